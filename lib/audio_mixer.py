@@ -1,10 +1,18 @@
+from lib.audio_store import *
 from lib.audio_utils import *
 from lib.collection_utils import *
+from lib.fx_cache import *
 from lib.io_utils import *
 from lib.math_utils import *
+from lib.processing_utils import *
+from multiprocessing import Pool
+import numpy as np
 import os
 from pydub import AudioSegment
+import queue
+import shutil
 import sys
+import tempfile
 
 def getAudioSequenceDuration(sequence):
     if len(sequence) <= 0:
@@ -13,7 +21,42 @@ def getAudioSequenceDuration(sequence):
     lastAudioClip = sequence[-1]
     return lastAudioClip["ms"] + lastAudioClip["dur"]
 
-def makeTrack(duration, instructions, segments, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000):
+def getFrameCount(duration, sampleRate=48000):
+    # the same number of frames as AudioSegment.silent(duration)
+    return int(sampleRate * (duration / 1000.0))
+
+def getTrackSegments(filename, instructions, sampleWidth=4, sampleRate=48000, channels=2, audioStore=None):
+    # load audio file; a store only reads the clips that are cut from it below
+    if audioStore is not None:
+        audio = audioStore.getAudio(filename)
+    else:
+        audio = getAudio(filename, sampleWidth, sampleRate, channels)
+    audioDurationMs = len(audio)
+
+    # look through instructions to find unique clips
+    clips = [(ii["start"], ii["dur"]) for ii in instructions if ii["filename"]==filename]
+    clips = list(set(clips))
+
+    # make segments from clips
+    segments = []
+    for clipStart, clipDur in clips:
+        clip = getAudioClip(audio, clipStart, clipDur, audioDurationMs)
+        if clip is None:
+            continue
+        segments.append({
+            "id": (clipStart, clipDur),
+            "start": clipStart,
+            "dur": clipDur,
+            "audio": clip
+        })
+    return segments
+
+def makeTrack(duration, instructions, segments, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000, mixer="pydub", fxCache=None, fxBackend="sox"):
+    if mixer == "numpy":
+        samples = np.zeros((getFrameCount(duration, sampleRate), channels), dtype=np.float32)
+        mixTrack(samples, instructions, segments, sfx=sfx, sampleRate=sampleRate, channels=channels, fxPad=fxPad, fxCache=fxCache, fxBackend=fxBackend)
+        return samplesToAudioSegment(samples, sampleWidth, sampleRate)
+
     # build audio
     baseAudio = AudioSegment.silent(duration=duration, frame_rate=sampleRate)
     baseAudio = baseAudio.set_channels(channels)
@@ -22,7 +65,7 @@ def makeTrack(duration, instructions, segments, sfx=True, sampleWidth=4, sampleR
     for index, i in enumerate(instructions):
         segment = [s for s in segments if s["id"]==(i["start"], i["dur"])].pop()
         audio = segment["audio"]
-        audio = applyAudioProperties(audio, i, sfx, fxPad)
+        audio = applyAudioProperties(audio, i, sfx, fxPad, fxBackend)
         # convert sample width
         if audio.sample_width != sampleWidth:
             # print("Warning: sample width changed to %s from %s" % (sampleWidth, audio.sample_width))
@@ -33,7 +76,7 @@ def makeTrack(duration, instructions, segments, sfx=True, sampleWidth=4, sampleR
         sys.stdout.flush()
     return baseAudio
 
-def mixAudio(instructions, duration, outfilename, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000, masterDb=0.0, outputTracks=False, tracksDir="output/tracks/%s.wav"):
+def mixAudio(instructions, duration, outfilename, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000, masterDb=0.0, outputTracks=False, tracksDir="output/tracks/%s.wav", mixer="pydub", audioStore=None, processes=1, trackBuffers=-1, fxCache=None, fxBackend="sox"):
     # remove instructions with no volume
     instructions = [i for i in instructions if "volume" not in i or i["volume"] > 0]
     audioFiles = list(set([i["filename"] for i in instructions]))
@@ -46,10 +89,17 @@ def mixAudio(instructions, duration, outfilename, sfx=True, sampleWidth=4, sampl
         if "volume" in step:
             instructions[i]["db"] = volumeToDb(step["volume"])
 
+    if mixer == "numpy" and processes > 1 and trackCount > 1:
+        mixAudioParallel(instructions, [af["filename"] for af in audioFiles], duration, outfilename, sfx, sampleWidth, sampleRate, channels, fxPad, masterDb, outputTracks, tracksDir, audioStore, processes, trackBuffers, fxCache, fxBackend)
+        return
+
     # create base audio
-    baseAudio = AudioSegment.silent(duration=duration, frame_rate=sampleRate)
-    baseAudio = baseAudio.set_channels(channels)
-    baseAudio = baseAudio.set_sample_width(sampleWidth)
+    if mixer == "numpy":
+        baseSamples = np.zeros((getFrameCount(duration, sampleRate), channels), dtype=np.float32)
+    else:
+        baseAudio = AudioSegment.silent(duration=duration, frame_rate=sampleRate)
+        baseAudio = baseAudio.set_channels(channels)
+        baseAudio = baseAudio.set_sample_width(sampleWidth)
 
     # Load sounds
     print("Adding tracks...")
@@ -57,38 +107,28 @@ def mixAudio(instructions, duration, outfilename, sfx=True, sampleWidth=4, sampl
         filename = af["filename"]
         audioFiles[i]["index"] = i
 
-        # load audio file
-        audio = getAudio(filename, sampleWidth, sampleRate, channels)
-        audioDurationMs = len(audio)
-
-        # look through instructions to find unique clips
-        clips = [(ii["start"], ii["dur"]) for ii in instructions if ii["filename"]==filename]
-        clips = list(set(clips))
-
-        # make segments from clips
-        segments = []
-        for clipStart, clipDur in clips:
-            clip = getAudioClip(audio, clipStart, clipDur, audioDurationMs)
-            if clip is None:
-                continue
-            segments.append({
-                "id": (clipStart, clipDur),
-                "start": clipStart,
-                "dur": clipDur,
-                "audio": clip
-            })
+        segments = getTrackSegments(filename, instructions, sampleWidth, sampleRate, channels, audioStore)
 
         # make the track
         trackInstructions = [ii for ii in instructions if ii["filename"]==af["filename"]]
         print("Making track %s of %s with %s segments and %s instructions..." % (i+1, trackCount, len(segments), len(trackInstructions)))
-        trackAudio = makeTrack(duration, trackInstructions, segments, sfx=sfx, sampleWidth=sampleWidth, sampleRate=sampleRate, channels=channels, fxPad=fxPad)
-        baseAudio = baseAudio.overlay(trackAudio)
+        if mixer == "numpy":
+            # mix straight into the base audio unless the track is written on its own too
+            trackSamples = np.zeros(baseSamples.shape, dtype=np.float32) if outputTracks else baseSamples
+            mixTrack(trackSamples, trackInstructions, segments, sfx=sfx, sampleRate=sampleRate, channels=channels, fxPad=fxPad, fxCache=fxCache, fxBackend=fxBackend)
+            if outputTracks:
+                baseSamples += trackSamples
+                trackAudio = samplesToAudioSegment(trackSamples, sampleWidth, sampleRate, db=masterDb)
+                trackSamples = None
+        else:
+            trackAudio = makeTrack(duration, trackInstructions, segments, sfx=sfx, sampleWidth=sampleWidth, sampleRate=sampleRate, channels=channels, fxPad=fxPad, mixer=mixer, fxBackend=fxBackend)
+            baseAudio = baseAudio.overlay(trackAudio)
+            # adjust master volume
+            if outputTracks and masterDb != 0.0:
+                trackAudio = trackAudio.apply_gain(masterDb)
         if outputTracks:
             trackfilename = tracksDir % getBasename(filename)
             format = trackfilename.split(".")[-1]
-            # adjust master volume
-            if masterDb != 0.0:
-                trackAudio = trackAudio.apply_gain(masterDb)
             trackAudio.export(trackfilename, format=format)
             print("Wrote to %s" % trackfilename)
         print("Track %s of %s complete." % (i+1, trackCount))
@@ -96,10 +136,121 @@ def mixAudio(instructions, duration, outfilename, sfx=True, sampleWidth=4, sampl
     print("Writing to file...")
     format = outfilename.split(".")[-1]
     # adjust master volume
-    if masterDb != 0.0:
+    if mixer == "numpy":
+        baseAudio = samplesToAudioSegment(baseSamples, sampleWidth, sampleRate, db=masterDb)
+        baseSamples = None
+    elif masterDb != 0.0:
         baseAudio = baseAudio.apply_gain(masterDb)
     f = baseAudio.export(outfilename, format=format)
     print("Wrote to %s" % outfilename)
+    if audioStore is not None:
+        print(audioStore.getStats())
+    if fxCache is not None:
+        print(fxCache.getStats())
+
+# renders tracks in a process pool, each into one of a fixed number of float32 buffer files so memory stays bounded
+# however many tracks there are; finished buffers are summed in pairs in the pool until only the mix is left
+def mixAudioParallel(instructions, filenames, duration, outfilename, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000, masterDb=0.0, outputTracks=False, tracksDir="output/tracks/%s.wav", audioStore=None, processes=2, trackBuffers=-1, fxCache=None, fxBackend="sox"):
+    trackCount = len(filenames)
+    shape = (getFrameCount(duration, sampleRate), channels)
+    # a buffer for each process to render into, plus one so a finished track can wait to be summed
+    bufferCount = max(2, trackBuffers if trackBuffers > 0 else processes + 1)
+    tmpDir = tempfile.mkdtemp(prefix="mix_")
+    bufferFilenames = [os.path.join(tmpDir, "buffer_%s.f32" % i) for i in range(bufferCount)]
+    freeBuffers = list(range(bufferCount))
+    finishedBuffers = []
+    pendingTracks = list(range(trackCount))
+
+    print("Mixing %s tracks with %s processes into %s buffers..." % (trackCount, processes, bufferCount))
+    pool = Pool(processes)
+    finished = queue.Queue()
+    inFlight = 0
+    completed = 0
+    while len(pendingTracks) > 0 or inFlight > 0 or len(finishedBuffers) > 1:
+        # sum finished tracks first, which frees a buffer for the next track
+        while len(finishedBuffers) > 1 and inFlight < processes:
+            a, b = (finishedBuffers.pop(0), finishedBuffers.pop(0))
+            pool.apply_async(sumTrackFiles, (bufferFilenames[a], bufferFilenames[b], shape), callback=(lambda result, a=a, b=b: finished.put((a, b, None))), error_callback=(lambda err: finished.put((None, None, err))))
+            inFlight += 1
+        while len(pendingTracks) > 0 and len(freeBuffers) > 0 and inFlight < processes:
+            i = pendingTracks.pop(0)
+            buffer = freeBuffers.pop(0)
+            filename = filenames[i]
+            trackInstructions = [ii for ii in instructions if ii["filename"]==filename]
+            trackFilename = tracksDir % getBasename(filename) if outputTracks else False
+            params = (filename, trackInstructions, bufferFilenames[buffer], shape, sfx, sampleWidth, sampleRate, channels, fxPad, masterDb, trackFilename, audioStore, fxCache, fxBackend)
+            pool.apply_async(mixTrackFile, params, callback=(lambda result, buffer=buffer: finished.put((buffer, None, None))), error_callback=(lambda err: finished.put((None, None, err))))
+            inFlight += 1
+        a, b, err = finished.get()
+        if err is not None:
+            pool.terminate()
+            shutil.rmtree(tmpDir)
+            raise err
+        inFlight -= 1
+        finishedBuffers.append(a)
+        if b is not None:
+            freeBuffers.append(b)
+        else:
+            completed += 1
+            printProgress(completed, trackCount)
+    pool.close()
+    pool.join()
+
+    print("\nWriting to file...")
+    format = outfilename.split(".")[-1]
+    samples = np.memmap(bufferFilenames[finishedBuffers[0]], dtype=np.float32, mode="r", shape=shape)
+    baseAudio = samplesToAudioSegment(samples, sampleWidth, sampleRate, db=masterDb)
+    samples = None
+    shutil.rmtree(tmpDir)
+    baseAudio.export(outfilename, format=format)
+    print("Wrote to %s" % outfilename)
+
+# adds each instruction's segment into float samples of shape (frames, channels) in place
+def mixTrack(samples, instructions, segments, sfx=True, sampleRate=48000, channels=2, fxPad=3000, verbose=True, fxCache=None, fxBackend="sox"):
+    segmentLookup = dict([(s["id"], s) for s in segments])
+    frameCount = len(samples)
+    instructionCount = len(instructions)
+    for index, i in enumerate(instructions):
+        segment = segmentLookup[(i["start"], i["dur"])]
+        if sfx and hasSoundFx(i) and fxCache is not None:
+            key, props = fxCache.getKey(getValue(i, "filename", ""), i["start"], i["dur"], i, fxPad, sampleRate, channels, fxBackend)
+            clipSamples = fxCache.get(key)
+            if clipSamples is None:
+                clipSamples = applyAudioPropertiesAsSamples(segment["audio"], props, sampleRate, channels, sfx, fxPad, fxBackend)
+                fxCache.set(key, clipSamples)
+        elif sfx and hasSoundFx(i):
+            clipSamples = applyAudioPropertiesAsSamples(segment["audio"], i, sampleRate, channels, sfx, fxPad, fxBackend)
+        else:
+            # segments are usually played many times, so only convert them once
+            if "samples" not in segment:
+                segment["samples"] = audioSegmentToSamples(segment["audio"], sampleRate, channels)
+                segment["levels"] = getSampleLevels(segment["samples"])
+            clipSamples = applyAudioPropertiesToSamples(segment["samples"], i, sampleRate, segment["levels"])
+        start = int(i["ms"] * (sampleRate / 1000.0))
+        if start < 0:
+            clipSamples = clipSamples[-start:]
+            start = 0
+        end = min(start + len(clipSamples), frameCount)
+        if start < end:
+            samples[start:end] += clipSamples[:end-start]
+        if verbose:
+            sys.stdout.write('\r')
+            sys.stdout.write("%s%%" % round(1.0*(index+1)/instructionCount*100,1))
+            sys.stdout.flush()
+
+# renders a track into a float32 buffer file for mixAudioParallel(), and writes it on its own if there's a track filename
+def mixTrackFile(filename, instructions, bufferFilename, shape, sfx=True, sampleWidth=4, sampleRate=48000, channels=2, fxPad=3000, masterDb=0.0, trackFilename=False, audioStore=None, fxCache=None, fxBackend="sox"):
+    samples = np.memmap(bufferFilename, dtype=np.float32, mode="r+" if os.path.isfile(bufferFilename) else "w+", shape=shape)
+    # buffers are reused once their track has been summed
+    samples[:] = 0
+    segments = getTrackSegments(filename, instructions, sampleWidth, sampleRate, channels, audioStore)
+    mixTrack(samples, instructions, segments, sfx=sfx, sampleRate=sampleRate, channels=channels, fxPad=fxPad, verbose=False, fxCache=fxCache, fxBackend=fxBackend)
+    samples.flush()
+    if trackFilename:
+        trackAudio = samplesToAudioSegment(samples, sampleWidth, sampleRate, db=masterDb)
+        trackAudio.export(trackFilename, format=trackFilename.split(".")[-1])
+    samples = None
+    return True
 
 def plotAudioSequence(seq):
     import matplotlib.pyplot as plt
@@ -122,3 +273,14 @@ def plotAudioSequence(seq):
     ax.set_xlabel("time [minutes]")
     plt.tight_layout()
     plt.show()
+
+# adds the samples in one float32 buffer file to another, in blocks so neither has to be read into memory at once
+def sumTrackFiles(filename, addFilename, shape, blockSize=1048576):
+    samples = np.memmap(filename, dtype=np.float32, mode="r+", shape=shape)
+    addSamples = np.memmap(addFilename, dtype=np.float32, mode="r", shape=shape)
+    for i in range(0, shape[0], blockSize):
+        samples[i:i+blockSize] += addSamples[i:i+blockSize]
+    samples.flush()
+    samples = None
+    addSamples = None
+    return True
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+# An audio store keeps decoded audio in a directory as raw PCM files, one per source file, at the sample rate, sample
+# width, and channels the mixer uses. Files are named by a hash of the source path, its modification time and size,
+# and the format, so an edited source or a different format is decoded again instead of read stale. Reads are
+# memory-mapped, so cutting a clip out of a long source only reads that clip from disk. Least recently used files are
+# removed once the directory is over its size budget.
+
+from lib.audio_utils import *
+import hashlib
+import numpy as np
+import os
+from pydub import AudioSegment
+
+class AudioStore:
+
+    def __init__(self, directory="tmp/cache/audio/", maxBytes=4000000000, sampleRate=48000, channels=2):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.sampleRate = sampleRate
+        # getAudio() always decodes at 16-bit
+        self.sampleWidth = 2
+        self.channels = channels
+        self.samples = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # stores are passed to mixing processes, which map the files themselves
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["samples"] = {}
+        return state
+
+    def evict(self, keep=None):
+        files = []
+        for fn in os.listdir(self.directory):
+            fn = os.path.join(self.directory, fn)
+            # other processes sharing the store may remove files at any point
+            try:
+                if fn.endswith(".pcm"):
+                    files.append((os.path.getmtime(fn), os.path.getsize(fn), fn))
+            except OSError:
+                continue
+        totalBytes = sum([size for mtime, size, fn in files])
+        for mtime, size, fn in sorted(files):
+            if totalBytes <= self.maxBytes:
+                break
+            if fn == keep:
+                continue
+            try:
+                os.remove(fn)
+                self.evictions += 1
+            except OSError:
+                pass
+            totalBytes -= size
+
+    # audio that can be cut into clips like an AudioSegment, without reading the rest of the file
+    def getAudio(self, filename, verbose=True):
+        return StoredAudio(self.getSamples(filename, verbose), self.sampleRate, self.sampleWidth)
+
+    def getFilename(self, filename):
+        return os.path.join(self.directory, self.getKey(filename) + ".pcm")
+
+    def getKey(self, filename):
+        filename = os.path.abspath(filename)
+        key = "%s|%s|%s|%s|%s|%s" % (filename, os.path.getmtime(filename), os.path.getsize(filename), self.sampleRate, self.sampleWidth, self.channels)
+        return hashlib.md5(key.encode("utf8")).hexdigest()
+
+    # returns memory-mapped int16 samples of shape (frames, channels), decoding the file first if it isn't stored yet
+    def getSamples(self, filename, verbose=True):
+        pcmFilename = self.getFilename(filename)
+        if pcmFilename in self.samples:
+            self.hits += 1
+            return self.samples[pcmFilename]
+        if os.path.isfile(pcmFilename):
+            self.hits += 1
+            # mark as recently used
+            os.utime(pcmFilename)
+        else:
+            self.misses += 1
+            self.write(pcmFilename, getAudio(filename, self.sampleWidth, self.sampleRate, self.channels, verbose=verbose))
+        if os.path.getsize(pcmFilename) > 0:
+            samples = np.memmap(pcmFilename, dtype=np.int16, mode="r").reshape(-1, self.channels)
+        else:
+            samples = np.zeros((0, self.channels), dtype=np.int16)
+        self.samples[pcmFilename] = samples
+        return samples
+
+    def getStats(self):
+        return "Audio store: %s hits, %s misses, %s evictions" % (self.hits, self.misses, self.evictions)
+
+    def write(self, pcmFilename, audio):
+        # write to a temporary file first so other processes never read a partial file
+        tmpFilename = pcmFilename + ".%s.tmp" % os.getpid()
+        with open(tmpFilename, "wb") as f:
+            f.write(audio.raw_data)
+        os.replace(tmpFilename, pcmFilename)
+        self.evict(keep=pcmFilename)
+
+# supports len() and [start:end] slicing in milliseconds like an AudioSegment, e.g. for getAudioClip()
+class StoredAudio:
+
+    def __init__(self, samples, sampleRate, sampleWidth):
+        self.samples = samples
+        self.sampleRate = sampleRate
+        self.sampleWidth = sampleWidth
+
+    def __getitem__(self, ms):
+        start = ms.start if ms.start is not None else 0
+        end = ms.stop if ms.stop is not None else len(self)
+        # the same frame math as AudioSegment slicing
+        start = int(min(start, len(self)) * (self.sampleRate / 1000.0))
+        end = int(min(end, len(self)) * (self.sampleRate / 1000.0))
+        samples = self.samples[start:end]
+        return AudioSegment(data=samples.tobytes(), sample_width=self.sampleWidth, frame_rate=self.sampleRate, channels=samples.shape[1])
+
+    def __len__(self):
+        return int(round(1000.0 * len(self.samples) / self.sampleRate))
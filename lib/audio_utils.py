@@ -13,10 +13,14 @@ import pydub
 from pydub import AudioSegment
 from pysndfx import AudioEffectsChain
 import re
+from scipy import signal
 import subprocess
 import sys
 
-def addFx(sound, effects, pad=3000, fade_in=100, fade_out=100):
+def addFx(sound, effects, pad=3000, fade_in=100, fade_out=100, backend="sox"):
+    if backend == "scipy":
+        return addFxScipy(sound, effects, pad, fade_in, fade_out)
+
     # Add padding
     if pad > 0:
         sound += AudioSegment.silent(duration=pad, frame_rate=sound.frame_rate)
@@ -67,6 +71,67 @@ def addFx(sound, effects, pad=3000, fade_in=100, fade_out=100):
     newSound = newSound.fade_in(min(fade_in, dur)).fade_out(min(fade_out, dur))
     return newSound
 
+# the same effects as addFx() with the same parameters, but processed in this process with NumPy/SciPy instead of
+# piping each clip through a sox process; every effect follows the sox effect it replaces (biquads from the same
+# cookbook formulas, sox's overdrive curve and echo taps, and the freeverb network behind sox's reverb), though tempo
+# uses librosa's phase vocoder instead of sox's WSOLA
+def addFxScipy(sound, effects, pad=3000, fade_in=100, fade_out=100):
+    sampleRate = sound.frame_rate
+    samples = addFxToSamples(audioSegmentToSamples(sound), effects, pad, fade_in, fade_out, sampleRate)
+    return samplesToAudioSegment(samples, sound.sample_width, sampleRate)
+
+# addFxScipy() on float samples of shape (frames, channels), returning float32 samples; the fades are a gain per frame
+def addFxToSamples(samples, effects, pad=3000, fadeIn=100, fadeOut=100, sampleRate=48000):
+    samples = samples.astype(np.float64)
+    if pad > 0:
+        samples = np.concatenate((samples, np.zeros((int(pad * sampleRate / 1000), samples.shape[1]))))
+
+    for effect, value in effects:
+        if effect == "reverb" and value > 0:
+            samples = applyReverb(samples, value, sampleRate=sampleRate)
+        elif effect == "distortion" and value > 0:
+            # sox overdrive with the default colour of 20
+            gain = 10.0 ** (value / 20.0)
+            d = samples * gain + 0.1
+            d = np.where(d < -1, -2.0/3, np.where(d > 1, 2.0/3, d - d * d * d / 3.0))
+            # sox blocks the dc offset of the shaped signal before mixing it with the dry signal
+            samples = samples * 0.5 + filterSamples([1.0, -1.0], [1.0, -0.995], d) * 0.75
+        elif effect == "highpass" and value > 0:
+            b, a = getBiquad("highpass", value, sampleRate)
+            samples = filterSamples(b, a, samples)
+        elif effect == "lowpass" and value > 0:
+            b, a = getBiquad("lowpass", value, sampleRate)
+            samples = filterSamples(b, a, samples)
+        elif effect == "bass":
+            frequency = 100
+            gain = value
+            if isinstance(value, tuple):
+                gain, frequency = value
+            b, a = getBiquad("highshelf", frequency, sampleRate, gain=gain)
+            samples = filterSamples(b, a, samples)
+        elif effect == "echo":
+            amount = value
+            count = 1
+            if isinstance(value, tuple):
+                amount, count = value
+            # like the sox command addFx() builds: gain in of 0.8, gain out of 0.9, and a tap with a decay of 0.3 for
+            # each echo, all at the same delay
+            delay = min(roundInt(amount / 1000.0 * sampleRate), len(samples))
+            echoed = samples * 0.8
+            echoed[delay:] += samples[:len(samples)-delay] * 0.3 * count
+            samples = echoed * 0.9
+        elif effect == "tempo" and value != 1.0 and value != 1:
+            samples = librosa.effects.time_stretch(np.ascontiguousarray(samples.T), rate=value).T
+
+    samples = samples.astype(np.float32)
+    frameCount = len(samples)
+    dur = int(round(1000.0 * frameCount / sampleRate))
+    if fadeIn > 0:
+        samples *= getFadeGains(frameCount, min(fadeIn, dur), sampleRate, fadeIn=True).reshape(-1, 1)
+    if fadeOut > 0:
+        samples *= getFadeGains(frameCount, min(fadeOut, dur), sampleRate, fadeIn=False).reshape(-1, 1)
+    return samples
+
 def analyzeAudio(fn, start=0, dur=250, findSamples=False):
     y, sr = loadAudioData(fn)
     if findSamples:
@@ -86,7 +151,8 @@ def analyzeAudio(fn, start=0, dur=250, findSamples=False):
     bandwidth = scaleAudioData(librosa.feature.spectral_bandwidth(y=y, sr=sr))
     return np.asarray([centroid, bandwidth])
 
-def applyAudioProperties(audio, props, sfx=True, fxPad=3000):
+# fx=False applies everything but the sound fx (see applyAudioPropertiesAsSamples())
+def applyAudioProperties(audio, props, sfx=True, fxPad=3000, fxBackend="sox", fx=True):
     p = props
     if "matchDb" in p and p["matchDb"] > -9999:
         maxMatchDb = p["maxMatchDb"] if "maxMatchDb" in p else -1
@@ -110,14 +176,81 @@ def applyAudioProperties(audio, props, sfx=True, fxPad=3000):
         elif "stretchTo" in p and p["stretchTo"] > p["dur"]:
             stretchAmount = 1.0 * p["stretchTo"] / p["dur"]
             audio = stretchSound(audio, stretchAmount)
-        effects = []
-        for effect in ["reverb", "distortion", "highpass", "lowpass", "bass", "echo", "tempo"]:
-            if effect in p and p[effect] != "":
-                effects.append((effect, p[effect]))
-        if len(effects) > 0:
-            audio = addFx(audio, effects, pad=fxPad)
+        effects = getSoundFx(p)
+        if len(effects) > 0 and fx:
+            audio = addFx(audio, effects, pad=fxPad, backend=fxBackend)
     return audio
 
+# applyAudioProperties(), returning float samples of shape (frames, channels); with the scipy backend, the sound fx are
+# applied to the samples directly instead of converting to an AudioSegment and back
+def applyAudioPropertiesAsSamples(audio, props, sampleRate=48000, channels=2, sfx=True, fxPad=3000, fxBackend="sox"):
+    if not sfx or fxBackend != "scipy":
+        return audioSegmentToSamples(applyAudioProperties(audio, props, sfx, fxPad, fxBackend), sampleRate, channels)
+    audio = applyAudioProperties(audio, props, sfx, fxPad, fxBackend, fx=False)
+    samples = audioSegmentToSamples(audio, sampleRate, channels)
+    effects = getSoundFx(props)
+    if len(effects) > 0:
+        samples = addFxToSamples(samples, effects, fxPad, sampleRate=sampleRate)
+    return samples
+
+# applies the same properties as applyAudioProperties (except sound fx) to float samples of shape (frames, channels):
+# volume changes become one gain per channel and fades become a gain per frame, so the whole clip is multiplied once
+def applyAudioPropertiesToSamples(samples, props, sampleRate=48000, levels=None):
+    p = props
+    rms, peak = levels if levels is not None else getSampleLevels(samples)
+    frameCount, channels = samples.shape
+    db = 0.0
+    if "matchDb" in p and p["matchDb"] > -9999:
+        targetDb = p["matchDb"]
+        maxMatchDb = p["maxMatchDb"] if "maxMatchDb" in p else -1
+        targetDb = min(targetDb, maxMatchDb)
+        level = peak if "useMaxDBFS" in p else rms
+        if level > 0:
+            db += targetDb - 20.0 * math.log10(level)
+    if "maxDb" in p and p["maxDb"] > -9999 and rms > 0:
+        deltaDb = p["maxDb"] - (20.0 * math.log10(rms) + db)
+        if deltaDb < 0:
+            db += deltaDb
+    if "reverse" in p and p["reverse"]:
+        # pydub reverses the interleaved samples, which swaps the channels too
+        samples = samples[::-1, ::-1]
+    if "db" in p and p["db"] != 0.0:
+        db += p["db"]
+    channelGains = np.full(channels, 10.0 ** (db / 20.0))
+    if "pan" in p and p["pan"] != 0.0 and channels == 2:
+        # same as pydub: up to +3dB on one side and down to silence on the other
+        pan = lim(p["pan"], (-1.0, 1.0))
+        boost = 2.0 ** (abs(pan) * 0.5)
+        reduce = 2.0 - 2.0 ** abs(pan)
+        channelGains *= np.array([boost, reduce] if pan < 0 else [reduce, boost])
+    samples = samples * channelGains.astype(np.float32)
+    frameGains = None
+    if "fadeIn" in p and p["fadeIn"] > 0:
+        frameGains = getFadeGains(frameCount, p["fadeIn"], sampleRate, fadeIn=True)
+    if "fadeOut" in p and p["fadeOut"] > 0:
+        fadeOutGains = getFadeGains(frameCount, p["fadeOut"], sampleRate, fadeIn=False)
+        frameGains = fadeOutGains if frameGains is None else frameGains * fadeOutGains
+    if frameGains is not None:
+        samples *= frameGains.reshape(-1, 1)
+    return samples
+
+# sox's reverb: the dry signal plus a wet signal that is the pre-delayed input through the reverb's impulse responses,
+# so each clip only costs an fft convolution; like sox, stereo input is reverbed as a mix of both channels
+def applyReverb(samples, reverberance=50, hfDamping=50, roomScale=100, stereoDepth=100, preDelay=20, wetGain=0, sampleRate=48000):
+    frameCount, channels = samples.shape
+    delay = roundInt(preDelay / 1000.0 * sampleRate)
+    if frameCount <= delay:
+        return samples
+    responses = getReverbResponse(frameCount - delay, reverberance, hfDamping, roomScale, stereoDepth, wetGain, sampleRate)
+    output = samples.copy()
+    if channels == 2:
+        dry = (samples[:frameCount-delay, 0] + samples[:frameCount-delay, 1]) * 0.5
+        output[delay:] += signal.fftconvolve(dry.reshape(-1, 1), responses, axes=0)[:frameCount-delay]
+        return output
+    for channel in range(channels):
+        output[delay:, channel] += signal.fftconvolve(samples[:frameCount-delay, channel], responses[:, min(channel, 1)])[:frameCount-delay]
+    return output
+
 def audioFingerprintsToImage(fingerprints, filename, cols, rows, width, height, bgcolors=None):
     pixels = np.zeros((height, width), dtype=np.uint8)
     bgpixels = None
@@ -151,7 +284,33 @@ def audioFingerprintsToImage(fingerprints, filename, cols, rows, width, height,
 
 # Note: sample_width -> bit_depth conversions: 1->8, 2->16, 3->24, 4->32
 # 24/32 bit depth and 48K sample rates are industry standards
-def getAudio(filename, sampleWidth=4, sampleRate=48000, channels=2, verbose=True):
+# returns float32 samples of shape (frames, channels) between -1 and 1
+def audioSegmentToSamples(audio, sampleRate=None, channels=None):
+    if channels is not None and audio.channels != channels:
+        audio = audio.set_channels(channels)
+    if sampleRate is not None and audio.frame_rate != sampleRate:
+        audio = audio.set_frame_rate(sampleRate)
+    data = audio.raw_data
+    sampleWidth = audio.sample_width
+    # numpy has no 24-bit type
+    if sampleWidth == 3:
+        data = audioop.lin2lin(data, 3, 4)
+        sampleWidth = 4
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[sampleWidth]
+    samples = np.frombuffer(data, dtype=dtype).reshape(-1, audio.channels)
+    return samples.astype(np.float32) * np.float32(1.0 / 2 ** (8 * sampleWidth - 1))
+
+# runs an iir filter over float samples of shape (frames, channels); a -360db signal at dc and nyquist is added first,
+# since without it the filter state decays into denormal floats over the silent padding, which are many times slower
+def filterSamples(b, a, samples):
+    offset = np.zeros((len(samples), 1))
+    offset[::2] = 1e-18
+    return signal.lfilter(b, a, samples + offset, axis=0)
+
+def getAudio(filename, sampleWidth=4, sampleRate=48000, channels=2, verbose=True, audioStore=None):
+    # read already decoded audio from the store (in the store's format) if there is one
+    if audioStore is not None:
+        return audioStore.getAudio(filename, verbose)[:]
     # A hack: always read files at 16-bit depth because Sox does not support more than that
     sampleWidth = 2
     audiofilename = getAudioFile(filename)
@@ -289,6 +448,26 @@ def getAudioSimilarity(test, references):
         sumValue += refDistance
     return 1.0 * sumValue / refCount
 
+# returns the (b, a) coefficients of a lowpass, highpass, or highshelf biquad from the audio eq cookbook, as sox
+# designs them
+def getBiquad(filterType, frequency, sampleRate=48000, q=0.707, gain=0.0, slope=0.5):
+    w0 = 2.0 * math.pi * frequency / sampleRate
+    cosw0 = math.cos(w0)
+    alpha = math.sin(w0) / (2.0 * q)
+    if filterType == "lowpass":
+        b = [(1.0 - cosw0) / 2.0, 1.0 - cosw0, (1.0 - cosw0) / 2.0]
+        a = [1.0 + alpha, -2.0 * cosw0, 1.0 - alpha]
+    elif filterType == "highpass":
+        b = [(1.0 + cosw0) / 2.0, -(1.0 + cosw0), (1.0 + cosw0) / 2.0]
+        a = [1.0 + alpha, -2.0 * cosw0, 1.0 - alpha]
+    else:
+        A = 10.0 ** (gain / 40.0)
+        alpha = math.sin(w0) / 2.0 * math.sqrt((A + 1.0 / A) * (1.0 / slope - 1.0) + 2.0)
+        sqrtA2alpha = 2.0 * math.sqrt(A) * alpha
+        b = [A * ((A + 1.0) + (A - 1.0) * cosw0 + sqrtA2alpha), -2.0 * A * ((A - 1.0) + (A + 1.0) * cosw0), A * ((A + 1.0) + (A - 1.0) * cosw0 - sqrtA2alpha)]
+        a = [(A + 1.0) - (A - 1.0) * cosw0 + sqrtA2alpha, 2.0 * ((A - 1.0) - (A + 1.0) * cosw0), (A + 1.0) - (A - 1.0) * cosw0 - sqrtA2alpha]
+    return (np.array(b) / a[0], np.array(a) / a[0])
+
 def getDurationFromAudioData(y, sr):
     ylen = len(y)
     return 1.0 * ylen / sr
@@ -311,6 +490,30 @@ def getDurationFromAudioFile(fn, accurate=False):
             duration = float(duration)
     return duration
 
+# returns the gain of each frame for a fade in/out of duration ms, stepped the same way as pydub's AudioSegment.fade:
+# one step per ms for fades over 100ms, otherwise one step per frame
+def getFadeGains(frameCount, duration, sampleRate=48000, fadeIn=True):
+    gains = np.ones(frameCount, dtype=np.float32)
+    silence = 10.0 ** (-120.0 / 20.0)
+    fromGain, toGain = (silence, 1.0) if fadeIn else (1.0, silence)
+    durationMs = int(round(1000.0 * frameCount / sampleRate))
+    start = 0 if fadeIn else max(0, durationMs - duration)
+    framesPerMs = sampleRate / 1000.0
+    startFrame = int(start * framesPerMs)
+    if duration > 100:
+        edges = ((start + np.arange(duration + 1)) * framesPerMs).astype(int)
+        steps = fromGain + (toGain - fromGain) / duration * np.arange(duration)
+        ramp = np.repeat(steps, np.diff(edges))
+    else:
+        fadeFrames = int((start + duration) * framesPerMs) - startFrame
+        ramp = fromGain + (toGain - fromGain) / max(fadeFrames, 1) * np.arange(fadeFrames)
+    ramp = ramp[:max(0, frameCount - startFrame)]
+    endFrame = startFrame + len(ramp)
+    gains[:startFrame] = fromGain
+    gains[startFrame:endFrame] = ramp
+    gains[endFrame:] = toGain
+    return gains
+
 def getFeatures(y, sr, start, dur=100, fft=2048, hop_length=512):
     if dur <= 0:
         return {
@@ -496,9 +699,86 @@ def getPowerFromTimecodes(timecodes, method="max"):
             powerData[t["index"]] = power
     return powerData
 
+# impulse responses of the reverb, keyed by their parameters
+reverbResponses = {}
+
+# returns the impulse responses of shape (frames, 2) of sox's reverb network (freeverb): eight damped comb filters in
+# parallel then four allpass filters in series, with the filter lengths offset by the stereo depth for the second
+# response; they're run on an impulse one filter length at a time, so each filter only needs a loop per block
+def getReverbResponse(frameCount, reverberance=50, hfDamping=50, roomScale=100, stereoDepth=100, wetGain=0, sampleRate=48000):
+    key = (reverberance, hfDamping, roomScale, stereoDepth, wetGain, sampleRate)
+    if key in reverbResponses and len(reverbResponses[key]) >= frameCount:
+        return reverbResponses[key][:frameCount]
+    # compute whole seconds so slightly longer clips can use the same responses
+    responseCount = int(math.ceil(1.0 * frameCount / sampleRate)) * sampleRate
+    combLengths = [1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617]
+    allpassLengths = [225, 341, 441, 556]
+    scale = roomScale / 100.0 * 0.9 + 0.1
+    a = -1.0 / math.log(1.0 - 0.3)
+    b = 100.0 / (math.log(1.0 - 0.98) * a + 1.0)
+    feedback = 1.0 - math.exp((reverberance - b) / (a * b))
+    damping = hfDamping / 100.0 * 0.3 + 0.2
+    gain = 10.0 ** (wetGain / 20.0) * 0.015
+    r = sampleRate / 44100.0
+    impulse = np.zeros(responseCount)
+    impulse[0] = 1.0
+    responses = np.zeros((responseCount, 2), dtype=np.float32)
+    for i, offset in enumerate([0.0, stereoDepth / 100.0]):
+        if i > 0 and offset == 0:
+            responses[:, i] = responses[:, 0]
+            continue
+        combed = np.zeros(responseCount)
+        for j, length in enumerate(combLengths):
+            size = int(scale * r * (length + 12 * offset * (-1) ** j) + 0.5)
+            buf = np.zeros(size)
+            store = 0.0
+            for k in range(0, responseCount, size):
+                x = impulse[k:k+size]
+                out = buf[:len(x)]
+                combed[k:k+size] += out
+                stored, _zf = signal.lfilter([1.0 - damping], [1.0, -damping], out, zi=[damping * store])
+                store = stored[-1]
+                buf = x + stored * feedback
+        for j, length in enumerate(allpassLengths):
+            size = int(r * (length + 12 * offset * (-1) ** j) + 0.5)
+            buf = np.zeros(size)
+            allpassed = np.zeros(responseCount)
+            for k in range(0, responseCount, size):
+                x = combed[k:k+size]
+                out = buf[:len(x)]
+                allpassed[k:k+size] = out - x
+                buf = x + out * 0.5
+            combed = allpassed
+        responses[:, i] = combed * gain
+    # a render with many different reverbs keeps only the latest
+    if len(reverbResponses) >= 32 and key not in reverbResponses:
+        reverbResponses.pop(next(iter(reverbResponses)))
+    reverbResponses[key] = responses
+    return responses[:frameCount]
+
+# returns the RMS and peak amplitude of float samples, i.e. the dBFS and max dBFS of pydub before the log
+def getSampleLevels(samples):
+    if samples.size < 1:
+        return (0.0, 0.0)
+    rms = math.sqrt(np.mean(np.square(samples, dtype=np.float64)))
+    peak = float(np.max(np.abs(samples)))
+    return (rms, peak)
+
+# the (effect, value) pairs for addFx() in a clip's properties
+def getSoundFx(props):
+    p = props
+    return [(effect, p[effect]) for effect in ["reverb", "distortion", "highpass", "lowpass", "bass", "echo", "tempo"] if effect in p and p[effect] != ""]
+
 def getStft(y, n_fft=2048, hop_length=512):
     return librosa.feature.rmse(S=librosa.stft(y, n_fft=n_fft, hop_length=hop_length))[0]
 
+# returns True if applyAudioProperties would stretch the audio or run it through sound fx
+def hasSoundFx(props):
+    p = props
+    if "stretch" in p and p["stretch"] > 1.0 or "stretchTo" in p and p["stretchTo"] > p["dur"]:
+        return True
+    return len(getSoundFx(p)) > 0
+
 def loadAudioData(fn, sr=None):
     return librosa.load(fn, sr=sr)
 
@@ -695,6 +975,23 @@ def pitchToNote(hz):
         pass
     return note
 
+# converts float samples of shape (frames, channels) to audio with a sample width in bytes; this is the only place
+# the mix is quantized, and it's done in blocks so a long track never needs a float64 copy of the whole buffer
+def samplesToAudioSegment(samples, sampleWidth=4, sampleRate=48000, db=0.0, blockSize=1048576):
+    frameCount, channels = samples.shape
+    convertWidth = 4 if sampleWidth == 3 else sampleWidth
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[convertWidth]
+    maxAmplitude = 2 ** (8 * convertWidth - 1)
+    gain = 10.0 ** (db / 20.0) * maxAmplitude
+    data = np.zeros((frameCount, channels), dtype=dtype)
+    for i in range(0, frameCount, blockSize):
+        block = np.round(samples[i:i+blockSize].astype(np.float64) * gain)
+        data[i:i+blockSize] = np.clip(block, -maxAmplitude, maxAmplitude-1)
+    data = data.tobytes()
+    if sampleWidth == 3:
+        data = audioop.lin2lin(data, 4, 3)
+    return AudioSegment(data=data, sample_width=sampleWidth, frame_rate=sampleRate, channels=channels)
+
 def scaleAudioData(arr):
     # get the average
     avg = np.average(arr)
@@ -33,10 +33,11 @@ def saveCacheFile(fn, data, overwrite=False, compressed=True):
         fn += ".bz2"
     if not os.path.isfile(fn) or overwrite:
         print("Saving cache file %s..." % fn)
-        if compressed:
-            pickle.dump(data, bz2.open(fn, 'wb'))
-        else:
-            pickle.dump(data, open(fn, 'wb'))
+        # write to a temporary file first so other processes never read a partial file
+        tmpFn = fn + ".%s.tmp" % os.getpid()
+        with (bz2.open(tmpFn, 'wb') if compressed else open(tmpFn, 'wb')) as f:
+            pickle.dump(data, f)
+        os.replace(tmpFn, fn)
     else:
         print("Already exists %s" % fn)
     return True
@@ -1,3 +1,4 @@
+import bisect
 from multiprocessing import Pool
 from multiprocessing.dummy import Pool as ThreadPool
 
@@ -29,6 +30,8 @@ class Vector:
         self.pos = [0.0, 0.0, 0.0]
         self.size = [100.0, 100.0]
         self.keyframes = []
+        self.tracks = {}
+        self.tracksKeyframeCount = 0
 
         # for caching
         self.cache = defaults["cache"]
@@ -68,6 +71,7 @@ class Vector:
             keyframe.update({"name": "pos", "dimension": 1})
 
         self.keyframes.append(keyframe)
+        self.tracks = {}
         if sortFrames:
             self.sortFrames()
 
@@ -134,29 +138,23 @@ class Vector:
             return value
 
         # retrieve keyframes for this property
-        keyframes = [k for k in self.keyframes if k["name"]==name and (k["dimension"]==dimension or k["dimension"] is None or dimension is None)]
+        track = self.getTrack(name, dimension)
+        keyframes = track["keyframes"]
         kcount = len(keyframes)
 
-        # assuming keyframes are sorted
-        for i, kf in enumerate(keyframes):
+        if kcount > 0:
+            i = self.getTrackIndex(track, ms)
             # we're after the last frame, just take the last frame's value
-            if i >= kcount-1 and ms >= kf["ms"]:
-                value = kf["value"]
-                break
-            # we just passed the current ms
-            elif kf["ms"] > ms:
-
-                # we're before the first keyframe, just take the first keyframe value
-                if i <= 0:
-                    value = kf["value"]
-                    break
-
-                # lerp between the current and previous keyframe
+            if i >= kcount:
+                value = keyframes[-1]["value"]
+            # we're before the first keyframe, just take the first keyframe value
+            elif i <= 0:
+                value = keyframes[0]["value"]
+            # lerp between the current and previous keyframe
+            else:
                 kf0 = keyframes[i-1]
-                fromValue = kf0["value"]
-                toValue = kf["value"]
-                value = lerpEase((fromValue, toValue), norm(ms, (kf0["ms"], kf["ms"])), kf["easing"])
-                break
+                kf = keyframes[i]
+                value = lerpEase((kf0["value"], kf["value"]), norm(ms, (kf0["ms"], kf["ms"])), kf["easing"])
 
         if self.cache:
             self.cacheProps[nameKey] = value
@@ -179,6 +177,40 @@ class Vector:
         }
         return props
 
+    # a track is the keyframes that apply to a property, in list order
+    def getTrack(self, name, dimension=None):
+        # rebuild tracks if keyframes were changed
+        if self.tracksKeyframeCount != len(self.keyframes):
+            self.tracks = {}
+            self.tracksKeyframeCount = len(self.keyframes)
+
+        key = (name, dimension)
+        if key not in self.tracks:
+            keyframes = [k for k in self.keyframes if k["name"]==name and (k["dimension"]==dimension or k["dimension"] is None or dimension is None)]
+            # running max of keyframe times, so keyframes that are out of order behave like a linear scan
+            runningMaxTimes = []
+            for kf in keyframes:
+                runningMaxTimes.append(kf["ms"] if len(runningMaxTimes) < 1 else max(runningMaxTimes[-1], kf["ms"]))
+            self.tracks[key] = {"keyframes": keyframes, "times": runningMaxTimes, "cursor": 0}
+        return self.tracks[key]
+
+    # index of the first keyframe that's after ms
+    def getTrackIndex(self, track, ms):
+        times = track["times"]
+        count = len(times)
+        i = track["cursor"]
+        # frames are usually rendered in order, so check the last position and the next one before searching
+        for step in range(2):
+            if (i <= 0 or times[i-1] <= ms) and (i >= count or times[i] > ms):
+                track["cursor"] = i
+                return i
+            if i >= count or times[i] > ms:
+                break
+            i += 1
+        i = bisect.bisect_right(times, ms)
+        track["cursor"] = i
+        return i
+
     def getRotation(self, ms=None):
         return self.getPropValue("rotation", ms=ms)
 
@@ -288,6 +320,7 @@ class Vector:
 
     def sortFrames(self):
         self.keyframes = sorted(self.keyframes, key=lambda k: k["ms"])
+        self.tracks = {}
 
     def toDict(self, ms):
         return {
@@ -297,6 +330,65 @@ class Vector:
             "scale": (self.getPropValue("scale", 0, ms), self.getPropValue("scale", 1, ms))
         }
 
+class PlayIndex:
+
+    def __init__(self, plays):
+        self.plays = plays
+        self.count = len(plays)
+        self.starts = [p[0] for p in plays]
+        # plays are usually queued in order; if not, active plays are found with a scan
+        self.isSorted = all(self.starts[i] <= self.starts[i+1] for i in range(self.count-1))
+        # running max of play ends: the first play in list order that hasn't ended yet
+        self.runningMaxEnds = []
+        for p in plays:
+            self.runningMaxEnds.append(p[1] if len(self.runningMaxEnds) < 1 else max(self.runningMaxEnds[-1], p[1]))
+        # midpoints sorted, with ties kept in list order
+        midpoints = sorted([(lerp((p[0], p[1]), 0.5), i) for i, p in enumerate(plays)])
+        self.midpoints = [m[0] for m in midpoints]
+        self.midpointIndices = [m[1] for m in midpoints]
+
+    def getActivePlay(self, ms):
+        if not self.isSorted:
+            plays = [t for t in self.plays if t[0] <= ms <= t[1]]
+            return plays[0] if len(plays) > 0 else None
+        startedCount = bisect.bisect_right(self.starts, ms)
+        i = bisect.bisect_left(self.runningMaxEnds, ms)
+        return self.plays[i] if i < startedCount else None
+
+    def getClosestPlay(self, ms):
+        right = bisect.bisect_right(self.midpoints, ms)
+        left = right - 1
+        if left < 0:
+            return self.plays[self.midpointIndices[right]]
+        # the first of any plays sharing the left midpoint
+        left = bisect.bisect_left(self.midpoints, self.midpoints[left])
+        leftIndex = self.midpointIndices[left]
+        if right >= self.count:
+            return self.plays[leftIndex]
+        rightIndex = self.midpointIndices[right]
+        leftDistance = abs(ms - self.midpoints[left])
+        rightDistance = abs(ms - self.midpoints[right])
+        if leftDistance < rightDistance or leftDistance == rightDistance and leftIndex < rightIndex:
+            return self.plays[leftIndex]
+        return self.plays[rightIndex]
+
+    # the start of the play that determines the clip time at ms; see Clip.getClipTime()
+    def getPlayStart(self, ms, initialOffset=0):
+        if self.count <= 0:
+            return initialOffset
+
+        # check if we are playing this clip at this time
+        play = self.getActivePlay(ms)
+        if play is not None:
+            return play[0]
+
+        # otherwise, find the closest play
+        start, end, params = self.getClosestPlay(ms)
+        # if we are before the first play or after the last one, set to initial offset for continuity between compositions
+        if ms < self.plays[0][0] or ms > self.plays[-1][1]:
+            start = initialOffset
+        return start
+
 class Clip:
 
     npProperties = [("x", "f"), ("y", "f"), ("width", "f"), ("height", "f"), ("alpha", "f"), ("tn", "f"), ("zindex", "i"), ("rotation", "f"), ("blur", "f"), ("brightness", "f")]
@@ -326,6 +418,8 @@ class Clip:
         self.dur = defaults["dur"]
         self.plays = defaults["plays"]
         self.initialOffset = defaults["initialOffset"]
+        self.playIndex = None
+        self.playSchedule = {}
 
         if self.dur <= 0 and self.filename is not None:
             self.dur = getDurationFromAudioFile(self.filename)
@@ -341,29 +435,8 @@ class Clip:
         if ms is None:
             return 0.0
 
-        plays = [t for t in self.plays if t[0] <= ms <= t[1]]
         time = 0.0
-        start = self.initialOffset
-
-        # check if we are playing this clip at this time
-        if len(plays) > 0:
-            start, end, params = plays[0]
-
-        # otherwise, find the closest play
-        elif len(self.plays) > 0:
-            plays = sorted(self.plays, key=lambda p: abs(ms - lerp((p[0], p[1]), 0.5)))
-            closestPlay = plays[0]
-            start, end, params =  closestPlay
-
-            # assumes plays are sorted
-            firstPlay = self.plays[0]
-            lastPlay = self.plays[-1]
-
-            # if we are before the first play or after the last one, set to initial offset
-            # for continuity between compositions
-            if ms < firstPlay[0] or ms > lastPlay[1]:
-                start = self.initialOffset
-
+        start = self.getPlayStart(ms)
         msSincePlay = ms - start
 
         # play forward and backward
@@ -412,12 +485,26 @@ class Clip:
 
         return neighbors
 
+    def getPlayIndex(self):
+        # rebuild the index if plays were added or replaced
+        if self.playIndex is None or self.playIndex.plays is not self.plays or self.playIndex.count != len(self.plays):
+            self.playIndex = PlayIndex(self.plays)
+            self.playSchedule = {}
+        return self.playIndex
+
+    def getPlayStart(self, ms):
+        playIndex = self.getPlayIndex()
+        if ms in self.playSchedule:
+            return self.playSchedule[ms]
+        return playIndex.getPlayStart(ms, self.initialOffset)
+
     def getState(self, name):
         return self.state[name] if name in self.state else None
 
     def queuePlay(self, ms, params={}):
         dur = params["dur"] if "dur" in params else self.dur
         self.plays.append((ms, ms+dur, params))
+        self.playSchedule = {}
 
     def queueTween(self, ms, dur="auto", tweens=[], sortFrames=False):
         if isinstance(tweens, tuple):
@@ -442,8 +529,29 @@ class Clip:
     def setFadeOut(self, fadeDur):
         self.fadeOut = fadeDur
 
+    # a play schedule is only good for the offset and plays it was made with
+    def setInitialOffset(self, initialOffset):
+        self.initialOffset = initialOffset
+        self.props["initialOffset"] = initialOffset
+        self.playSchedule = {}
+
+    # precompute the play start for each frame of a render so getClipTime() is just a lookup
+    def setPlaySchedule(self, msList):
+        playIndex = self.getPlayIndex()
+        self.playSchedule = dict([(ms, playIndex.getPlayStart(ms, self.initialOffset)) for ms in msList])
+
+    def setPlays(self, plays):
+        self.plays = plays
+        self.props["plays"] = plays
+        self.playSchedule = {}
+
     def setProp(self, key, value):
-        self.props[key] = value
+        if key == "initialOffset":
+            self.setInitialOffset(value)
+        elif key == "plays":
+            self.setPlays(value)
+        else:
+            self.props[key] = value
 
     def setState(self, key, value):
         self.state[key] = value
@@ -455,7 +563,7 @@ class Clip:
         self.vector = Vector() if vector is None else vector
 
     def sortPlays(self):
-        self.plays = sorted(self.plays, key=lambda p: p[0])
+        self.setPlays(sorted(self.plays, key=lambda p: p[0]))
 
     def toDict(self, ms=None, containerW=None, containerH=None, parent=None, customProps=None):
         props = self.props.copy()
@@ -293,14 +293,25 @@ def processComposition(a, clips, videoDurationMs, sampler=None, stepTime=False,
         frameStart = totalFrames + frameStart
     if frameEnd <= 0:
         frameEnd = totalFrames + frameEnd
+
+    # stream frames straight into the encoder; only full renders are streamed since a partial range would overwrite the output file
+    # (shards are the exception; each one is encoded to its own file and joined afterwards)
+    streamOutput = a.STREAM_OUTPUT and (frameStart <= 1 or a.SHARD_OUTPUT)
+    if a.STREAM_OUTPUT and not streamOutput:
+        print("Frame range does not start at the first frame; saving PNG frames instead of streaming")
+
+    # shards size clips for every frame of the composition so they match the frames the other shards render
+    sizingFrames = []
     for f in range(totalFrames):
         frame = f + 1
         ms = frameToMs(frame, a.FPS)
         if excerpted:
             ms = frameToMs(excerptFrameStart + f, a.FPS)
+        if a.SHARD_OUTPUT:
+            sizingFrames.append({"frame": frame, "ms": ms, "width": a.WIDTH, "height": a.HEIGHT})
         if not (frameStart <= frame <= frameEnd):
             continue
-        videoFrames.append({
+        videoFrame = {
             "frame": frame,
             "filename": a.OUTPUT_FRAME % zeroPad(frame, totalFrames),
             "ms": ms,
@@ -308,7 +319,11 @@ def processComposition(a, clips, videoDurationMs, sampler=None, stepTime=False,
             "height": a.HEIGHT,
             "overwrite": a.OVERWRITE,
             "debug": a.DEBUG
-        })
+        }
+        # when streaming, only save the frames we want to look at
+        if streamOutput and not (a.DEBUG or a.TEE_FRAMES == "all" or frame in a.TEE_FRAMES):
+            videoFrame["saveFrame"] = False
+        videoFrames.append(videoFrame)
     stepTime = logTime(stepTime, "Processed video frame sequence")
 
     # We're outputing just a single frame
@@ -316,11 +331,23 @@ def processComposition(a, clips, videoDurationMs, sampler=None, stepTime=False,
         videoFrames = [videoFrames[a.OUTPUT_SINGLE_FRAME-1]]
         print("Procesing single frame: %s" % videoFrames[0]["filename"])
 
-    rebuildAudio = (not a.VIDEO_ONLY and (not os.path.isfile(a.AUDIO_OUTPUT_FILE) or a.OVERWRITE))
+    rebuildAudio = (not a.VIDEO_ONLY and not a.SHARD_OUTPUT and (not os.path.isfile(a.AUDIO_OUTPUT_FILE) or a.OVERWRITE))
     rebuildVideo = (not a.AUDIO_ONLY and (len(videoFrames) > 0 and not os.path.isfile(videoFrames[-1]["filename"]) or a.OVERWRITE))
+    if streamOutput:
+        rebuildVideo = (not a.AUDIO_ONLY and len(videoFrames) > 0 and (not os.path.isfile(a.OUTPUT_FILE) or a.OVERWRITE))
+
+    # saved frames are recorded in a render manifest; once there is one, only frames that are missing or would look different are rendered
+    # frames that fade into the previous frame depend on every frame before them, so those are always rendered in full;
+    # so are frames with pre or post-processing functions, since a frame's key can't tell what those do
+    useManifest = (not streamOutput and not isSequential and not (0.0 <= a.FRAME_ALPHA < 1.0) and preProcessingFunction is None and postProcessingFunction is None)
+    renderManifestFilename = getRenderManifestFilename(a.OUTPUT_FRAME)
+    if useManifest and os.path.isfile(renderManifestFilename):
+        rebuildVideo = (not a.AUDIO_ONLY and len(videoFrames) > 0)
 
     if rebuildAudio:
-        mixAudio(audioSequence, durationMs, a.AUDIO_OUTPUT_FILE, masterDb=a.MASTER_DB)
+        audioStore = AudioStore(a.CACHE_DIR + "audio/", maxBytes=roundInt(a.AUDIO_CACHE_SIZE * 1000000000)) if a.AUDIO_CACHE_SIZE > 0 else None
+        fxCache = FxCache(roundInt(a.FX_CACHE_MEMORY * 1000000000), directory=(a.CACHE_DIR + "fx/" if a.FX_CACHE_DISK else None), maxDiskBytes=roundInt(a.FX_CACHE_DISK_SIZE * 1000000000)) if a.FX_CACHE_MEMORY > 0 or a.FX_CACHE_DISK else None
+        mixAudio(audioSequence, durationMs, a.AUDIO_OUTPUT_FILE, masterDb=a.MASTER_DB, mixer=a.MIXER, audioStore=audioStore, processes=a.AUDIO_PROCESSES, fxCache=fxCache, fxBackend=a.FX_BACKEND)
         stepTime = logTime(stepTime, "Mix audio")
 
     if rebuildVideo:
@@ -333,17 +360,60 @@ def processComposition(a, clips, videoDurationMs, sampler=None, stepTime=False,
             "baseImage": baseImage,
             "container": container,
             "recalculateClipSizes": a.RECALC_CLIP_SIZE,
-            "vthreads": a.VIDEO_THREADS
+            "vthreads": a.VIDEO_THREADS,
+            "loadProcesses": a.LOAD_PROCESSES,
+            "loadMemoryBudget": a.LOAD_MEMORY_BUDGET,
+            "compositor": a.COMPOSITOR,
+            "tileSize": a.TILE_SIZE,
+            "cacheDir": a.CACHE_DIR,
+            "spriteCacheMemory": a.SPRITE_CACHE_MEMORY,
+            "spriteQuantize": a.SPRITE_QUANTIZE,
+            "mipLevels": a.MIP_LEVELS,
+            "pixelMemory": a.PIXEL_MEMORY,
+            "pixelWindow": a.PIXEL_WINDOW,
+            "dedupeFrames": not a.NO_DEDUPE,
+            "pipelineWorkers": a.PIPELINE_WORKERS,
+            "pipelineQueueSize": a.PIPELINE_QUEUE
         }
         clipsPixelData = None
         if not renderOnTheFly:
-            clipsPixelData = loadVideoPixelDataFromFrames(videoFrames, clips, a.WIDTH, a.HEIGHT, a.FPS, a.CACHE_DIR, a.CACHE_KEY, a.VERIFY_CACHE, cache=True, debug=a.DEBUG, precision=a.PRECISION, customClipToArrFunction=customClipToArrFunction, customClipToArrCalcFunction=customClipToArrCalcFunction, globalArgs=globalArgs)
+            clipsPixelData = loadVideoPixelDataFromFrames(sizingFrames if a.SHARD_OUTPUT else videoFrames, clips, a.WIDTH, a.HEIGHT, a.FPS, a.CACHE_DIR, a.CACHE_KEY, a.VERIFY_CACHE, cache=True, debug=a.DEBUG, precision=a.PRECISION, customClipToArrFunction=customClipToArrFunction, customClipToArrCalcFunction=customClipToArrCalcFunction, globalArgs=globalArgs)
         stepTime = logTime(stepTime, "Loaded pixel data")
-        if a.OVERWRITE:
+        renderFrames = videoFrames
+        if useManifest:
+            renderManifest = RenderManifest(renderManifestFilename)
+            globalArgs["renderManifest"] = renderManifest
+            renderKeys = getFrameRenderKeys(videoFrames, clips, clipsPixelData, a.PRECISION, customClipToArrFunction, globalArgs)
+            for frame, key in zip(videoFrames, renderKeys):
+                frame["renderKey"] = key
+            if not a.OVERWRITE:
+                renderFrames = [frame for frame in videoFrames if not renderManifest.isCurrent(frame["filename"], frame["renderKey"])]
+                # frames that changed are rendered over their old PNG
+                for frame in renderFrames:
+                    frame["overwrite"] = True
+                print("%s of %s frames are up to date" % (len(videoFrames) - len(renderFrames), len(videoFrames)))
+            stepTime = logTime(stepTime, "Checked render manifest")
+        # other shards' frames share the output pattern
+        if a.OVERWRITE and not a.SHARD_OUTPUT:
             removeFiles(a.OUTPUT_FRAME % "*")
-        processFrames(videoFrames, clips, clipsPixelData, threads=a.THREADS, precision=a.PRECISION, customClipToArrFunction=customClipToArrFunction, postProcessingFunction=postProcessingFunction, preProcessingFunction=preProcessingFunction, globalArgs=globalArgs)
-
-    if not a.AUDIO_ONLY and a.OUTPUT_SINGLE_FRAME < 1 and frameStart <= 1:
+        encoder = None
+        if streamOutput:
+            audioFile = a.AUDIO_OUTPUT_FILE if not a.VIDEO_ONLY and not a.SHARD_OUTPUT and os.path.isfile(a.AUDIO_OUTPUT_FILE) else False
+            quality = "medium" if a.DEBUG else "high"
+            encoder = FrameEncoder(a.OUTPUT_FILE, a.WIDTH, a.HEIGHT, a.FPS, audioFile=audioFile, quality=quality)
+        try:
+            processFrames(renderFrames, clips, clipsPixelData, threads=a.THREADS, precision=a.PRECISION, customClipToArrFunction=customClipToArrFunction, postProcessingFunction=postProcessingFunction, preProcessingFunction=preProcessingFunction, globalArgs=globalArgs, processes=a.PROCESSES, encoder=encoder)
+        except BaseException:
+            if encoder is not None:
+                encoder.abort()
+            raise
+        if encoder is not None:
+            if not encoder.close():
+                print("Could not encode %s" % a.OUTPUT_FILE)
+                sys.exit(1)
+            stepTime = logTime(stepTime, "Encoded video")
+
+    if not a.AUDIO_ONLY and a.OUTPUT_SINGLE_FRAME < 1 and frameStart <= 1 and not streamOutput and not a.SHARD_OUTPUT:
         audioFile = a.AUDIO_OUTPUT_FILE if not a.VIDEO_ONLY and os.path.isfile(a.AUDIO_OUTPUT_FILE) else False
         quality = "medium" if a.DEBUG else "high"
         compileFrames(a.OUTPUT_FRAME, a.FPS, a.OUTPUT_FILE, getZeroPadding(totalFrames), audioFile=audioFile, quality=quality)
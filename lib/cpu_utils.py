@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+# A NumPy version of the makeImage kernel in gpu_utils.py for machines without a GPU/OpenCL device.
+# It takes the same flat pixel data and properties arrays and follows the kernel's float32 arithmetic,
+# drawing one clip at a time (in zindex order) with all of the clip's pixels computed at once.
+# clipsToImageTilesCPU() gives the same result, but splits the canvas into tiles that are each composited on their own (in parallel
+# with a pool) from just the clips that overlap them; a tile crowded with small clips draws all of them at once, one layer of overlap
+# at a time, so frames with lots of small clips don't draw them one by one.
+
+from multiprocessing.dummy import Pool as ThreadPool
+import numpy as np
+
+def blendColorsCPU(color1, color2, amount):
+    amount = amount[..., None]
+    invAmount = (1.0 - amount.astype(np.float64)).astype(np.float32)
+    # OpenCL compilers contract this into fma(color1, amount, color2 * invAmount), so the first product isn't rounded to float32
+    value = color1 * amount.astype(np.float64)
+    value += color2 * invAmount
+    return roundHalfUp(value.astype(np.float32))
+
+def clipsToImageCPU(width, height, flatPixelData, properties, colorDimensions, precision, baseImage=None):
+    count, pcount = properties.shape
+
+    # blank image if no clip data
+    if count <= 0 and baseImage is None:
+        return np.zeros((height, width, 3), dtype=np.uint8)
+    # base image if exists
+    elif count <= 0:
+        return np.array(baseImage, dtype=np.uint8)
+
+    result = np.zeros((height, width, 3), dtype=np.uint8) if baseImage is None else np.array(baseImage, dtype=np.uint8).reshape(height, width, 3).copy()
+    zvalues = np.zeros((height, width), dtype=np.int32)
+    zalphas = np.zeros((height, width), dtype=np.int32)
+
+    # draw clips from back to front
+    order = np.argsort(properties[:, 8], kind="stable")
+    for i in order:
+        drawClipCPU(result, zvalues, zalphas, flatPixelData, properties[i], colorDimensions, precision)
+
+    return result
+
+# each property of each clip as drawClipCPU() works it out, plus where each clip lands on the canvas
+def clipsToBoundsCPU(properties, width, height, precision):
+    f32 = np.float32
+    precisionMultiplier = f32(int(10 ** precision))
+    clips = {}
+    clips["offset"] = properties[:, 0].astype(np.int64)
+    xF = properties[:, 1].astype(f32) / precisionMultiplier
+    yF = properties[:, 2].astype(f32) / precisionMultiplier
+    clips["x"] = np.floor(xF).astype(np.int64)
+    clips["y"] = np.floor(yF).astype(np.int64)
+    clips["remainderX"] = (xF - clips["x"].astype(f32)).astype(f32)
+    clips["remainderY"] = (yF - clips["y"].astype(f32)).astype(f32)
+    clips["w"] = properties[:, 3].astype(np.int64)
+    clips["h"] = properties[:, 4].astype(np.int64)
+    clips["twF"] = properties[:, 5].astype(f32) / precisionMultiplier
+    clips["thF"] = properties[:, 6].astype(f32) / precisionMultiplier
+    edgeX = (clips["remainderX"] + clips["twF"]).astype(f32)
+    edgeY = (clips["remainderY"] + clips["thF"]).astype(f32)
+    clips["remainderW"] = (edgeX - np.floor(edgeX)).astype(f32)
+    clips["remainderH"] = (edgeY - np.floor(edgeY)).astype(f32)
+    clips["falpha"] = properties[:, 7].astype(f32) / precisionMultiplier
+    clips["zindex"] = properties[:, 8].astype(np.int32)
+    clips["fbrightness"] = properties[:, 9].astype(f32) / precisionMultiplier
+    # the part of the clip that lands on the canvas, from x0/y0 up to (but not including) x1/y1
+    clips["x0"] = np.maximum(clips["x"], 0)
+    clips["y0"] = np.maximum(clips["y"], 0)
+    clips["x1"] = np.minimum(clips["x"] + np.ceil(edgeX).astype(np.int64), width)
+    clips["y1"] = np.minimum(clips["y"] + np.ceil(edgeY).astype(np.int64), height)
+    clips["visible"] = (clips["x0"] < clips["x1"]) & (clips["y0"] < clips["y1"]) & (clips["w"] > 0) & (clips["h"] > 0)
+    return clips
+
+# tileSize is the width and height of each tile in pixels; pool is an optional thread pool that draws tiles in parallel.
+# Tiles with more than maxTileClips clips that cover less than maxClipArea pixels of the tile on average draw all their clips at once;
+# other tiles draw their clips one at a time, which is quicker for large clips.
+def clipsToImageTilesCPU(width, height, flatPixelData, properties, colorDimensions, precision, baseImage=None, tileSize=128, pool=None, maxTileClips=8, maxClipArea=1024):
+    count, pcount = properties.shape
+
+    # blank image if no clip data
+    if count <= 0 and baseImage is None:
+        return np.zeros((height, width, 3), dtype=np.uint8)
+    # base image if exists
+    elif count <= 0:
+        return np.array(baseImage, dtype=np.uint8)
+
+    result = np.zeros((height, width, 3), dtype=np.uint8) if baseImage is None else np.array(baseImage, dtype=np.uint8).reshape(height, width, 3).copy()
+    zvalues = np.zeros((height, width), dtype=np.int32)
+    zalphas = np.zeros((height, width), dtype=np.int32)
+
+    # clips from back to front, leaving out any that are off the canvas
+    clips = clipsToBoundsCPU(properties, width, height, precision)
+    order = np.argsort(clips["zindex"], kind="stable")
+    order = order[clips["visible"][order]]
+    if len(order) <= 0:
+        return result
+
+    # bucket clips by the tiles they overlap; each tile keeps its clips in drawing order
+    tilesX = (width + tileSize - 1) // tileSize
+    tx0 = clips["x0"][order] // tileSize
+    tx1 = (clips["x1"][order] - 1) // tileSize
+    ty0 = clips["y0"][order] // tileSize
+    ty1 = (clips["y1"][order] - 1) // tileSize
+    tileClips, tileCols, tileRows = getRectCellsCPU(order, tx0, ty0, tx1 - tx0 + 1, ty1 - ty0 + 1)
+    tileIds = tileRows * tilesX + tileCols
+    tileOrder = np.argsort(tileIds, kind="stable")
+    tileIds = tileIds[tileOrder]
+    tileClips = tileClips[tileOrder]
+    starts = np.flatnonzero(np.concatenate(([True], tileIds[1:] != tileIds[:-1])))
+    ends = np.append(starts[1:], len(tileIds))
+    # how many pixels of its tile each clip covers
+    tileX0 = (tileIds % tilesX) * tileSize
+    tileY0 = (tileIds // tilesX) * tileSize
+    areas = (np.minimum(clips["x1"][tileClips], tileX0 + tileSize) - np.maximum(clips["x0"][tileClips], tileX0)) * (np.minimum(clips["y1"][tileClips], tileY0 + tileSize) - np.maximum(clips["y0"][tileClips], tileY0))
+    tileAreas = np.add.reduceat(areas, starts)
+    crowded = ((ends - starts) > maxTileClips) & (tileAreas < maxClipArea * (ends - starts))
+
+    tiles = []
+    for start, end, isCrowded in zip(starts, ends, crowded):
+        x0 = int(tileX0[start])
+        y0 = int(tileY0[start])
+        tiles.append((x0, y0, min(x0 + tileSize, width), min(y0 + tileSize, height), tileClips[start:end], isCrowded))
+
+    def drawTile(tile):
+        x0, y0, x1, y1, clipIndices, isCrowded = tile
+        if isCrowded:
+            drawTileCPU(result, zvalues, zalphas, flatPixelData, clips, (x0, y0, x1, y1, clipIndices), colorDimensions)
+            return
+        for i in clipIndices:
+            drawClipCPU(result, zvalues, zalphas, flatPixelData, properties[i], colorDimensions, precision, (x0, y0, x1, y1))
+
+    # tiles don't share any pixels, so they can be drawn at the same time
+    if pool is not None:
+        pool.map(drawTile, tiles)
+    else:
+        for tile in tiles:
+            drawTile(tile)
+
+    return result
+
+# bounds is an optional (x0, y0, x1, y1) part of the canvas to draw to, e.g. a tile
+def drawClipCPU(result, zvalues, zalphas, flatPixelData, props, colorDimensions, precision, bounds=None):
+    canvasH, canvasW, _ = result.shape
+    boundsX0, boundsY0, boundsX1, boundsY1 = bounds if bounds is not None else (0, 0, canvasW, canvasH)
+    f32 = np.float32
+    precisionMultiplier = f32(int(10 ** precision))
+    offset = int(props[0])
+    xF = f32(props[1]) / precisionMultiplier
+    yF = f32(props[2]) / precisionMultiplier
+    x = int(np.floor(xF))
+    y = int(np.floor(yF))
+    remainderX = f32(xF - f32(x))
+    remainderY = f32(yF - f32(y))
+    w = int(props[3])
+    h = int(props[4])
+    twF = f32(props[5]) / precisionMultiplier
+    thF = f32(props[6]) / precisionMultiplier
+    remainderW = f32(f32(remainderX+twF) - np.floor(f32(remainderX+twF)))
+    remainderH = f32(f32(remainderY+thF) - np.floor(f32(remainderY+thF)))
+    tw = int(np.ceil(f32(remainderX+twF)))
+    th = int(np.ceil(f32(remainderY+thF)))
+    falpha = f32(props[7]) / precisionMultiplier
+    zindex = int(props[8])
+    fbrightness = f32(props[9]) / precisionMultiplier
+
+    # only the part of the clip that lands on the canvas
+    col0 = max(0, boundsX0 - x)
+    col1 = min(tw, boundsX1 - x)
+    row0 = max(0, boundsY0 - y)
+    row1 = min(th, boundsY1 - y)
+    if col0 >= col1 or row0 >= row1 or w <= 0 or h <= 0:
+        return
+
+    cols = np.arange(col0, col1)
+    rows = np.arange(row0, row1)
+    srcXF = getSourceCoordinatesCPU(cols, remainderX, twF, remainderW, w)
+    srcYF = getSourceCoordinatesCPU(rows, remainderY, thF, remainderH, h)
+    pixels = flatPixelData[offset:offset+h*w*colorDimensions].reshape(h, w, colorDimensions)
+    srcColor = getPixelsFCPU(pixels, srcXF, srcYF)
+
+    if fbrightness < 1.0:
+        srcColor[:, :, :3] = roundHalfUp(srcColor[:, :, :3] * fbrightness)
+
+    dstX0 = col0 + x
+    dstY0 = row0 + y
+    dstRows = slice(dstY0, dstY0 + len(rows))
+    dstCols = slice(dstX0, dstX0 + len(cols))
+    destZValue = zvalues[dstRows, dstCols]
+    destZAlpha = zalphas[dstRows, dstCols]
+    dest = result[dstRows, dstCols]
+    destColor = np.empty(srcColor.shape, dtype=np.float32)
+    destColor[:, :, :3] = dest
+    destColor[:, :, 3] = destZAlpha
+    # the kernel treats the very first canvas pixel as already opaque
+    if dstY0 == 0 and dstX0 == 0:
+        destColor[0, 0, 3] = 255
+    dalpha = destColor[:, :, 3] / f32(255.0)
+    salpha = srcColor[:, :, 3] / f32(255.0)
+    talpha = salpha * falpha
+    mask = (talpha > 0.0) & ((zindex > destZValue) | (dalpha < 1.0))
+    if not mask.any():
+        return
+
+    # there's already a pixel there; place it behind it using its alpha
+    behind = zindex < destZValue
+    if behind.any():
+        talpha = np.where(behind, ((1.0 - dalpha.astype(np.float64)) * talpha).astype(np.float32), talpha)
+
+    # mix the existing color with new color; fully opaque pixels just replace it
+    if np.all(talpha == 1.0):
+        blendedColor = srcColor
+    else:
+        blendedColor = blendColorsCPU(srcColor, destColor, talpha)
+    np.copyto(dest, blendedColor[:, :, :3], casting="unsafe", where=mask[:, :, None])
+
+    # assign new zindex if it's greater
+    above = mask & (zindex > destZValue)
+    np.copyto(destZAlpha, blendedColor[:, :, 3], casting="unsafe", where=above)
+    np.copyto(destZValue, zindex, where=above)
+
+# draw the clips that overlap one tile; clipIndices are in drawing order
+def drawTileCPU(result, zvalues, zalphas, flatPixelData, clips, tile, colorDimensions):
+    f32 = np.float32
+    x0, y0, x1, y1, clipIndices = tile
+    tileW = x1 - x0
+
+    # one fragment for each pixel of each clip that lands in the tile
+    cx0 = np.maximum(clips["x0"][clipIndices], x0)
+    cy0 = np.maximum(clips["y0"][clipIndices], y0)
+    cx1 = np.minimum(clips["x1"][clipIndices], x1)
+    cy1 = np.minimum(clips["y1"][clipIndices], y1)
+    k, dstX, dstY = getRectCellsCPU(clipIndices, cx0, cy0, cx1 - cx0, cy1 - cy0)
+    if len(k) <= 0:
+        return
+    srcXF = getSourceCoordinatesCPU(dstX - clips["x"][k], clips["remainderX"][k], clips["twF"][k], clips["remainderW"][k], clips["w"][k])
+    srcYF = getSourceCoordinatesCPU(dstY - clips["y"][k], clips["remainderY"][k], clips["thF"][k], clips["remainderH"][k], clips["h"][k])
+    srcColor = getFragmentPixelsFCPU(flatPixelData, clips["offset"][k], clips["w"][k], clips["h"][k], colorDimensions, srcXF, srcYF)
+    fbrightness = clips["fbrightness"][k]
+    dim = fbrightness < 1.0
+    if dim.any():
+        srcColor[dim, :3] = roundHalfUp(srcColor[dim, :3] * fbrightness[dim][:, None])
+    falpha = clips["falpha"][k]
+    zindex = clips["zindex"][k]
+
+    # a pixel's fragments have to be drawn in order, so draw the first fragment of every pixel, then the second, and so on
+    pixels = (dstY - y0) * tileW + (dstX - x0)
+    byPixel = np.argsort(pixels, kind="stable")
+    sortedPixels = pixels[byPixel]
+    groupStarts = np.flatnonzero(np.concatenate(([True], sortedPixels[1:] != sortedPixels[:-1])))
+    groupSizes = np.diff(np.append(groupStarts, len(sortedPixels)))
+    layers = np.empty(len(pixels), dtype=np.int64)
+    layers[byPixel] = np.arange(len(pixels)) - np.repeat(groupStarts, groupSizes)
+    byLayer = np.argsort(layers, kind="stable")
+    layerStarts = np.searchsorted(layers[byLayer], np.arange(groupSizes.max() + 1))
+    layerEnds = np.append(layerStarts[1:], len(byLayer))
+
+    dest = result[y0:y1, x0:x1].reshape(-1, 3)
+    tileZValues = zvalues[y0:y1, x0:x1].reshape(-1)
+    tileZAlphas = zalphas[y0:y1, x0:x1].reshape(-1)
+    for start, end in zip(layerStarts, layerEnds):
+        fragments = byLayer[start:end]
+        p = pixels[fragments]
+        z = zindex[fragments]
+        destZValue = tileZValues[p]
+        destColor = np.empty((len(p), 4), dtype=np.float32)
+        destColor[:, :3] = dest[p]
+        destColor[:, 3] = tileZAlphas[p]
+        # the kernel treats the very first canvas pixel as already opaque
+        if x0 == 0 and y0 == 0:
+            destColor[p == 0, 3] = 255
+        dalpha = destColor[:, 3] / f32(255.0)
+        salpha = srcColor[fragments, 3] / f32(255.0)
+        talpha = salpha * falpha[fragments]
+        mask = (talpha > 0.0) & ((z > destZValue) | (dalpha < 1.0))
+        if not mask.any():
+            continue
+
+        # there's already a pixel there; place it behind it using its alpha
+        behind = z < destZValue
+        talpha = np.where(behind, ((1.0 - dalpha.astype(np.float64)) * talpha).astype(np.float32), talpha)
+
+        blendedColor = blendColorsCPU(srcColor[fragments], destColor, talpha)
+        dest[p[mask]] = blendedColor[mask, :3]
+
+        # assign new zindex if it's greater
+        above = mask & (z > destZValue)
+        tileZAlphas[p[above]] = blendedColor[above, 3]
+        tileZValues[p[above]] = z[above]
+
+    result[y0:y1, x0:x1] = dest.reshape(y1 - y0, x1 - x0, 3)
+    zvalues[y0:y1, x0:x1] = tileZValues.reshape(y1 - y0, x1 - x0)
+    zalphas[y0:y1, x0:x1] = tileZAlphas.reshape(y1 - y0, x1 - x0)
+
+# like getPixelsFCPU(), but each fragment samples its own clip's pixels at one point
+def getFragmentPixelsFCPU(flatPixelData, offsets, w, h, dim, xF, yF):
+    f32 = np.float32
+    xF = np.clip(xF, f32(-1.0), (w + 1).astype(f32))
+    yF = np.clip(yF, f32(-1.0), (h + 1).astype(f32))
+
+    x0 = np.floor(xF).astype(np.int64)
+    x1 = np.ceil(xF).astype(np.int64)
+    xLerp = (xF - x0.astype(f32)).astype(f32)
+    y0 = np.floor(yF).astype(np.int64)
+    y1 = np.ceil(yF).astype(np.int64)
+    yLerp = (yF - y0.astype(f32)).astype(f32)
+
+    xLerp = (1.0 - xLerp.astype(np.float64)).astype(f32)
+    yLerp = (1.0 - yLerp.astype(np.float64)).astype(f32)
+
+    getPixels = lambda xs, ys: getFragmentPixelsCPU(flatPixelData, offsets, w, h, dim, xs, ys)
+    colorT = blendColorsCPU(getPixels(x0, y0), getPixels(x1, y0), xLerp)
+    colorB = blendColorsCPU(getPixels(x0, y1), getPixels(x1, y1), xLerp)
+    # check bounds; rows outside the source are transparent
+    colorT[:, 3] *= (y0 >= 0) & (y0 < h)
+    colorB[:, 3] *= (y1 >= 0) & (y1 < h)
+
+    return blendColorsCPU(colorT, colorB, yLerp)
+
+def getFragmentPixelsCPU(flatPixelData, offsets, w, h, dim, xs, ys):
+    indices = offsets + (np.clip(ys, 0, h-1) * w + np.clip(xs, 0, w-1)) * dim
+    colors = np.empty((len(xs), 4), dtype=np.float32)
+    for channel in range(3):
+        colors[:, channel] = flatPixelData[indices + channel]
+    if dim > 3:
+        colors[:, 3] = flatPixelData[indices + 3]
+    else:
+        colors[:, 3] = 255
+    # check bounds; retain rgb color of edge, but make alpha=0
+    colors[:, 3] *= (xs >= 0) & (xs < w)
+    return colors
+
+def getPixelsFCPU(pixels, xF, yF):
+    h, w, dim = pixels.shape
+    xF = np.clip(xF, np.float32(-1.0), np.float32(w+1))
+    yF = np.clip(yF, np.float32(-1.0), np.float32(h+1))
+
+    x0 = np.floor(xF).astype(np.int32)
+    x1 = np.ceil(xF).astype(np.int32)
+    xLerp = (xF - x0.astype(np.float32)).astype(np.float32)
+    y0 = np.floor(yF).astype(np.int32)
+    y1 = np.ceil(yF).astype(np.int32)
+    yLerp = (yF - y0.astype(np.float32)).astype(np.float32)
+
+    xLerp = (1.0 - xLerp.astype(np.float64)).astype(np.float32)
+    yLerp = (1.0 - yLerp.astype(np.float64)).astype(np.float32)
+
+    # blending is separable: blend left/right once for each source row that's needed, then blend those rows top/bottom
+    rows, rowIndices = np.unique(np.clip(np.concatenate((y0, y1)), 0, h-1), return_inverse=True)
+    sourceRows = pixels[rows]
+    colorL = getPixelsCPU(sourceRows, x0)
+    colorR = getPixelsCPU(sourceRows, x1)
+    colorH = blendColorsCPU(colorL, colorR, xLerp[None, :])
+    colorT = colorH[rowIndices[:len(y0)]]
+    colorB = colorH[rowIndices[len(y0):]]
+    # check bounds; rows outside the source are transparent
+    colorT[:, :, 3] *= ((y0 >= 0) & (y0 < h))[:, None]
+    colorB[:, :, 3] *= ((y1 >= 0) & (y1 < h))[:, None]
+
+    return blendColorsCPU(colorT, colorB, yLerp[:, None])
+
+def getPixelsCPU(sourceRows, xs):
+    h, w, dim = sourceRows.shape
+    colors = np.empty((h, len(xs), 4), dtype=np.float32)
+    colors[:, :, :3] = sourceRows[:, np.clip(xs, 0, w-1), :3]
+    if dim > 3:
+        colors[:, :, 3] = sourceRows[:, np.clip(xs, 0, w-1), 3]
+    else:
+        colors[:, :, 3] = 255
+    # check bounds; retain rgb color of edge, but make alpha=0
+    colors[:, :, 3] *= (xs >= 0) & (xs < w)
+    return colors
+
+# every cell of a list of rectangles, as (rectangle id, x, y) arrays ordered by rectangle, then row, then column
+def getRectCellsCPU(ids, x, y, w, h):
+    counts = w * h
+    total = int(counts.sum())
+    cellIds = np.repeat(ids, counts)
+    cells = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    rectW = np.repeat(w, counts)
+    return (cellIds, np.repeat(x, counts) + cells % rectW, np.repeat(y, counts) + cells // rectW)
+
+# map destination columns (or rows) to source coordinates, as in the kernel's normF/edge handling
+def getSourceCoordinatesCPU(steps, remainder, targetF, remainderTarget, sourceLength):
+    f32 = np.float32
+    a = remainder
+    b = f32(np.float64(f32(remainder + targetF)) - 1.0)
+    srcN = (steps.astype(np.float32) - a) / f32(b - a)
+    srcF = srcN * f32(sourceLength - 1)
+    srcF = np.where(srcN < 0.0, -remainder, srcF)
+    srcF = np.where(srcN > 1.0, f32(np.float64(sourceLength - 1) + (1.0 - np.float64(remainderTarget))), srcF)
+    return srcF.astype(np.float32)
+
+# round half away from zero like OpenCL's round() (values here are never negative)
+def roundHalfUp(value):
+    # adding 0.5 in float64 is exact for float32 values; the result is whole numbers stored as float32
+    value = np.add(value, 0.5, dtype=np.float64)
+    return np.floor(value, out=value).astype(np.float32)
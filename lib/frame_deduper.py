@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# A frame deduper remembers the output of the last few rendered frames by what they draw (see getFrameStateKey()).
+# A frame with the same key as a recent one reuses its image instead of being composited again.
+
+from collections import OrderedDict
+import hashlib
+from lib.clip import *
+from lib.math_utils import *
+import numpy as np
+import threading
+
+class FrameDeduper:
+
+    def __init__(self, size=4):
+        self.size = size
+        self.frames = OrderedDict()
+        self.skipped = 0
+        self.aborted = False
+        # frames rendered on multiple threads share the deduper
+        self.lock = threading.Condition()
+
+    # wake anything waiting for a frame that will never be set, e.g. when an earlier stage of a render failed
+    def abort(self):
+        with self.lock:
+            self.aborted = True
+            self.lock.notify_all()
+
+    # returns (filename, image) of an earlier frame with the same key, or None
+    def get(self, key):
+        with self.lock:
+            if key not in self.frames:
+                return None
+            self.frames.move_to_end(key)
+            self.skipped += 1
+            return self.frames[key]
+
+    def set(self, key, filename, im):
+        with self.lock:
+            self.frames[key] = (filename, im)
+            self.frames.move_to_end(key)
+            while len(self.frames) > self.size:
+                self.frames.popitem(last=False)
+            self.lock.notify_all()
+
+    # like get(), but waits for a frame that's still being rendered to be set; returns None if the deduper is aborted first
+    def wait(self, key):
+        with self.lock:
+            while key not in self.frames and not self.aborted:
+                self.lock.wait()
+        return self.get(key)
+
+# A key for what a frame draws: its evaluated clip array, with each visible clip's time replaced by the index of the source frame
+# it draws (so clips held on the same source frame match) and invisible clips zeroed out. frameCounts is the number of frames
+# of each clip's pixel data (or None if clips are drawn from their exact time); clipIds optionally identify each clip's source,
+# and extra is anything else that changes the frame's output, e.g. container effects.
+def getFrameStateKey(clipArr, frameCounts=None, precision=3, extra=(), clipIds=None):
+    precisionMultiplier = int(10 ** precision)
+    properties = [p[0] for p in Clip.npProperties]
+    arr = np.array(clipArr, dtype=np.int64).reshape(-1, len(properties))
+    if clipIds is not None:
+        arr = np.column_stack((arr, clipIds))
+    tnIndex = properties.index("tn")
+    isVisible = (arr[:, properties.index("width")] > 0) & (arr[:, properties.index("height")] > 0) & (arr[:, properties.index("alpha")] > 0)
+    arr[np.logical_not(isVisible)] = 0
+    # see clipsToFrameGPU()
+    if frameCounts is not None:
+        for i in np.nonzero(isVisible)[0]:
+            frameCount = frameCounts[i]
+            arr[i, tnIndex] = roundInt(1.0 * arr[i, tnIndex] / precisionMultiplier * (frameCount-1)) if frameCount > 0 else -1
+    h = hashlib.sha1()
+    h.update(arr.tobytes())
+    h.update(repr(extra).encode("utf-8"))
+    return h.hexdigest()
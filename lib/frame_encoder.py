@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# A frame encoder pipes raw RGB frames into one long-running ffmpeg process instead of saving each frame as a PNG
+# and compiling them afterwards. Frames can be added in any order (e.g. from parallel workers); they are held in a
+# reorder buffer until every earlier frame has been written, since ffmpeg has to receive them in sequence. The video is
+# encoded to a temporary file next to the output and only moved into place once every frame was encoded, so a render
+# that crashes or is killed never leaves a partial file where a finished one is expected.
+
+import os
+import subprocess
+import threading
+
+class FrameEncoder:
+
+    def __init__(self, filename, width, height, fps, audioFile=None, quality="high", startIndex=0):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.frameSize = width * height * 3
+        self.startIndex = startIndex
+        self.nextIndex = startIndex
+        self.buffer = {}
+        self.maxBuffered = 0
+        self.lock = threading.Lock()
+        # keep the extension so ffmpeg picks the same container
+        base, ext = os.path.splitext(filename)
+        self.tmpFilename = "%s.%s.tmp%s" % (base, os.getpid(), ext)
+
+        preset, crf = getEncodingQuality(quality)
+        command = ['ffmpeg','-y',
+                    '-loglevel', 'error',
+                    '-f', 'rawvideo',
+                    '-pix_fmt', 'rgb24',
+                    '-s', '%sx%s' % (width, height),
+                    '-framerate', str(fps)+'/1',
+                    '-i', 'pipe:0']
+        if audioFile:
+            command += ['-i', audioFile]
+        command += ['-c:v','libx264',
+                    '-preset', preset,
+                    '-crf', crf,
+                    '-r', str(fps),
+                    '-pix_fmt', 'yuv420p']
+        if audioFile:
+            command += ['-c:a','aac',
+                        '-b:a', '192k']
+        command.append(self.tmpFilename)
+        print(" ".join(command))
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    # index is the frame's position in the output; data is the frame's raw rgb bytes
+    def addFrame(self, index, data):
+        # a frame that's never written would hold up every frame after it, so fail right away
+        if len(data) != self.frameSize:
+            raise ValueError("Frame %s has %s bytes; expected %s" % (index, len(data), self.frameSize))
+        with self.lock:
+            self.buffer[index] = data
+            self.maxBuffered = max(self.maxBuffered, len(self.buffer))
+            while self.nextIndex in self.buffer:
+                self.proc.stdin.write(self.buffer.pop(self.nextIndex))
+                self.nextIndex += 1
+
+    # stops encoding and removes the partial file, e.g. if rendering failed
+    def abort(self):
+        self.buffer = {}
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.kill()
+        self.proc.wait()
+        if os.path.isfile(self.tmpFilename):
+            os.remove(self.tmpFilename)
+
+    # returns True if every frame was encoded and the video was moved to its filename
+    def close(self):
+        missingCount = len(self.buffer)
+        self.buffer = {}
+        self.proc.stdin.close()
+        returnCode = self.proc.wait()
+        if returnCode != 0 or missingCount > 0:
+            if returnCode != 0:
+                print("ffmpeg exited with code %s while encoding %s" % (returnCode, self.filename))
+            else:
+                print("%s frames after missing frame %s were not encoded to %s" % (missingCount, self.nextIndex, self.filename))
+            if os.path.isfile(self.tmpFilename):
+                os.remove(self.tmpFilename)
+            return False
+        os.replace(self.tmpFilename, self.filename)
+        print("Encoded %s frames to %s (reorder buffer held up to %s frames)" % (self.nextIndex - self.startIndex, self.filename, self.maxBuffered))
+        return True
+
+# https://trac.ffmpeg.org/wiki/Encode/H.264
+# presets: veryfast, faster, fast, medium, slow, slower, veryslow
+#   slower = better quality
+# crf: 0 is lossless, 23 is the default, and 51 is worst possible quality
+#   17 or 18 to be visually lossless or nearly so
+def getEncodingQuality(quality="high"):
+    preset = "veryslow"
+    crf = "18"
+    if quality=="medium":
+        preset = "medium"
+        crf = "23"
+    elif quality=="low":
+        preset = "medium"
+        crf = "28"
+    return (preset, crf)
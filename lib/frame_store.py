@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# A frame store keeps uncompressed frames for a single source video in two append-only files:
+#   <name>.frames: raw uint8 pixels written back to back
+#   <name>.index: fixed-size records of (ms, offset, height, width, channels)
+# Frames are read back as zero-copy views into a memory-mapped .frames file, so pages are only read from disk when touched
+# Half-size mip levels of a store's frames are kept in their own stores next to it: <name>.mip1, <name>.mip2, ...
+
+from lib.cache_utils import *
+from lib.io_utils import *
+from lib.math_utils import *
+import mmap
+import numpy as np
+import os
+
+class FrameStore:
+
+    indexDtype = np.dtype([("ms", "<i8"), ("offset", "<i8"), ("height", "<i8"), ("width", "<i8"), ("channels", "<i8")])
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dataFilename = filename + ".frames"
+        self.indexFilename = filename + ".index"
+        self.mm = None
+        self.mmSize = 0
+        self.load()
+
+    def append(self, ms, pixels):
+        self.appendFrames([(ms, pixels)])
+
+    # new frames are written to the end of the data file; the index is written last so a partial write is never referenced
+    def appendFrames(self, frames):
+        if len(frames) <= 0:
+            return
+        records = np.zeros(len(frames), dtype=self.indexDtype)
+        with open(self.dataFilename, "ab") as f:
+            offset = f.tell()
+            for i, frame in enumerate(frames):
+                ms, pixels = frame
+                pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+                if pixels.ndim < 3:
+                    pixels = pixels.reshape(pixels.shape + (1,))
+                h, w, c = pixels.shape
+                f.write(pixels.tobytes())
+                records[i] = (roundInt(ms), offset, h, w, c)
+                offset += pixels.nbytes
+        with open(self.indexFilename, "ab") as f:
+            f.write(records.tobytes())
+        self.addRecords(records)
+
+    def addRecords(self, records):
+        count = len(self.records)
+        self.records = np.concatenate((self.records, records))
+        # later records win if a timestamp is written more than once (e.g. re-extracted at a larger size)
+        for i, ms in enumerate(records["ms"]):
+            self.lookup[int(ms)] = count + i
+
+    def close(self):
+        # views returned by getFrame() keep their own reference to the map, so just drop ours
+        self.mm = None
+        self.mmSize = 0
+
+    def exists(self):
+        return os.path.isfile(self.indexFilename) and os.path.isfile(self.dataFilename)
+
+    def getFrame(self, ms):
+        index = self.lookup[roundInt(ms)]
+        ms, offset, h, w, c = self.records[index]
+        size = int(h * w * c)
+        if offset + size > self.mmSize:
+            self.remap()
+        return np.frombuffer(self.mm, dtype=np.uint8, count=size, offset=int(offset)).reshape(int(h), int(w), int(c))
+
+    # like getFrame() but reads a copy from the data file, so nothing stays mapped once the copy is dropped
+    def readFrame(self, ms):
+        index = self.lookup[roundInt(ms)]
+        ms, offset, h, w, c = self.records[index]
+        size = int(h * w * c)
+        with open(self.dataFilename, "rb") as f:
+            pixels = np.fromfile(f, dtype=np.uint8, count=size, offset=int(offset))
+        return pixels.reshape(int(h), int(w), int(c))
+
+    def getShape(self, ms):
+        record = self.records[self.lookup[roundInt(ms)]]
+        return (int(record["height"]), int(record["width"]), int(record["channels"]))
+
+    def getTimes(self):
+        return list(self.lookup.keys())
+
+    def hasFrame(self, ms):
+        return roundInt(ms) in self.lookup
+
+    def load(self):
+        self.close()
+        self.lookup = {}
+        self.records = np.zeros(0, dtype=self.indexDtype)
+        if not self.exists():
+            return
+        records = np.fromfile(self.indexFilename, dtype=np.uint8)
+        # ignore a trailing partial record if a previous write was interrupted
+        recordCount = int(len(records) / self.indexDtype.itemsize)
+        records = records[:recordCount*self.indexDtype.itemsize].view(self.indexDtype)
+        # also ignore records that point past the end of the data file
+        dataSize = os.path.getsize(self.dataFilename)
+        if recordCount > 0:
+            valid = (records["offset"] + records["height"] * records["width"] * records["channels"]) <= dataSize
+            records = records[valid]
+        self.addRecords(records)
+
+    def remap(self):
+        self.close()
+        size = os.path.getsize(self.dataFilename) if os.path.isfile(self.dataFilename) else 0
+        if size <= 0:
+            return
+        with open(self.dataFilename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mmSize = size
+
+    def remove(self):
+        self.close()
+        for fn in [self.dataFilename, self.indexFilename]:
+            if os.path.isfile(fn):
+                os.remove(fn)
+                print("Removed %s" % fn)
+        self.load()
+
+def frameStoreFromCacheFile(cacheFn, storeFn):
+    store = FrameStore(storeFn)
+    if store.exists() or not os.path.isfile(cacheFn + ".bz2"):
+        return store
+    # migrate a legacy bz2-pickled (clipTimes, clipPixels) cache into the frame store
+    loaded, fileCacheData = loadCacheFile(cacheFn)
+    if loaded and len(fileCacheData) > 0:
+        clipTimes, clipPixels = fileCacheData
+        print("Migrating %s to frame store %s..." % (cacheFn, storeFn))
+        store.appendFrames(list(zip(clipTimes, clipPixels)))
+    return store
+
+# a frame and its mip levels (largest first) as a tuple, or just the frame if there are no levels for it
+def getMipFrame(store, mipStores, ms):
+    frame = store.getFrame(ms)
+    levels = [frame]
+    for mipStore in mipStores:
+        if not mipStore.hasFrame(ms):
+            break
+        levels.append(mipStore.getFrame(ms))
+    return tuple(levels) if len(levels) > 1 else frame
+
+def getMipFrameStores(store, levels):
+    return [FrameStore(store.filename + ".mip%s" % (level+1)) for level in range(levels)]
+
+# the size of each mip level below full size, halving until the width would be smaller than minWidth
+def getMipSizes(width, height, levels, minWidth=16):
+    sizes = []
+    for level in range(1, levels+1):
+        w = roundInt(1.0 * width / (2 ** level))
+        h = max(1, roundInt(1.0 * height / (2 ** level)))
+        if w < minWidth:
+            break
+        sizes.append((w, h))
+    return sizes
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# An fx cache keeps the samples of clips that were stretched or run through sox effects, so a composition that plays
+# the same clip with the same effects many times only processes it once. The key covers the source file, the clip's
+# start and duration, every property that changes its audio before or during the effects (volume, fades, pan, effect
+# params, etc.), the effects padding, and the effects backend. Volume stays in the key, since effects like reverb and
+# overdrive clip and saturate, so their output isn't just a scaled copy at another volume. Least recently used clips are
+# dropped once the cache is over its memory ceiling; with a directory, clips are also saved to disk so later renders can
+# use them, and the least recently used files are removed once the directory is over its size budget.
+
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import os
+
+class FxCache:
+
+    keyProps = ["dur", "matchDb", "maxMatchDb", "useMaxDBFS", "maxDb", "reverse", "db", "pan", "fadeIn", "fadeOut", "stretch", "stretchTo", "reverb", "distortion", "highpass", "lowpass", "bass", "echo", "tempo"]
+
+    def __init__(self, maxBytes=512000000, directory=None, maxDiskBytes=2000000000):
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.maxDiskBytes = maxDiskBytes
+        self.diskBytes = 0
+        self.clips = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fileKeys = {}
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.diskBytes = sum([size for mtime, size, fn in self.getFiles()])
+
+    # caches are passed to mixing processes, which start with an empty memory cache
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["clips"] = OrderedDict()
+        state["bytes"] = 0
+        return state
+
+    def evict(self, keep=None):
+        files = self.getFiles()
+        totalBytes = sum([size for mtime, size, fn in files])
+        for mtime, size, fn in sorted(files):
+            if totalBytes <= self.maxDiskBytes:
+                break
+            if fn == keep:
+                continue
+            # other processes sharing the directory may remove files at any point
+            try:
+                os.remove(fn)
+                self.evictions += 1
+            except OSError:
+                pass
+            totalBytes -= size
+        self.diskBytes = totalBytes
+
+    def get(self, key):
+        if key in self.clips:
+            self.clips.move_to_end(key)
+            self.hits += 1
+            return self.clips[key]
+        if self.directory is not None and os.path.isfile(self.getFilename(key)):
+            self.hits += 1
+            samples = np.load(self.getFilename(key))
+            # mark as recently used
+            os.utime(self.getFilename(key))
+            self.set(key, samples, save=False)
+            return samples
+        self.misses += 1
+        return None
+
+    def getFilename(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    # (modification time, size, filename) of each clip saved in the directory
+    def getFiles(self):
+        files = []
+        for fn in os.listdir(self.directory):
+            fn = os.path.join(self.directory, fn)
+            try:
+                if fn.endswith(".npy") and not fn.endswith(".tmp.npy"):
+                    files.append((os.path.getmtime(fn), os.path.getsize(fn), fn))
+            except OSError:
+                continue
+        return files
+
+    # returns the key and the props to process the clip with
+    def getKey(self, filename, clipStart, clipDur, props, fxPad=3000, sampleRate=48000, channels=2, fxBackend="sox"):
+        props = dict([(name, props[name]) for name in self.keyProps if name in props])
+        # the disk cache outlives the render, so the source file's modification time and size are part of the key
+        if filename not in self.fileKeys:
+            self.fileKeys[filename] = "%s|%s|%s" % (os.path.abspath(filename), os.path.getmtime(filename), os.path.getsize(filename)) if os.path.isfile(filename) else filename
+        key = "%s|%s|%s|%s|%s|%s|%s|%s" % (self.fileKeys[filename], clipStart, clipDur, sorted(props.items()), fxPad, sampleRate, channels, fxBackend)
+        return (hashlib.md5(key.encode("utf8")).hexdigest(), props)
+
+    def getStats(self):
+        total = self.hits + self.misses
+        hitRate = 1.0 * self.hits / total if total > 0 else 0.0
+        return "Fx cache: %s hits, %s misses (%.1f%% hit rate), %s evictions, %s clips using %s MB" % (self.hits, self.misses, hitRate * 100.0, self.evictions, len(self.clips), round(self.bytes / 1000000.0, 1))
+
+    def set(self, key, samples, save=True):
+        if save and self.directory is not None:
+            # write to a temporary file first so other processes never read a partial file
+            filename = self.getFilename(key)
+            tmpFilename = filename + ".%s.tmp.npy" % os.getpid()
+            np.save(tmpFilename, samples)
+            os.replace(tmpFilename, filename)
+            # only look through the directory once it might be over budget
+            self.diskBytes += os.path.getsize(filename)
+            if self.diskBytes > self.maxDiskBytes:
+                self.evict(keep=filename)
+        # clips that would take up the whole cache aren't worth keeping
+        if samples.nbytes > self.maxBytes:
+            return
+        if key in self.clips:
+            self.bytes -= self.clips[key].nbytes
+        self.clips[key] = samples
+        self.clips.move_to_end(key)
+        self.bytes += samples.nbytes
+        while self.bytes > self.maxBytes and len(self.clips) > 0:
+            _key, evicted = self.clips.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
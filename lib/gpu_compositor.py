@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# A GPU compositor keeps the OpenCL context, the compiled makeImage program, and its device buffers for a whole render.
+# Clip pixel data can be uploaded once as a frame atlas that stays on the device; each frame then only sends the clip
+# properties (plus pixels for any clips that had to be resized or rotated for that frame) and reads back the image.
+# This works with any OpenCL runtime, including CPU runtimes like pocl.
+
+from lib.gpu_utils import *
+from lib.math_utils import *
+import numpy as np
+import threading
+
+class GPUCompositor:
+
+    def __init__(self, width, height, pcount, colorDimensions, precision, cacheDir=None):
+        self.width = width
+        self.height = height
+        self.pcount = pcount
+        self.colorDimensions = colorDimensions
+        self.ctx, self.prg = loadMakeImageProgram(width, height, pcount, colorDimensions, precision, cacheDir=cacheDir)
+        self.queue = cl.CommandQueue(self.ctx)
+        # retrieve kernels once; each retrieval creates a new kernel object
+        self.kernels = {"makeImage": cl.Kernel(self.prg, "makeImage"), "makeImageAtlas": cl.Kernel(self.prg, "makeImageAtlas")}
+        self.buffers = {}
+        self.atlasOffsets = None
+        # frames rendered on multiple threads share the buffers
+        self.lock = threading.Lock()
+
+    # returns a device buffer with at least nbytes, only reallocating when it needs to grow
+    def getBuffer(self, name, nbytes, flags):
+        nbytes = max(1, nbytes)
+        if name not in self.buffers or self.buffers[name].size < nbytes:
+            self.buffers[name] = cl.Buffer(self.ctx, flags, size=nbytes)
+        return self.buffers[name]
+
+    def getMaxAllocSize(self):
+        return min([d.max_mem_alloc_size for d in self.ctx.devices])
+
+    # upload every frame of every clip once; atlasOffsets[clipIndex][frameIndex][level] is where that frame's (mip level's) pixels start
+    def loadAtlas(self, clipsPixelData, maxBytes=-1):
+        c = self.colorDimensions
+        offsets = []
+        total = 0
+        for clipFrames in clipsPixelData:
+            clipOffsets = []
+            for frame in clipFrames:
+                frameOffsets = []
+                for pixels in getFrameLevels(frame):
+                    h, w = pixels.shape[:2]
+                    frameOffsets.append(total)
+                    total += int(h*w*c)
+                clipOffsets.append(frameOffsets)
+            offsets.append(clipOffsets)
+
+        # offsets into the atlas are int32 properties, so it can't be more than 2 GiB even if the device allows larger buffers
+        maxAllocSize = min(self.getMaxAllocSize(), 2**31-1)
+        if maxBytes > 0:
+            maxAllocSize = min(maxAllocSize, maxBytes)
+        if total > maxAllocSize:
+            print("Warning: clip pixel data (%s MB) is too large for the device atlas (%s MB); uploading pixel data every frame instead" % (roundInt(total/1000000.0), roundInt(maxAllocSize/1000000.0)))
+            self.atlasOffsets = None
+            return False
+
+        mf = cl.mem_flags
+        atlas = self.getBuffer("atlas", total, mf.READ_ONLY)
+        for clipFrames, clipOffsets in zip(clipsPixelData, offsets):
+            for frame, frameOffsets in zip(clipFrames, clipOffsets):
+                for pixels, offset in zip(getFrameLevels(frame), frameOffsets):
+                    h, w = pixels.shape[:2]
+                    # pixels are size 3, but need size 4
+                    if pixels.shape[2] < c:
+                        fillVals = np.full((h, w, 1), 255, dtype='uint8')
+                        pixels = np.concatenate((pixels, fillVals), axis=2)
+                    cl.enqueue_copy(self.queue, atlas, np.ascontiguousarray(pixels, dtype=np.uint8).reshape(-1), dst_offset=offset)
+        self.queue.finish()
+        self.atlasOffsets = offsets
+        print("Uploaded %s MB of clip pixel data to the device" % roundInt(total/1000000.0))
+        return True
+
+    # properties' pixel offsets point into the atlas, or into frameData if negative (see makeImageAtlas in gpu_utils.py)
+    def makeImage(self, properties, frameData, baseImage=None):
+        width = self.width
+        height = self.height
+        count, pcount = properties.shape
+
+        # blank image if no clip data
+        if count <= 0 and baseImage is None:
+            return np.zeros((height, width, 3), dtype=np.uint8)
+        # base image if exists
+        elif count <= 0:
+            return np.array(baseImage, dtype=np.uint8)
+
+        properties = np.ascontiguousarray(properties, dtype=np.int32).reshape(-1)
+        frameData = np.ascontiguousarray(frameData, dtype=np.uint8).reshape(-1)
+        result = np.zeros(width * height * 3, dtype=np.uint8)
+
+        mf = cl.mem_flags
+        with self.lock:
+            bufProps = self.getBuffer("properties", properties.nbytes, mf.READ_ONLY)
+            bufFrame = self.getBuffer("frameData", frameData.nbytes, mf.READ_ONLY)
+            bufZ = self.getBuffer("zvalues", width * height * 2 * 4, mf.READ_WRITE)
+            bufOut = self.getBuffer("result", result.nbytes, mf.READ_WRITE)
+
+            cl.enqueue_copy(self.queue, bufProps, properties)
+            if len(frameData) > 0:
+                cl.enqueue_copy(self.queue, bufFrame, frameData)
+            cl.enqueue_fill_buffer(self.queue, bufZ, np.int32(0), 0, width * height * 2 * 4)
+            if baseImage is None:
+                cl.enqueue_fill_buffer(self.queue, bufOut, np.uint8(0), 0, result.nbytes)
+            else:
+                cl.enqueue_copy(self.queue, bufOut, np.array(baseImage, dtype=np.uint8).reshape(-1))
+
+            if self.atlasOffsets is not None:
+                self.kernels["makeImageAtlas"](self.queue, (count, ), None, self.buffers["atlas"], bufFrame, bufProps, bufZ, bufOut)
+            else:
+                self.kernels["makeImage"](self.queue, (count, ), None, bufFrame, bufProps, bufZ, bufOut)
+
+            # Copy result
+            cl.enqueue_copy(self.queue, result, bufOut)
+
+        return result.reshape(height, width, 3)
+
+# frames with mip levels are tuples of pixels, largest first
+def getFrameLevels(frame):
+    return list(frame) if isinstance(frame, tuple) else [frame]
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import numpy as np
 import os
 from pprint import pprint
-import pyopencl as cl
 import sys
 
+# pyopencl is only needed for the gpu compositor; cpu-only machines can use clipsToImageCPU in cpu_utils.py instead
+try:
+    import pyopencl as cl
+except ImportError:
+    cl = None
+
+from lib.cache_utils import *
 from lib.clip import *
 
 os.environ['PYOPENCL_COMPILER_OUTPUT'] = '1'
 
-def loadMakeImageProgram(width, height, pcount, colorDimensions, precision):
+def loadMakeImageProgram(width, height, pcount, colorDimensions, precision, cacheDir=None):
     precisionMultiplier = int(10 ** precision)
     # the kernel function
     srcCode = """
@@ -99,7 +106,7 @@ def loadMakeImageProgram(width, height, pcount, colorDimensions, precision):
         return finalcolor;
     }
 
-    __kernel void makeImage(__global uchar *pdata, __global int *props, __global int *zvalues, __global uchar *result){
+    static void drawClip(__global uchar *pdata, __global uchar *framedata, __global int *props, __global int *zvalues, __global uchar *result) {
         int canvasW = %d;
         int canvasH = %d;
         int i = get_global_id(0);
@@ -107,6 +114,11 @@ def loadMakeImageProgram(width, height, pcount, colorDimensions, precision):
         int colorDimensions = %d;
         int precisionMultiplier = %d;
         int offset = props[i*pcount];
+        // a negative offset points to pixels that were made for this frame only (e.g. resized or rotated clips)
+        if (offset < 0) {
+            pdata = framedata;
+            offset = -offset - 1;
+        }
         float xF = (float) props[i*pcount+1] / (float) precisionMultiplier;
         float yF = (float) props[i*pcount+2] / (float) precisionMultiplier;
         int x = (int) floor(xF);
@@ -190,9 +202,21 @@ def loadMakeImageProgram(width, height, pcount, colorDimensions, precision):
             }
         }
     }
+
+    __kernel void makeImage(__global uchar *pdata, __global int *props, __global int *zvalues, __global uchar *result){
+        drawClip(pdata, pdata, props, zvalues, result);
+    }
+
+    // clip pixels are read from a frame atlas that stays on the device, or from framedata for clips with a negative offset
+    __kernel void makeImageAtlas(__global uchar *atlas, __global uchar *framedata, __global int *props, __global int *zvalues, __global uchar *result){
+        drawClip(atlas, framedata, props, zvalues, result);
+    }
     """ % (width, height, pcount, colorDimensions, precisionMultiplier)
 
-    return loadGPUProgram(srcCode)
+    cacheFilename = None
+    if cacheDir is not None:
+        cacheFilename = cacheDir + "makeImage_%sx%s_%s_%s_%s.clbin" % (width, height, pcount, colorDimensions, precision)
+    return loadGPUProgram(srcCode, cacheFilename)
 
 def clipsToImageGPU(width, height, flatPixelData, properties, colorDimensions, precision, gpuProgram=None, baseImage=None):
     count, pcount = properties.shape
@@ -292,7 +316,14 @@ def clipsToImageGPULite(width, height, flatPixelData, properties):
     result = result.reshape(height, width, 3)
     return result
 
-def loadGPUProgram(srcCode):
+def getGPUProgramCacheKey(srcCode, devices):
+    deviceStrings = ["%s|%s|%s" % (d.platform.name, d.name, d.driver_version) for d in devices]
+    return hashlib.sha1((srcCode + "\n".join(deviceStrings)).encode("utf-8")).hexdigest()
+
+def loadGPUProgram(srcCode, cacheFilename=None):
+    if cl is None:
+        raise ImportError("pyopencl is not installed; use -compositor cpu to render without OpenCL")
+
     # Get platforms, both CPU and GPU
     plat = cl.get_platforms()
     GPUs = plat[0].get_devices(device_type=cl.device_type.GPU)
@@ -304,7 +335,26 @@ def loadGPUProgram(srcCode):
         print("Warning: using CPU instead of GPU")
         ctx = cl.Context(CPU)
 
-    # Kernel function instantiation
-    prg = cl.Program(ctx, srcCode).build()
+    # Kernel function instantiation; reuse compiled binaries if they were built from the same source for the same devices
+    devices = ctx.devices
+    cacheKey = getGPUProgramCacheKey(srcCode, devices)
+    prg = None
+    if cacheFilename is not None and os.path.isfile(cacheFilename):
+        try:
+            _, cacheData = loadCacheFile(cacheFilename, compressed=False)
+        # e.g. a file left unreadable by a process that was killed while writing it; it's rebuilt below
+        except Exception as err:
+            print("Could not read %s (%s); rebuilding" % (cacheFilename, err))
+            cacheData = None
+        if isinstance(cacheData, dict) and cacheData.get("key") == cacheKey:
+            try:
+                prg = cl.Program(ctx, devices, cacheData["binaries"]).build()
+            except cl.Error:
+                print("Could not load program binaries from %s; rebuilding" % cacheFilename)
+                prg = None
+    if prg is None:
+        prg = cl.Program(ctx, srcCode).build()
+        if cacheFilename is not None:
+            saveCacheFile(cacheFilename, {"key": cacheKey, "binaries": prg.get_info(cl.program_info.BINARIES)}, overwrite=True, compressed=False)
 
     return (ctx, prg)
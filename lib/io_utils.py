@@ -152,6 +152,15 @@ def getNestedValue(d, string):
 def getZeroPadding(count):
     return len(str(count))
 
+# hard link a file to a new name (replacing it if it exists), or copy it if the filesystem can't link
+def linkFile(src, dst):
+    if os.path.isfile(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
 def makeDirectories(filenames):
     if not isinstance(filenames, list):
         filenames = [filenames]
@@ -95,6 +95,56 @@ def ease(n, easingFunction="sin", exp=6, invert=False):
 
     return n if invert is not True else 1.0-n
 
+# same as ease() but for a numpy array of values (powers may differ from ease() in the last bit)
+def easeArray(n, easingFunction="sin", exp=6, invert=False):
+    n = np.array(n, dtype=np.float64)
+
+    if easingFunction.endswith("Invert"):
+        easingFunction = easingFunction[:-6]
+        invert = True
+
+    if "^" in easingFunction:
+        easingFunction, exp = easingFunction.split("^")
+        exp = int(exp)
+
+    if easingFunction == "sin":
+        n = (np.sin((n+1.5)*math.pi)+1.0) / 2.0
+    elif easingFunction == "quadIn":
+        n = np.power(n, 2.0)
+    elif easingFunction == "quadOut":
+        n = n * (2.0 - n)
+    elif easingFunction == "quadInOut":
+        n = np.where(n < 0.5, 2.0 * n * n, -1.0 + (4 - 2.0*n)*n)
+    elif easingFunction == "cubicIn":
+        n = np.power(n, 3.0)
+    elif easingFunction == "cubicOut":
+        n = np.power(n - 1.0, 3.0) + 1.0
+    elif easingFunction == "cubicInOut":
+        n = np.where(n < 0.5, 4.0 * np.power(n, 3.0), (n-1.0)*(2*n-2)*(2*n-2)+1)
+    elif easingFunction == "quartIn":
+        n = np.power(n, 4.0)
+    elif easingFunction == "quartOut":
+        n = 1.0 - np.power(n-1.0, 4.0)
+    elif easingFunction == "quartInOut":
+        n = np.where(n < 0.5, 8.0 * np.power(n, 4.0), 1.0 - 8.0 * np.power(n-1.0, 4.0))
+    elif easingFunction == "quintIn":
+        n = np.power(n, 5.0)
+    elif easingFunction == "quintOut":
+        n = 1.0 + np.power(n - 1.0, 5.0)
+    elif easingFunction == "quintInOut":
+        n = np.where(n < 0.5, 16.0 * np.power(n, 5.0), 1.0 + 16.0 * np.power(n-1.0, 5.0))
+    elif easingFunction == "expIn":
+        n = np.power(n, float(exp))
+    elif easingFunction == "expOut":
+        n = 1.0 - np.power(n-1.0, float(exp)) if exp % 2 <= 0 else 1.0 + np.power(n-1.0, float(exp))
+    elif easingFunction == "expInOut":
+        if exp % 2 <= 0:
+            n = np.where(n < 0.5, 2**(exp-1) * np.power(n, float(exp)), 1.0 - 2**(exp-1) * np.power(n-1.0, float(exp)))
+        else:
+            n = np.where(n < 0.5, 2**(exp-1) * np.power(n, float(exp)), 1.0 + 2**(exp-1) * np.power(n-1.0, float(exp)))
+
+    return n if invert is not True else 1.0-n
+
 def easeSinInOut(n):
     return (math.sin((n+1.5)*math.pi)+1.0) / 2.0
 
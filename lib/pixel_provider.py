@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# A pixel provider stands in for clipsPixelData (each clip's list of frames) when every clip's frames won't fit in memory.
+# A background thread looks at which clips are visible in a window of upcoming output frames and reads just the source
+# frames they will draw from the clips' frame stores, as long as they fit in the memory budget. Frames that are only needed
+# by output frames that are already done are dropped. A frame that wasn't prefetched in time is read straight from its store.
+# The renderer tells the provider where it is with beginFrame() and endFrame().
+
+from collections import deque
+from lib.clip import *
+from lib.frame_store import *
+from lib.math_utils import *
+import numpy as np
+import threading
+
+class PixelProvider:
+
+    def __init__(self, stores, clipSources, memoryBudget, windowSize=48):
+        # stores[storeIndex] is (frameStore, mipStores); clipSources[clipIndex] is (storeIndex, the ms of each of the clip's frames)
+        self.stores = stores
+        self.clipSources = clipSources
+        self.memoryBudget = memoryBudget
+        self.windowSize = windowSize
+        self.frames = {}
+        self.lastUses = {}
+        self.bytes = 0
+        self.maxBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.frameTimes = []
+        self.positions = {}
+        self.position = 0
+        self.inFlight = set([])
+        self.planEnd = 0
+        self.pending = deque()
+        self.getClipArrs = None
+        self.precision = 3
+        self.thread = None
+        self.running = False
+        self.condition = threading.Condition()
+
+    def __getitem__(self, clipIndex):
+        return ClipFrames(self, clipIndex)
+
+    def __len__(self):
+        return len(self.clipSources)
+
+    def beginFrame(self, ms):
+        with self.condition:
+            if ms in self.positions:
+                self.inFlight.add(self.positions[ms])
+                self.updatePosition()
+
+    def endFrame(self, ms):
+        with self.condition:
+            if ms in self.positions:
+                position = self.positions[ms]
+                self.inFlight.discard(position)
+                # nothing before the lowest frame still rendering is needed again
+                self.updatePosition(position+1)
+
+    def evict(self):
+        for key in [key for key, lastUse in self.lastUses.items() if lastUse < self.position]:
+            del self.lastUses[key]
+            if key in self.frames:
+                self.bytes -= getFrameBytes(self.frames.pop(key))
+
+    def getFrame(self, clipIndex, frameIndex):
+        storeIndex, times = self.clipSources[clipIndex]
+        key = (storeIndex, times[frameIndex])
+        with self.condition:
+            if key in self.frames:
+                self.hits += 1
+                return self.frames[key]
+            self.misses += 1
+        frame = self.readFrame(key)
+        with self.condition:
+            # keep it for the rest of this output frame if there's room
+            if key not in self.frames and self.bytes + getFrameBytes(frame) <= self.memoryBudget:
+                self.insert(key, frame)
+                self.lastUses[key] = max(self.lastUses.get(key, self.position), self.position)
+        return frame
+
+    def getFrameCount(self, clipIndex):
+        return len(self.clipSources[clipIndex][1])
+
+    def getSize(self, key):
+        storeIndex, ms = key
+        store, mipStores = self.stores[storeIndex]
+        size = np.prod(store.getShape(ms))
+        for mipStore in mipStores:
+            if not mipStore.hasFrame(ms):
+                break
+            size += np.prod(mipStore.getShape(ms))
+        return int(size)
+
+    def getStats(self):
+        total = self.hits + self.misses
+        hitRate = 1.0 * self.hits / total if total > 0 else 0.0
+        return "Pixel provider: %s frames prefetched, %s hits, %s misses (%.1f%% hit rate), up to %s MB of pixel data in memory" % (self.prefetched, self.hits, self.misses, hitRate * 100.0, round(self.maxBytes / 1000000.0, 1))
+
+    def insert(self, key, frame):
+        self.frames[key] = frame
+        self.bytes += getFrameBytes(frame)
+        self.maxBytes = max(self.maxBytes, self.bytes)
+
+    # work out which source frames the clips visible in the window will draw, in the order they will be drawn
+    def plan(self):
+        windowEnd = min(len(self.frameTimes), self.position + self.windowSize)
+        planStart = max(self.planEnd, self.position)
+        if planStart >= windowEnd or self.getClipArrs is None:
+            return
+        precisionMultiplier = int(10 ** self.precision)
+        arrs = self.getClipArrs(self.frameTimes[planStart:windowEnd])
+        properties = [p[0] for p in Clip.npProperties]
+        isVisible = (arrs[:, :, properties.index("width")] > 0) & (arrs[:, :, properties.index("height")] > 0) & (arrs[:, :, properties.index("alpha")] > 0)
+        tns = arrs[:, :, properties.index("tn")] / float(precisionMultiplier)
+        pending = []
+        for i, clipIndex in np.argwhere(isVisible):
+            storeIndex, times = self.clipSources[clipIndex]
+            if len(times) <= 0:
+                continue
+            # see clipsToFrameGPU()
+            frameIndex = roundInt(tns[i, clipIndex] * (len(times)-1))
+            key = (storeIndex, times[frameIndex])
+            position = planStart + i
+            with self.condition:
+                if key not in self.lastUses or self.lastUses[key] < position:
+                    self.lastUses[key] = position
+            pending.append(key)
+        with self.condition:
+            self.pending.extend(pending)
+            self.planEnd = windowEnd
+
+    def prefetch(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    break
+                self.evict()
+            self.plan()
+            loaded = False
+            with self.condition:
+                # drop anything already loaded or no longer needed
+                while len(self.pending) > 0 and (self.pending[0] in self.frames or self.pending[0] not in self.lastUses):
+                    self.pending.popleft()
+                key = self.pending[0] if len(self.pending) > 0 else None
+                fits = key is not None and self.bytes + self.getSize(key) <= self.memoryBudget
+            if fits:
+                frame = self.readFrame(key)
+                with self.condition:
+                    # frames read by the renderer in the meantime may have used up the budget
+                    if key not in self.frames and key in self.lastUses and self.bytes + getFrameBytes(frame) <= self.memoryBudget:
+                        self.insert(key, frame)
+                        self.prefetched += 1
+                    loaded = True
+            if not loaded:
+                # wait for the renderer to move on
+                with self.condition:
+                    if self.running:
+                        self.condition.wait(0.1)
+
+    def readFrame(self, key):
+        storeIndex, ms = key
+        store, mipStores = self.stores[storeIndex]
+        frame = store.readFrame(ms)
+        levels = [frame]
+        for mipStore in mipStores:
+            if not mipStore.hasFrame(ms):
+                break
+            levels.append(mipStore.readFrame(ms))
+        return tuple(levels) if len(levels) > 1 else frame
+
+    # frameTimes are the ms of every output frame in render order; getClipArrs(msList) returns clip arrays like Timeline.toNpArrs()
+    def start(self, frameTimes, getClipArrs=None, precision=3):
+        self.stop()
+        # frames kept from earlier frame times are dropped as soon as the new frames move on, unless they're planned again
+        self.lastUses = dict([(key, 0) for key in self.frames])
+        self.frameTimes = list(frameTimes)
+        self.positions = dict([(ms, i) for i, ms in enumerate(self.frameTimes)])
+        self.position = 0
+        self.planEnd = 0
+        self.pending = deque()
+        self.getClipArrs = getClipArrs
+        self.precision = precision
+        self.running = True
+        self.thread = threading.Thread(target=self.prefetch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+
+    def updatePosition(self, position=None):
+        if len(self.inFlight) > 0:
+            position = min(self.inFlight)
+        if position is not None and position > self.position:
+            self.position = position
+            self.condition.notify_all()
+
+# looks like a clip's list of frames to the renderer
+class ClipFrames:
+
+    def __init__(self, provider, clipIndex):
+        self.provider = provider
+        self.clipIndex = clipIndex
+
+    def __getitem__(self, frameIndex):
+        return self.provider.getFrame(self.clipIndex, frameIndex)
+
+    def __len__(self):
+        return self.provider.getFrameCount(self.clipIndex)
+
+def getFrameBytes(frame):
+    return sum([pixels.nbytes for pixels in frame]) if isinstance(frame, tuple) else frame.nbytes
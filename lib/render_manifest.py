@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# A render manifest records a key for each saved frame: a hash of what the frame draws (see getFrameStateKey()), where
+# its clips' pixels come from, and the render settings. A rerun only renders frames whose PNG is missing or whose key
+# changed. The manifest is an append-only text file of "<frame filename>\t<key>" lines (later lines win), so renders of
+# different frame ranges (e.g. -frange splits running at the same time) can all add to the same manifest.
+
+import os
+import threading
+
+class RenderManifest:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def isCurrent(self, frameFilename, key):
+        return os.path.isfile(frameFilename) and self.keys.get(os.path.basename(frameFilename)) == key
+
+    def load(self):
+        self.keys = {}
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, "r") as f:
+            for line in f:
+                # ignore a partial line if a previous write was interrupted
+                if not line.endswith("\n"):
+                    continue
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) == 2:
+                    self.keys[parts[0]] = parts[1]
+
+    def set(self, frameFilename, key):
+        name = os.path.basename(frameFilename)
+        with self.lock:
+            self.keys[name] = key
+            # a single small append is written in one go, so other processes adding to the manifest won't interleave with it
+            with open(self.filename, "a") as f:
+                f.write("%s\t%s\n" % (name, key))
+
+# the manifest for an output frame pattern like "tmp/sample/frame.%s.png" is "tmp/sample/frame.manifest.tsv"
+def getRenderManifestFilename(framePattern):
+    return os.path.splitext(framePattern.replace("%s", "manifest"))[0] + ".tsv"
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# A render pipeline runs frame jobs through a series of stages (e.g. gather pixels -> composite -> post-process -> write),
+# each with its own pool of worker threads, connected by bounded queues. A stage that falls behind fills the queue in front
+# of it, which blocks the stages before it (backpressure), so only a limited number of frames are ever in memory at once.
+# Jobs come from a source iterator, which runs as the first stage on its own thread. A stage can be ordered, in which case
+# it receives jobs in the order the source made them. Each stage keeps track of how long its workers spend working, waiting
+# for jobs, and waiting to hand jobs on, so getStats() shows which stage a render is waiting on.
+
+import queue
+import threading
+import time
+
+class RenderPipeline:
+
+    def __init__(self, queueSize=4, maxInFlight=-1):
+        self.queueSize = queueSize
+        self.maxInFlight = maxInFlight
+        self.stages = []
+        self.runStages = []
+        self.error = None
+        self.errorLock = threading.Lock()
+        self.elapsed = 0
+
+    def addStage(self, name, function, workers=1, ordered=False):
+        self.stages.append(RenderStage(name, function, max(1, workers), ordered))
+
+    def getStats(self):
+        lines = ["Render pipeline (%s frames in %.1fs):" % (self.runStages[0].count if len(self.runStages) > 0 else 0, self.elapsed)]
+        for stage in self.runStages:
+            lines.append("  " + stage.getStats(self.elapsed))
+        return "\n".join(lines)
+
+    # function(job) for each job in order as it leaves the last stage, e.g. for progress;
+    # onError(error) once when the first stage fails, e.g. to wake workers waiting on something that stage would have made
+    def run(self, name, jobs, onDone=None, onError=None):
+        source = RenderStage(name, None, 1)
+        stages = [source] + self.stages
+        self.runStages = stages
+        # every stage can have a full queue in front of it plus a job in each worker
+        maxInFlight = self.maxInFlight if self.maxInFlight > 0 else self.queueSize * len(stages) + sum([stage.workers for stage in stages])
+        inFlight = threading.Semaphore(maxInFlight)
+        queues = [queue.Queue(self.queueSize) for stage in stages] + [None]
+        startTime = time.time()
+
+        # keep the first error; later ones are usually caused by it
+        def setError(e):
+            with self.errorLock:
+                if self.error is not None:
+                    return
+                self.error = e
+            if onError is not None:
+                onError(e)
+
+        def finishJob(item):
+            inFlight.release()
+            if onDone is not None and self.error is None:
+                onDone(item[1])
+
+        def runSource():
+            try:
+                iterator = iter(jobs)
+                index = 0
+                while self.error is None:
+                    inFlight.acquire()
+                    t = time.time()
+                    try:
+                        job = next(iterator)
+                    except StopIteration:
+                        inFlight.release()
+                        break
+                    source.busy += time.time() - t
+                    source.count += 1
+                    t = time.time()
+                    if len(stages) > 1:
+                        queues[1].put((index, job))
+                    else:
+                        finishJob((index, job))
+                    source.waitOut += time.time() - t
+                    index += 1
+            except Exception as e:
+                setError(e)
+            if len(stages) > 1:
+                stages[1].close(queues[1])
+
+        def runWorker(i, inQueue):
+            stage = stages[i]
+            outQueue = queues[i+1]
+            while True:
+                t = time.time()
+                item = inQueue.get()
+                stage.addWait(time.time() - t)
+                if item is None:
+                    break
+                index, job = item
+                if self.error is None:
+                    t = time.time()
+                    try:
+                        job = stage.function(job)
+                    except Exception as e:
+                        setError(e)
+                    stage.addBusy(time.time() - t)
+                t = time.time()
+                if outQueue is not None:
+                    outQueue.put((index, job))
+                else:
+                    finishJob((index, job))
+                stage.addWaitOut(time.time() - t)
+            # the last worker of a stage to finish tells the next stage there's nothing left
+            if stage.workerDone() and outQueue is not None:
+                stages[i+1].close(outQueue)
+
+        threads = []
+        for i, stage in enumerate(stages):
+            if i <= 0:
+                continue
+            inQueue = queues[i]
+            if stage.ordered:
+                inQueue = queue.Queue(self.queueSize)
+                threads.append(threading.Thread(target=reorderJobs, args=(queues[i], inQueue, stage.workers)))
+            for w in range(stage.workers):
+                threads.append(threading.Thread(target=runWorker, args=(i, inQueue)))
+        threads.append(threading.Thread(target=runSource))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.time() - startTime
+        if self.error is not None:
+            raise self.error
+
+class RenderStage:
+
+    def __init__(self, name, function, workers=1, ordered=False):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.ordered = ordered
+        self.count = 0
+        self.busy = 0.0
+        self.waitIn = 0.0
+        self.waitOut = 0.0
+        self.workersDone = 0
+        self.lock = threading.Lock()
+
+    def addBusy(self, seconds):
+        with self.lock:
+            self.busy += seconds
+            self.count += 1
+
+    def addWait(self, seconds):
+        with self.lock:
+            self.waitIn += seconds
+
+    def addWaitOut(self, seconds):
+        with self.lock:
+            self.waitOut += seconds
+
+    # an ordered stage's reorder thread passes the end on to the workers itself
+    def close(self, inQueue):
+        for w in range(self.workers if not self.ordered else 1):
+            inQueue.put(None)
+
+    def getStats(self, elapsed):
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        busy = self.busy / (elapsed * self.workers) if elapsed > 0 else 0.0
+        return "%s (%s worker%s): %s frames, %.2f frames/s, busy %.0f%% of the time, %.1fs waiting for frames, %.1fs waiting on the next stage" % (self.name, self.workers, "s" if self.workers != 1 else "", self.count, rate, busy * 100.0, self.waitIn, self.waitOut)
+
+    def workerDone(self):
+        with self.lock:
+            self.workersDone += 1
+            return self.workersDone >= self.workers
+
+# pass jobs on in index order; jobs are limited by the pipeline's in-flight count, so only so many can be held here
+def reorderJobs(inQueue, outQueue, workers):
+    pending = {}
+    nextIndex = 0
+    while True:
+        item = inQueue.get()
+        if item is None:
+            break
+        pending[item[0]] = item
+        while nextIndex in pending:
+            outQueue.put(pending.pop(nextIndex))
+            nextIndex += 1
+    for w in range(workers):
+        outQueue.put(None)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# A shard queue hands out frame ranges of a render (shards) to worker processes through a directory, which can be on a
+# shared filesystem so workers on other machines can use it too. Each shard is a JSON file that moves between the
+# pending/, running/, done/, and failed/ folders. A worker claims a shard by renaming it from pending/ to running/,
+# which only one worker can do, so no two workers ever render the same shard. A shard that fails goes back to
+# pending/ until it has been tried more than the allowed number of retries, then it goes to failed/.
+
+import json
+import os
+
+class ShardQueue:
+
+    states = ["pending", "running", "done", "failed"]
+
+    def __init__(self, directory, retries=2):
+        self.directory = directory
+        self.retries = retries
+        for state in self.states + ["logs"]:
+            dirname = os.path.join(directory, state)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+    # replaces any shards from an earlier render; with resume, shards that are already done with the same command are
+    # kept so an interrupted render can pick up where it left off (the command doesn't change when the composition or
+    # its media do, so only resume renders of the same inputs)
+    def setShards(self, shards, resume=False):
+        names = set([shard["name"] for shard in shards])
+        for state in self.states:
+            for name in self.getNames(state):
+                if name not in names:
+                    os.remove(self.getFilename(state, name))
+        added = 0
+        for shard in shards:
+            name = shard["name"]
+            done = self.read("done", name) if resume else None
+            if done is not None and done["command"] == shard["command"]:
+                continue
+            for state in self.states:
+                filename = self.getFilename(state, name)
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            shard["attempts"] = 0
+            self.write("pending", shard)
+            added += 1
+        return added
+
+    # returns the next pending shard, or None if there are none left
+    def claim(self, workerName):
+        for name in self.getNames("pending"):
+            try:
+                os.rename(self.getFilename("pending", name), self.getFilename("running", name))
+            except OSError:
+                # another worker got to it first
+                continue
+            shard = self.read("running", name)
+            shard["worker"] = workerName
+            self.write("running", shard)
+            return shard
+        return None
+
+    def finish(self, shard, success):
+        name = shard["name"]
+        if not success:
+            shard["attempts"] += 1
+        state = "done" if success else ("pending" if shard["attempts"] <= self.retries else "failed")
+        self.write("running", shard)
+        os.rename(self.getFilename("running", name), self.getFilename(state, name))
+        return state
+
+    def getCounts(self):
+        return dict([(state, len(self.getShards(state))) for state in self.states])
+
+    def getFilename(self, state, name):
+        return os.path.join(self.directory, state, name + ".json")
+
+    def getLogFilename(self, shard):
+        return os.path.join(self.directory, "logs", shard["name"] + ".log")
+
+    def getNames(self, state):
+        return sorted([os.path.splitext(fn)[0] for fn in os.listdir(os.path.join(self.directory, state)) if fn.endswith(".json")])
+
+    def getShards(self, state):
+        shards = [self.read(state, name) for name in self.getNames(state)]
+        return [shard for shard in shards if shard is not None]
+
+    def read(self, state, name):
+        filename = self.getFilename(state, name)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, "r", encoding="utf8") as f:
+            return json.load(f)
+
+    # shards left running by workers that have exited (e.g. a lost SSH connection) count as failed attempts
+    def requeue(self):
+        shards = self.getShards("running")
+        for shard in shards:
+            self.finish(shard, False)
+        return len(shards)
+
+    def write(self, state, shard):
+        filename = self.getFilename(state, shard["name"])
+        # write to a temporary file first so readers never see a partial shard; each process has its own
+        tmpFilename = filename + ".%s.tmp" % os.getpid()
+        with open(tmpFilename, "w", encoding="utf8") as f:
+            json.dump(shard, f)
+        os.replace(tmpFilename, filename)
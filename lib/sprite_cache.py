@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# A sprite cache keeps clip pixels that were rotated, blurred, and/or resized for a frame, so consecutive frames that
+# draw the same source frame with the same transform don't redo the work. Sprites are keyed on exact rotation and blur
+# by default; with a rotation and/or blur step, they're quantized so that tiny changes between frames still hit the cache.
+# The quantized values are also the ones that get rendered, so a frame looks the same whether its sprites came from the
+# cache or not (but slightly different from an unquantized render). Least recently used sprites are dropped once the
+# cache is over its memory ceiling.
+
+from collections import OrderedDict
+import threading
+
+class SpriteCache:
+
+    def __init__(self, maxBytes=512000000, rotationStep=0, blurStep=0):
+        self.maxBytes = maxBytes
+        self.rotationStep = rotationStep
+        self.blurStep = blurStep
+        self.sprites = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # frames rendered on multiple threads share the cache
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.sprites:
+                self.sprites.move_to_end(key)
+                self.hits += 1
+                return self.sprites[key]
+            self.misses += 1
+            return None
+
+    def getKey(self, sourceKey, rotation, blur, width, height, colors):
+        return (sourceKey, rotation, blur, width, height, colors)
+
+    def getStats(self):
+        total = self.hits + self.misses
+        hitRate = 1.0 * self.hits / total if total > 0 else 0.0
+        return "Sprite cache: %s hits, %s misses (%.1f%% hit rate), %s evictions, %s sprites using %s MB" % (self.hits, self.misses, hitRate * 100.0, self.evictions, len(self.sprites), round(self.bytes / 1000000.0, 1))
+
+    def quantize(self, rotation, blur):
+        rotation = round(rotation / self.rotationStep) * self.rotationStep if self.rotationStep > 0 else rotation
+        blur = round(blur / self.blurStep) * self.blurStep if self.blurStep > 0 else blur
+        return (rotation, blur)
+
+    def set(self, key, pixels):
+        # sprites that would take up the whole cache aren't worth keeping
+        if pixels.nbytes > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.sprites:
+                self.bytes -= self.sprites[key].nbytes
+            self.sprites[key] = pixels
+            self.sprites.move_to_end(key)
+            self.bytes += pixels.nbytes
+            while self.bytes > self.maxBytes and len(self.sprites) > 0:
+                _key, sprite = self.sprites.popitem(last=False)
+                self.bytes -= sprite.nbytes
+                self.evictions += 1
@@ -0,0 +1,587 @@
+# -*- coding: utf-8 -*-
+
+# A timeline compiles the keyframes and plays of a list of clips into flat NumPy arrays so every clip can be evaluated
+# at a batch of times in one go. Timeline.toNpArrs() returns the same arrays as calling clipsToNpArr() for each time.
+# Keyframes can be in any order (like Vector.getPropValue()), but plays are assumed sorted by start like Clip.getClipTime();
+# clips with unsorted plays are evaluated with the original per-clip code instead.
+
+from lib.clip import *
+from lib.math_utils import *
+import hashlib
+import numpy as np
+
+class KeyframeTrack:
+
+    def __init__(self, vectors, name, dimension=None):
+        vectorCount = len(vectors)
+        self.defaults = np.zeros(vectorCount)
+        self.counts = np.zeros(vectorCount, dtype=np.int64)
+        times = []
+        values = []
+        easings = []
+        for i, vector in enumerate(vectors):
+            value = getattr(vector, name)
+            if dimension is not None:
+                value = value[dimension]
+            self.defaults[i] = value
+            keyframes = vector.getTrack(name, dimension)["keyframes"]
+            self.counts[i] = len(keyframes)
+            times += [k["ms"] for k in keyframes]
+            values += [k["value"] for k in keyframes]
+            easings += [k["easing"] for k in keyframes]
+
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.int64)
+        self.vectorIds = np.repeat(np.arange(vectorCount), self.counts)
+        self.times = np.array(times, dtype=np.float64)
+        self.values = np.array(values, dtype=np.float64)
+        # the first keyframe after a time (in list order) is the first one whose running max passes it
+        self.runningMaxTimes = np.zeros(len(times))
+        for i in range(vectorCount):
+            i0 = self.starts[i]
+            i1 = i0 + self.counts[i]
+            if i1 > i0:
+                self.runningMaxTimes[i0:i1] = np.maximum.accumulate(self.times[i0:i1])
+        self.easingNames, self.easings = np.unique(np.array(easings, dtype=object).astype(str), return_inverse=True) if len(easings) > 0 else ([], np.zeros(0, dtype=np.int64))
+
+    def getValues(self, ms):
+        if len(self.times) <= 0:
+            return np.repeat(self.defaults[:, np.newaxis], len(ms), axis=1)
+        # index of the first keyframe after each time, like the loop in Vector.getPropValue()
+        i = searchSegments(self.runningMaxTimes, self.vectorIds, self.starts, ms, side="right")
+        vectorIds = np.broadcast_to(np.arange(len(self.defaults))[:, np.newaxis], i.shape)
+        return self.interpolate(i, vectorIds, np.broadcast_to(ms[np.newaxis, :], i.shape))
+
+    # like getValues() but for (vector, time) pairs instead of every vector at every time
+    def getValuesAt(self, vectorIds, ms):
+        if len(self.times) <= 0:
+            return self.defaults[vectorIds]
+        i = searchSegments(self.runningMaxTimes, self.vectorIds, self.starts, ms, side="right", querySegmentIds=vectorIds)
+        return self.interpolate(i, vectorIds, ms)
+
+    def interpolate(self, i, vectorIds, queryMs):
+        values = np.array(self.defaults[vectorIds], dtype=np.float64)
+        counts = self.counts[vectorIds]
+        starts = self.starts[vectorIds]
+        hasKeyframes = counts > 0
+
+        # before the first keyframe or after the last one
+        first = hasKeyframes & (i <= 0)
+        values[first] = self.values[starts[first]]
+        last = hasKeyframes & (i >= counts)
+        values[last] = self.values[(starts + counts - 1)[last]]
+
+        # lerp between the previous and current keyframe, eased with the current keyframe's easing
+        between = hasKeyframes & (i > 0) & (i < counts)
+        if np.any(between):
+            kf1 = (i + starts)[between]
+            kf0 = kf1 - 1
+            t0 = self.times[kf0]
+            t1 = self.times[kf1]
+            amount = 1.0 * (queryMs[between] - t0) / (t1 - t0)
+            easings = self.easings[kf1]
+            for easingIndex in np.unique(easings):
+                easingName = self.easingNames[easingIndex]
+                if easingName == "linear":
+                    continue
+                mask = easings == easingIndex
+                amount[mask] = easeArray(amount[mask], easingName)
+            fromValues = self.values[kf0]
+            toValues = self.values[kf1]
+            values[between] = (toValues - fromValues) * amount + fromValues
+
+        return values
+
+    # vectors whose keyframes are out of time order may not be monotonic between keyframes
+    def getUnsortedVectors(self):
+        unsorted = np.zeros(len(self.defaults), dtype=bool)
+        np.logical_or.at(unsorted, self.vectorIds, self.times < self.runningMaxTimes)
+        return unsorted
+
+class VectorTimeline:
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.tracks = {}
+        self.origins = np.array([v.origin for v in vectors], dtype=np.float64).reshape(-1, 2)
+        self.transformOrigins = np.array([v.transformOrigin for v in vectors], dtype=np.float64).reshape(-1, 2)
+        self.baseSizes = np.array([v.size for v in vectors], dtype=np.float64).reshape(-1, 2)
+
+        # parents are evaluated with their own timeline
+        parents = []
+        self.parentIndices = np.full(len(vectors), -1, dtype=np.int64)
+        for i, v in enumerate(vectors):
+            if v.parent is None:
+                continue
+            if v.parent not in parents:
+                parents.append(v.parent)
+            self.parentIndices[i] = parents.index(v.parent)
+        self.parentTimeline = VectorTimeline(parents) if len(parents) > 0 else None
+
+    # like toDict() but for (vector, time range) pairs, with each value as a (2, pairs) array of its lowest and highest value between
+    # t0 and t1; every track is eased between its keyframes without overshooting, so this is a bound as long as none of them (or any
+    # parent's) has a keyframe between t0 and t1. Values that appear more than once are bounded separately, so the bounds can be loose.
+    def getBounds(self, ids, t0, t1, parentBounds=None):
+        scales = [self.getTrackBounds("scale", i, ids, t0, t1) for i in range(2)]
+        hasParent = np.zeros(len(ids), dtype=bool)
+        if parentBounds is not None:
+            hasParent[:] = True
+        elif self.parentTimeline is not None:
+            hasParent = self.parentIndices[ids] >= 0
+            parentBounds = self.parentTimeline.getBounds(self.parentIndices[ids][hasParent], t0[hasParent], t1[hasParent])
+
+        sizes = []
+        positions = []
+        for i in range(2):
+            length = self.getTrackBounds("size", i, ids, t0, t1)
+            tlength = intervalProduct(length, scales[i])
+
+            # see toDict()
+            size = tlength.copy()
+            d = self.getTrackBounds("pos", i, ids, t0, t1) + self.getTrackBounds("translate", i, ids, t0, t1)
+            d += intervalProduct(length, -(self.origins[ids, i] - self.transformOrigins[ids, i]))
+            d += intervalProduct(tlength, -self.transformOrigins[ids, i])
+            if np.any(hasParent):
+                size[:, hasParent] = intervalProduct(size[:, hasParent], parentBounds["scale"][i])
+                nd = intervalProduct(d[:, hasParent], 1.0 / parentBounds["baseSize"][i])
+                d[:, hasParent] = intervalProduct(parentBounds["size"][i], nd) + parentBounds["pos"][i]
+            sizes.append(size)
+            positions.append(d)
+
+        return {
+            "pos": positions,
+            "baseSize": [self.baseSizes[ids, i] for i in range(2)],
+            "size": sizes,
+            "scale": scales
+        }
+
+    # every keyframe time of the tracks toDict() reads, including each vector's parents', as (vector ids, times)
+    def getKeyframeTimes(self):
+        ids = []
+        times = []
+        for name in ["size", "scale", "pos", "translate"]:
+            for i in range(2):
+                track = self.getTrack(name, i)
+                ids.append(track.vectorIds)
+                times.append(track.times)
+        if self.parentTimeline is not None:
+            parentIds, parentTimes = self.parentTimeline.getKeyframeTimes()
+            for parentId in np.unique(parentIds):
+                vectorIds = np.nonzero(self.parentIndices == parentId)[0]
+                vectorTimes = parentTimes[parentIds == parentId]
+                ids.append(np.repeat(vectorIds, len(vectorTimes)))
+                times.append(np.tile(vectorTimes, len(vectorIds)))
+        return (np.concatenate(ids).astype(np.int64), np.concatenate(times))
+
+    def getPropValues(self, name, dimension, ms):
+        return self.getTrack(name, dimension).getValues(ms)
+
+    def getTrackBounds(self, name, dimension, ids, t0, t1):
+        track = self.getTrack(name, dimension)
+        values0 = track.getValuesAt(ids, t0)
+        values1 = track.getValuesAt(ids, t1)
+        return np.array([np.minimum(values0, values1), np.maximum(values0, values1)])
+
+    def getTrack(self, name, dimension=None):
+        key = (name, dimension)
+        if key not in self.tracks:
+            self.tracks[key] = KeyframeTrack(self.vectors, name, dimension)
+        return self.tracks[key]
+
+    # vectors with keyframes out of order in any track toDict() reads, or with a parent that has
+    def getUnsortedVectors(self):
+        unsorted = np.zeros(len(self.vectors), dtype=bool)
+        for name in ["size", "scale", "pos", "translate"]:
+            for i in range(2):
+                unsorted |= self.getTrack(name, i).getUnsortedVectors()
+        if self.parentTimeline is not None:
+            hasParent = self.parentIndices >= 0
+            unsorted[hasParent] |= self.parentTimeline.getUnsortedVectors()[self.parentIndices[hasParent]]
+        return unsorted
+
+    # the vectorized equivalent of Vector.toDict() plus x/y/width/height from Vector.getPropsAtTime();
+    # arrays are shaped (vectors, times); parentProps is a toDict()-like dict that overrides each vector's own parent
+    def toDict(self, ms, parentProps=None):
+        scales = [self.getPropValues("scale", i, ms) for i in range(2)]
+        sizes = []
+        positions = []
+        parentDict = None
+        if parentProps is None and self.parentTimeline is not None:
+            parentDict = self.parentTimeline.toDict(ms)
+            hasParent = self.parentIndices >= 0
+            parentIndices = self.parentIndices[hasParent]
+
+        for i in range(2):
+            length = self.getPropValues("size", i, ms)
+
+            # see Vector.getSizeDimension()
+            size = length * scales[i]
+            if parentProps is not None:
+                size *= parentProps["scale"][i]
+            elif parentDict is not None:
+                size[hasParent] *= parentDict["scale"][i][parentIndices]
+            sizes.append(size)
+
+            # see Vector.getPosDimension()
+            d = self.getPropValues("pos", i, ms)
+            d -= length * self.origins[:, i:i+1]
+            tlength = length * scales[i]
+            d -= (tlength - length) * self.transformOrigins[:, i:i+1]
+            d += self.getPropValues("translate", i, ms)
+            if parentProps is not None:
+                nd = 1.0 * d / parentProps["baseSize"][i]
+                d = parentProps["size"][i] * nd + parentProps["pos"][i]
+            elif parentDict is not None:
+                nd = 1.0 * d[hasParent] / parentDict["baseSize"][i][parentIndices]
+                d[hasParent] = parentDict["size"][i][parentIndices] * nd + parentDict["pos"][i][parentIndices]
+            positions.append(d)
+
+        return {
+            "pos": positions,
+            "baseSize": [self.baseSizes[:, i:i+1] for i in range(2)],
+            "size": sizes,
+            "scale": scales
+        }
+
+class Timeline:
+
+    def __init__(self, clips, containerW=None, containerH=None, precision=3):
+        self.clips = clips
+        self.containerW = containerW
+        self.containerH = containerH
+        self.precision = precision
+
+        clipCount = len(clips)
+        self.indices = np.array([clip.props["index"] for clip in clips], dtype=np.int64)
+        self.vectors = VectorTimeline([clip.vector for clip in clips])
+        # clipsToNpArr() passes the first clip's parent to every clip
+        self.parent = clips[0].vector.parent if clipCount > 0 else None
+        self.parentTimeline = VectorTimeline([self.parent]) if self.parent is not None else None
+
+        self.starts = np.array([clip.start for clip in clips], dtype=np.float64)
+        self.durs = np.array([clip.dur for clip in clips], dtype=np.float64)
+        self.loopDurs = np.array([int(clip.dur*2) for clip in clips], dtype=np.float64)
+        self.initialOffsets = np.array([clip.initialOffset for clip in clips], dtype=np.float64)
+        self.zindices = np.array([clip.props["zindex"] if "zindex" in clip.props else clip.props["index"]+1 for clip in clips], dtype=np.float64)
+        self.loadPlays()
+
+    def getClipTimes(self, ms):
+        starts = np.repeat(self.initialOffsets[:, np.newaxis], len(ms), axis=1)
+        counts = self.playCounts[:, np.newaxis]
+        playStarts = self.playStarts[:, np.newaxis]
+        hasPlays = np.broadcast_to(counts > 0, starts.shape)
+        if len(self.playTimes) > 0:
+            queryMs = np.broadcast_to(ms[np.newaxis, :], starts.shape)
+
+            # a play is active if it starts before ms and ends after it; running max of play ends finds the first one in list order
+            startedCount = searchSegments(self.playTimes[:, 0], self.playClipIds, self.playStarts, ms, side="right")
+            firstEnded = searchSegments(self.playRunningMaxEnds, self.playClipIds, self.playStarts, ms, side="left")
+            isActive = hasPlays & (firstEnded < startedCount)
+            activeIndex = np.minimum(firstEnded + playStarts, len(self.playTimes)-1)
+            starts[isActive] = self.playTimes[activeIndex[isActive], 0]
+
+            # otherwise, the play with the closest midpoint (first in list order if tied)
+            isNearest = hasPlays & np.logical_not(isActive)
+            if np.any(isNearest):
+                right = searchSegments(self.playMidpoints, self.playClipIds, self.playStarts, ms, side="right")
+                left = right - 1
+                hasLeft = left >= 0
+                hasRight = right < counts
+                leftIndex = np.clip(left + playStarts, 0, len(self.playTimes)-1)
+                rightIndex = np.clip(right + playStarts, 0, len(self.playTimes)-1)
+                # the first of any plays sharing the left midpoint
+                leftIndex = self.playGroupStarts[leftIndex]
+                leftDistance = np.abs(queryMs - self.playMidpoints[leftIndex])
+                rightDistance = np.abs(queryMs - self.playMidpoints[rightIndex])
+                leftOrder = self.playOrder[leftIndex]
+                rightOrder = self.playOrder[rightIndex]
+                useLeft = hasLeft & (np.logical_not(hasRight) | (leftDistance < rightDistance) | ((leftDistance == rightDistance) & (leftOrder < rightOrder)))
+                # clips without plays may index past the end here, but those aren't used
+                nearestIndex = np.minimum(np.where(useLeft, leftOrder, rightOrder) + playStarts, len(self.playTimes)-1)
+                nearestStarts = self.playTimes[nearestIndex, 0]
+                # if we are before the first play or after the last one, use the initial offset
+                firstStarts = self.playTimes[np.minimum(self.playStarts, len(self.playTimes)-1), 0][:, np.newaxis]
+                lastEnds = self.playTimes[np.maximum(self.playStarts + self.playCounts - 1, 0), 1][:, np.newaxis]
+                isOutside = (queryMs < firstStarts) | (queryMs > lastEnds)
+                nearestStarts = np.where(isOutside, starts, nearestStarts)
+                starts[isNearest] = nearestStarts[isNearest]
+
+        # see Clip.getClipTime()
+        msSincePlay = ms[np.newaxis, :] - starts
+        durs = self.durs[:, np.newaxis]
+        remainder = np.mod(msSincePlay, self.loopDurs[:, np.newaxis])
+        isReversed = remainder > durs
+        remainder = np.where(isReversed, durs - (remainder - durs) - 1, remainder)
+        remainder = np.maximum(0, np.minimum(durs-1, remainder))
+        return np.round(self.starts[:, np.newaxis] + remainder)
+
+    # a hash of everything toNpArrs() depends on, so cached results can be checked against the timeline that made them
+    def getHash(self, msList=[]):
+        vectors = [clip.vector for clip in self.clips]
+        parents = [v.parent for v in vectors if v.parent is not None]
+        parents = [p for i, p in enumerate(parents) if p not in parents[:i]]
+        h = hashlib.sha1()
+        h.update(repr((self.containerW, self.containerH, self.precision)).encode("utf-8"))
+        h.update(np.array(msList, dtype=np.float64).tobytes())
+        for i, clip in enumerate(self.clips):
+            h.update(repr((clip.props["index"], self.zindices[i], clip.start, clip.dur, clip.initialOffset, [(p[0], p[1]) for p in clip.plays])).encode("utf-8"))
+        for v in vectors + parents:
+            parentIndex = parents.index(v.parent) if v.parent is not None else -1
+            values = [v.size, v.pos, v.origin, v.transformOrigin, v.scale, v.translate, v.rotation, v.alpha, v.blur, v.brightness, parentIndex]
+            keyframes = [(k["name"], k["ms"], k["value"], k["dimension"], k["easing"]) for k in v.keyframes]
+            h.update(repr((values, keyframes)).encode("utf-8"))
+        return h.hexdigest()
+
+    # The largest width (in precision units, like column 2 of toNpArrs()) each clip has between two times, without evaluating every frame.
+    # Width is size * scale * parent scale; between two keyframes of any of those tracks each one follows a single easing, which never
+    # overshoots, so if they all rise or all fall the largest width is at one end. Only stretches where they go in different directions
+    # (or clips with keyframes out of order) are sampled. With a container, widths only count while a clip can be visible (like in
+    # toNpArrsBatch()): stretches are also split at keyframes that move or fade clips, stretches where a clip can't reach the container
+    # are left out, and stretches where it's only sometimes visible are sampled. This can still be larger than the per-frame maximum.
+    def getMaxWidths(self, msStart, msEnd, samples=32):
+        clipCount = len(self.clips)
+        widths = np.zeros(clipCount, dtype=np.int32)
+        if clipCount <= 0:
+            return widths
+
+        tracks = [self.vectors.getTrack("size", 0), self.vectors.getTrack("scale", 0)]
+        unsorted = tracks[0].getUnsortedVectors() | tracks[1].getUnsortedVectors()
+        # see toNpArrsBatch(): the first clip's parent is used for every clip if it has one, otherwise each clip's own parent
+        parentTrack = None
+        parentIds = np.full(clipCount, -1, dtype=np.int64)
+        if self.parentTimeline is not None:
+            parentTrack = self.parentTimeline.getTrack("scale", 0)
+            parentIds[:] = 0
+        elif self.vectors.parentTimeline is not None:
+            parentTrack = self.vectors.parentTimeline.getTrack("scale", 0)
+            parentIds = self.vectors.parentIndices
+        if parentTrack is not None:
+            parentUnsorted = parentTrack.getUnsortedVectors()
+            unsorted |= (parentIds >= 0) & parentUnsorted[np.maximum(parentIds, 0)]
+        hasContainer = self.containerW is not None and self.containerH is not None
+        visibilityUnsorted = self.getVisibilityUnsorted() if hasContainer else None
+
+        # every clip's keyframe times (and its parent's) in range, plus the start and end
+        ids = [np.arange(clipCount), np.arange(clipCount)]
+        times = [np.full(clipCount, msStart, dtype=np.float64), np.full(clipCount, msEnd, dtype=np.float64)]
+        for track in tracks:
+            ids.append(track.vectorIds)
+            times.append(track.times)
+        if parentTrack is not None:
+            for parentId in range(len(parentTrack.defaults)):
+                clipIds = np.nonzero(parentIds == parentId)[0]
+                parentTimes = parentTrack.times[parentTrack.vectorIds == parentId]
+                ids.append(np.repeat(clipIds, len(parentTimes)))
+                times.append(np.tile(parentTimes, len(clipIds)))
+        if hasContainer:
+            vectorIds, vectorTimes = self.vectors.getKeyframeTimes()
+            alphaTrack = self.vectors.getTrack("alpha")
+            ids += [vectorIds, alphaTrack.vectorIds]
+            times += [vectorTimes, alphaTrack.times]
+            if self.parentTimeline is not None:
+                parentTimes = self.parentTimeline.getKeyframeTimes()[1]
+                ids.append(np.repeat(np.arange(clipCount), len(parentTimes)))
+                times.append(np.tile(parentTimes, clipCount))
+        ids = np.concatenate(ids).astype(np.int64)
+        times = np.concatenate(times)
+        inRange = (times >= msStart) & (times <= msEnd)
+        ids = ids[inRange]
+        times = times[inRange]
+        order = np.lexsort((times, ids))
+        ids = ids[order]
+        times = times[order]
+        isNew = np.concatenate(([True], (ids[1:] != ids[:-1]) | (times[1:] != times[:-1])))
+        ids = ids[isNew]
+        times = times[isNew]
+
+        # the width at each keyframe
+        maxes = np.zeros(clipCount)
+        factors = self.getWidthFactorsAt(tracks, parentTrack, parentIds, ids, times)
+        canBeVisible, _isVisible = self.getVisibility(ids, times, times, visibilityUnsorted)
+        np.maximum.at(maxes, ids, np.abs(np.prod(factors, axis=0)) * canBeVisible)
+
+        # just inside each stretch between keyframes ("Invert" easings jump at keyframes, so the ends aren't the keyframe values)
+        sameClip = ids[1:] == ids[:-1]
+        stretchIds = ids[1:][sameClip]
+        t0 = times[:-1][sameClip] + (times[1:] - times[:-1])[sameClip] * 0.000001
+        t1 = times[1:][sameClip] - (times[1:] - times[:-1])[sameClip] * 0.000001
+        factors0 = np.abs(self.getWidthFactorsAt(tracks, parentTrack, parentIds, stretchIds, t0))
+        factors1 = np.abs(self.getWidthFactorsAt(tracks, parentTrack, parentIds, stretchIds, t1))
+        # the product of each factor's largest value is an upper bound, and the actual largest width if every factor rises or every factor falls;
+        # otherwise the bound gets tighter by splitting the stretch into samples
+        stretchMaxes = np.prod(np.maximum(factors0, factors1), axis=0)
+        directions = np.sign(factors1 - factors0)
+        isMixed = np.logical_not(np.all(directions >= 0, axis=0) | np.all(directions <= 0, axis=0)) | unsorted[stretchIds]
+        # stretches where a clip is only visible some of the time are sampled too, so only the visible samples count
+        canBeVisible, isVisible = self.getVisibility(stretchIds, t0, t1, visibilityUnsorted)
+        stretchMaxes[np.logical_not(canBeVisible)] = 0
+        isSampled = (isMixed | np.logical_not(isVisible)) & canBeVisible
+        if np.any(isSampled) and samples > 0:
+            sampledCount = np.count_nonzero(isSampled)
+            amounts = np.arange(samples+2) / (samples + 1.0)
+            sampleIds = np.repeat(stretchIds[isSampled], samples+2)
+            sampleTimes = t0[isSampled][:, np.newaxis] + (t1 - t0)[isSampled][:, np.newaxis] * amounts[np.newaxis, :]
+            sampleFactors = np.abs(self.getWidthFactorsAt(tracks, parentTrack, parentIds, sampleIds, sampleTimes.reshape(-1)))
+            sampleFactors = sampleFactors.reshape(-1, sampledCount, samples+2)
+            sampleMaxes = np.prod(np.maximum(sampleFactors[:, :, 1:], sampleFactors[:, :, :-1]), axis=0)
+            sampleIds = np.repeat(stretchIds[isSampled], samples+1)
+            canBeVisible, _isVisible = self.getVisibility(sampleIds, sampleTimes[:, :-1].reshape(-1), sampleTimes[:, 1:].reshape(-1), visibilityUnsorted)
+            stretchMaxes[isSampled] = np.amax(sampleMaxes * canBeVisible.reshape(sampledCount, samples+1), axis=1)
+        np.maximum.at(maxes, stretchIds, stretchMaxes)
+
+        precisionMultiplier = int(10 ** self.precision)
+        widths[self.indices] = np.round(maxes * precisionMultiplier)
+        return widths
+
+    # whether each clip can be visible (see toNpArrsBatch()) at any time between t0 and t1, and whether it's visible at all of them;
+    # no track may have a keyframe between t0 and t1 (see VectorTimeline.getBounds()), and clips with keyframes out of order always can be
+    def getVisibility(self, ids, t0, t1, unsorted=None):
+        if self.containerW is None or self.containerH is None:
+            return (np.ones(len(ids), dtype=bool), np.ones(len(ids), dtype=bool))
+        parentBounds = self.parentTimeline.getBounds(np.zeros(len(ids), dtype=np.int64), t0, t1) if self.parentTimeline is not None else None
+        bounds = self.vectors.getBounds(ids, t0, t1, parentBounds)
+        x, y = bounds["pos"]
+        width, height = bounds["size"]
+        alpha = self.vectors.getTrackBounds("alpha", None, ids, t0, t1)
+        right = x + width
+        bottom = y + height
+        canBeVisible = (right[1] > 0) & (bottom[1] > 0) & (x[0] < self.containerW) & (y[0] < self.containerH) & (alpha[1] > 0)
+        isVisible = (right[0] > 0) & (bottom[0] > 0) & (x[1] < self.containerW) & (y[1] < self.containerH) & (alpha[0] > 0)
+        if unsorted is not None:
+            canBeVisible |= unsorted[ids]
+            isVisible &= np.logical_not(unsorted[ids])
+        return (canBeVisible, isVisible)
+
+    # clips whose visibility can't be bounded from keyframes because a track getVisibility() reads has keyframes out of order
+    def getVisibilityUnsorted(self):
+        unsorted = self.vectors.getUnsortedVectors() | self.vectors.getTrack("alpha").getUnsortedVectors()
+        if self.parentTimeline is not None and self.parentTimeline.getUnsortedVectors()[0]:
+            unsorted[:] = True
+        return unsorted
+
+    def getWidthFactorsAt(self, tracks, parentTrack, parentIds, ids, times):
+        parentScales = np.ones(len(ids))
+        if parentTrack is not None:
+            hasParent = parentIds[ids] >= 0
+            parentScales[hasParent] = parentTrack.getValuesAt(parentIds[ids][hasParent], times[hasParent])
+        return np.array([track.getValuesAt(ids, times) for track in tracks] + [parentScales])
+
+    def loadPlays(self):
+        clipCount = len(self.clips)
+        self.playCounts = np.array([len(clip.plays) for clip in self.clips], dtype=np.int64)
+        self.playStarts = np.concatenate(([0], np.cumsum(self.playCounts)[:-1])).astype(np.int64)
+        self.playClipIds = np.repeat(np.arange(clipCount), self.playCounts)
+        self.playsSorted = np.ones(clipCount, dtype=bool)
+        playTimes = [(p[0], p[1]) for clip in self.clips for p in clip.plays]
+        self.playTimes = np.array(playTimes, dtype=np.float64).reshape(-1, 2)
+        self.playRunningMaxEnds = np.zeros(len(playTimes))
+        midpoints = (self.playTimes[:, 1] - self.playTimes[:, 0]) * 0.5 + self.playTimes[:, 0]
+        self.playMidpoints = np.zeros(len(playTimes))
+        self.playOrder = np.zeros(len(playTimes), dtype=np.int64)
+        self.playGroupStarts = np.zeros(len(playTimes), dtype=np.int64)
+        for i in range(clipCount):
+            i0 = self.playStarts[i]
+            i1 = i0 + self.playCounts[i]
+            if i1 <= i0:
+                continue
+            times = self.playTimes[i0:i1]
+            self.playsSorted[i] = np.all(times[1:, 0] >= times[:-1, 0])
+            self.playRunningMaxEnds[i0:i1] = np.maximum.accumulate(times[:, 1])
+            # midpoints sorted, remembering their order in the list
+            order = np.argsort(midpoints[i0:i1], kind="stable")
+            self.playMidpoints[i0:i1] = midpoints[i0:i1][order]
+            self.playOrder[i0:i1] = order
+            self.playGroupStarts[i0:i1] = i0 + np.searchsorted(self.playMidpoints[i0:i1], self.playMidpoints[i0:i1], side="left")
+
+    def toNpArr(self, ms):
+        return self.toNpArrs([ms])[0]
+
+    def toNpArrs(self, msList, batchSize=-1):
+        clipCount = len(self.clips)
+        propertyCount = Clip.npPropertyCount()
+        frameCount = len(msList)
+        arrs = np.zeros((frameCount, clipCount, propertyCount), dtype=np.int32)
+        if clipCount <= 0 or frameCount <= 0:
+            return arrs
+
+        # keep temporary arrays to a few million values
+        if batchSize <= 0:
+            batchSize = max(1, int(4000000 / clipCount))
+
+        for i0 in range(0, frameCount, batchSize):
+            ms = np.array(msList[i0:i0+batchSize], dtype=np.float64)
+            arrs[i0:i0+len(ms)] = self.toNpArrsBatch(ms)
+
+        # fall back to the original code for anything the timeline can't represent
+        fallbackClips = [clip for i, clip in enumerate(self.clips) if not self.playsSorted[i]]
+        if len(fallbackClips) > 0:
+            for i, ms in enumerate(msList):
+                parentProps = self.parent.toDict(ms) if self.parent is not None else None
+                for clip in fallbackClips:
+                    arrs[i, clip.props["index"]] = clip.toNpArr(ms, self.containerW, self.containerH, self.precision, parentProps)
+
+        return arrs
+
+    def toNpArrsBatch(self, ms):
+        precisionMultiplier = int(10 ** self.precision)
+        parentProps = None
+        if self.parentTimeline is not None:
+            parentProps = self.parentTimeline.toDict(ms)
+            parentProps = {key: [value[0] for value in values] for key, values in parentProps.items()}
+        transform = self.vectors.toDict(ms, parentProps)
+        x, y = transform["pos"]
+        width, height = transform["size"]
+        alpha = self.vectors.getPropValues("alpha", None, ms)
+
+        t = self.getClipTimes(ms)
+        starts = self.starts[:, np.newaxis]
+        ends = starts + self.durs[:, np.newaxis]
+        tn = np.clip(1.0 * (t - starts) / (ends - starts), 0, 1)
+
+        # update properties if not visible
+        if self.containerW is not None and self.containerH is not None:
+            isVisible = (x+width > 0) & (y+height > 0) & (x < self.containerW) & (y < self.containerH) & (alpha > 0)
+            x = np.where(isVisible, x, 0)
+            y = np.where(isVisible, y, 0)
+            width = np.where(isVisible, width, 0)
+            height = np.where(isVisible, height, 0)
+            alpha = np.where(isVisible, alpha, 0)
+
+        values = {
+            "x": x,
+            "y": y,
+            "width": width,
+            "height": height,
+            "alpha": alpha,
+            "tn": tn,
+            "zindex": np.broadcast_to(self.zindices[:, np.newaxis], x.shape),
+            "rotation": self.vectors.getPropValues("rotation", None, ms),
+            "blur": self.vectors.getPropValues("blur", None, ms),
+            "brightness": self.vectors.getPropValues("brightness", None, ms)
+        }
+        arrs = np.zeros((len(ms), len(self.clips), Clip.npPropertyCount()), dtype=np.int32)
+        for i, p in enumerate(Clip.npProperties):
+            pkey, ptype = p
+            value = values[pkey] * precisionMultiplier if ptype == "f" else values[pkey]
+            arrs[:, self.indices, i] = np.round(value).T
+        return arrs
+
+# the product of two (2, n) arrays of lows and highs, or of one and a constant
+def intervalProduct(a, b):
+    if np.ndim(b) < 2:
+        b = np.array([b, b])
+    products = np.array([a[0] * b[0], a[0] * b[1], a[1] * b[0], a[1] * b[1]])
+    return np.array([np.amin(products, axis=0), np.amax(products, axis=0)])
+
+# For values sorted within each segment (segments laid out one after another), find each segment's insertion index for each time,
+# like bisect in every segment at once. Values and times are replaced by their rank so (segment, rank) fits a single int64 key.
+# If querySegmentIds is given, each time is only searched in its own segment and the result has the shape of ms.
+def searchSegments(values, segmentIds, segmentStarts, ms, side="left", querySegmentIds=None):
+    valueCount = len(values)
+    ranks = np.unique(np.concatenate((values, ms)), return_inverse=True)[1].reshape(-1)
+    rankCount = int(ranks.max()) + 1 if len(ranks) > 0 else 1
+    keys = segmentIds.astype(np.int64) * rankCount + ranks[:valueCount]
+    if querySegmentIds is not None:
+        queries = querySegmentIds.astype(np.int64) * rankCount + ranks[valueCount:]
+        return np.searchsorted(keys, queries, side=side) - segmentStarts[querySegmentIds]
+    queries = np.arange(len(segmentStarts), dtype=np.int64)[:, np.newaxis] * rankCount + ranks[valueCount:][np.newaxis, :]
+    return np.searchsorted(keys, queries, side=side) - segmentStarts[:, np.newaxis]
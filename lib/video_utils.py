@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
 from functools import partial
+import hashlib
 from lib.cache_utils import *
 from lib.clip import *
 from lib.collection_utils import *
+from lib.cpu_utils import *
+from lib.frame_deduper import *
+from lib.frame_encoder import *
+from lib.frame_store import *
+from lib.gpu_compositor import *
 from lib.gpu_utils import *
 from lib.math_utils import *
+from lib.pixel_provider import *
 from lib.processing_utils import *
+from lib.render_manifest import *
+from lib.render_pipeline import *
+from lib.sprite_cache import *
+from lib.timeline import *
 from moviepy.editor import VideoFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 import multiprocessing
 from multiprocessing import Pool
 from multiprocessing.dummy import Pool as ThreadPool
@@ -15,14 +28,24 @@ import numpy as np
 import os
 from PIL import Image, ImageDraw, ImageFilter
 from pprint import pprint
+import queue
 import subprocess
 import sys
+import tempfile
+import threading
 
 def addVideoArgs(parser):
     parser.add_argument('-in', dest="INPUT_FILE", default="tmp/samples.csv", help="Input file")
     parser.add_argument('-ss', dest="EXCERPT_START", type=float, default=-1, help="Excerpt start in seconds")
     parser.add_argument('-sd', dest="EXCERPT_DUR", type=float, default=-1, help="Excerpt duration in seconds")
     parser.add_argument('-db', dest="MASTER_DB", type=float, default=0.0, help="Master +/- decibels to be applied to final audio")
+    parser.add_argument('-mixer', dest="MIXER", default="pydub", help="Audio mixer: pydub or numpy (float32 mixing, faster)")
+    parser.add_argument('-aprocs', dest="AUDIO_PROCESSES", default=1, type=int, help="Number of processes for mixing audio tracks (one per source file) in parallel with -mixer numpy")
+    parser.add_argument('-fxmem', dest="FX_CACHE_MEMORY", default=0, type=float, help="Memory ceiling in GB (per mixing process, e.g. 0.5) for caching clips processed with sound fx, so repeated plays are only processed once; 0 to disable")
+    parser.add_argument('-fxbackend', dest="FX_BACKEND", default="sox", help="Sound fx backend: sox (a sox process per clip) or scipy (in-process filters, faster)")
+    parser.add_argument('-fxdisk', dest="FX_CACHE_DISK", action="store_true", help="Also keep clips processed with sound fx in the cache dir for later renders?")
+    parser.add_argument('-fxdisksize', dest="FX_CACHE_DISK_SIZE", default=2.0, type=float, help="Disk budget in GB for clips kept with -fxdisk; least recently used clips are removed past it")
+    parser.add_argument('-audiocache', dest="AUDIO_CACHE_SIZE", default=0, type=float, help="Disk budget in GB (e.g. 4) for decoded source audio kept in the cache dir between renders; 0 to decode every render and write nothing")
     parser.add_argument('-dir', dest="MEDIA_DIRECTORY", default="media/sample/", help="Input file")
     parser.add_argument('-width', dest="WIDTH", default=1920, type=int, help="Output video width")
     parser.add_argument('-height', dest="HEIGHT", default=1080, type=int, help="Output video height")
@@ -60,6 +83,22 @@ def addVideoArgs(parser):
     parser.add_argument('-probe', dest="PROBE", action="store_true", help="Just spit out duration info?")
     parser.add_argument('-frame', dest="OUTPUT_SINGLE_FRAME", default=-1, type=int, help="Output only a single frame (indicated frame number)")
     parser.add_argument('-frange', dest="FRAME_RANGE", default="1,0", help="Frame range to render")
+    parser.add_argument('-shard', dest="SHARD_OUTPUT", action="store_true", help="Render the frame range as one shard of a larger render (see render_shards.py): clips are sized for the whole composition, audio is not mixed, and frames are not compiled; with -stream, the range is encoded to -out")
+    parser.add_argument('-lprocs', dest="LOAD_PROCESSES", default=1, type=int, help="Number of processes for loading/caching pixel data from source files")
+    parser.add_argument('-lmem', dest="LOAD_MEMORY_BUDGET", default=-1, type=float, help="Approximate memory budget in GB for parallel pixel data loading, -1 for no limit")
+    parser.add_argument('-procs', dest="PROCESSES", default=1, type=int, help="Number of processes for rendering frames in parallel; each renders contiguous chunks of frames, -1 for all cores")
+    parser.add_argument('-compositor', dest="COMPOSITOR", default="gpu", help="Frame compositor: gpu (OpenCL) or cpu (NumPy, no OpenCL needed)")
+    parser.add_argument('-tilesize', dest="TILE_SIZE", default=128, type=int, help="Size in pixels of the tiles the cpu compositor splits frames into; 0 to draw one clip at a time")
+    parser.add_argument('-mips', dest="MIP_LEVELS", default=4, type=int, help="Number of half-size mip levels to cache for each clip frame (down to 16px wide), 0 for none")
+    parser.add_argument('-pixelmem', dest="PIXEL_MEMORY", default=-1, type=float, help="Memory budget in GB (per render process) for clip pixel data; if set, only the frames of clips visible in a window of upcoming frames are read into memory, -1 to keep every frame")
+    parser.add_argument('-pixelwin', dest="PIXEL_WINDOW", default=48, type=int, help="Number of upcoming frames to prefetch clip pixel data for when -pixelmem is set")
+    parser.add_argument('-spritemem', dest="SPRITE_CACHE_MEMORY", default=0.5, type=float, help="Memory ceiling in GB (per render process) for caching rotated, blurred, or resized clips across frames, 0 to disable")
+    parser.add_argument('-spritequant', dest="SPRITE_QUANTIZE", action="store_true", help="Round clip rotation to 0.1 degrees and blur to 0.05px so more clips can be reused from the sprite cache; this changes the output slightly")
+    parser.add_argument('-stream', dest="STREAM_OUTPUT", action="store_true", help="Pipe rendered frames straight into ffmpeg instead of saving and compiling PNG frames")
+    parser.add_argument('-pworkers', dest="PIPELINE_WORKERS", default="", help="Worker threads for each render stage, e.g. evaluate=2,gather=2,composite=1,post=1,output=2; stages not listed get -threads workers")
+    parser.add_argument('-pqueue', dest="PIPELINE_QUEUE", default=4, type=int, help="Number of frames that can wait between render stages")
+    parser.add_argument('-nodedupe', dest="NO_DEDUPE", action="store_true", help="Render every frame, even if it draws exactly the same thing as an earlier frame")
+    parser.add_argument('-tee', dest="TEE_FRAMES", default="", help="When streaming, comma-separated frame numbers to also save as PNGs, or 'all'; debug mode saves all")
 
 def alphaMask(im, mask):
     w, h = im.size
@@ -88,72 +127,29 @@ def applyEffects(im, x, y, rotation=0.0, blur=0.0, mask=None, colors=4):
 
 def blurImage(im, radius):
     if radius > 0.0:
-        im = im.filter(ImageFilter.GaussianBlur(radius=radius))
+        im = im.filter(ImageFilter.GaussianBlur(radius=float(radius)))
     return im
 
 def clipsToFrame(p, clips, pixelData, precision=3, customClipToArrFunction=None, baseImage=None, gpuProgram=None, postProcessingFunction=None, preProcessingFunction=None, globalArgs={}):
-    filename = p["filename"]
-    width = p["width"]
-    height = p["height"]
-
-    frame = getValue(p, "frame", 1)
-    ms = getValue(p, "ms", 0)
-    overwrite = getValue(p, "overwrite", False)
-    verbose = getValue(p, "verbose", False)
-    debug = getValue(p, "debug", False)
-    saveFrame = getValue(p, "saveFrame", filename)
-
-    frameAlpha = getValue(globalArgs, "frameAlpha", None)
-    isSequential = getValue(globalArgs, "isSequential", False)
-    container = getValue(globalArgs, "container", None)
-
-    im = None
-    fileExists = filename and os.path.isfile(filename) and not overwrite
-    clipArr = None
-    returnValue = None
-
-    globalArgsCopy = globalArgs.copy()
-    globalArgsCopy["frame"] = frame
-    globalArgsCopy["debug"] = debug
-
-    if not fileExists and saveFrame or not saveFrame or isSequential:
-        clipArr = clipsToNpArr(clips, ms, width, height, precision, customClipToArrFunction=customClipToArrFunction, globalArgs=globalArgsCopy)
-
-    # frame does not exist, create frame image
-    if not fileExists:
-        im = Image.new(mode="RGBA", size=(width, height), color=(0, 0, 0, 255))
-        if preProcessingFunction is not None:
-            baseImage = preProcessingFunction(baseImage, ms, globalArgs=globalArgs)
-        if pixelData is None:
-            im = clipsToFrameOnTheFly(clips, clipArr, width, height, precision, baseImage=baseImage, globalArgs=globalArgsCopy)
-        else:
-            im = clipsToFrameGPU(clipArr, width, height, pixelData, precision, baseImage=baseImage, gpuProgram=gpuProgram, globalArgs=globalArgs)
-        im = im.convert("RGB")
-        # check to see if we're applying container-level effects
-        if container is not None:
-            # right now we only care about blur
-            blur = container.vector.getBlur(ms)
-            if blur > 0.0:
-                im = blurImage(im, blur)
-        # check to see if there's post-processing to be done
-        if postProcessingFunction is not None:
-            im = postProcessingFunction(im, ms, globalArgs=globalArgs)
-        # save if necessary
-        if saveFrame:
-            im.save(filename)
-            print("Saved frame %s" % filename)
-        if frameAlpha is None:
-            returnValue = im
-
-    # frame has alpha, so darken for next frame
-    if frameAlpha is not None and 0.0 <= frameAlpha < 1.0:
-        if im is None:
-            im = Image.open(filename)
-        blackOverlay = Image.new(mode="RGB", size=im.size, color=(0, 0, 0))
-        im = Image.blend(im, blackOverlay, frameAlpha)
-        returnValue = im
-
-    return returnValue
+    context = {
+        "clips": clips,
+        "pixelData": pixelData,
+        "precision": precision,
+        "customClipToArrFunction": customClipToArrFunction,
+        "baseImage": baseImage,
+        "gpuProgram": gpuProgram,
+        "postProcessingFunction": postProcessingFunction,
+        "preProcessingFunction": preProcessingFunction,
+        "globalArgs": globalArgs
+    }
+    # run each render stage in turn (processFrames may run them as a pipeline instead)
+    job = renderFrameEvaluate({"params": p}, context)
+    frameDeduper = getValue(globalArgs, "frameDeduper", None)
+    if job["frameKey"] is not None:
+        job["dupe"] = frameDeduper.get(job["frameKey"])
+    for stage in [renderFrameGather, renderFrameComposite, renderFramePostProcess, renderFrameOutput]:
+        job = stage(job, context)
+    return job["returnValue"]
 
 def clipsToFrameOnTheFly(clips, clipArrs, width, height, precision=3, baseImage=None, globalArgs={}):
     debug = getValue(globalArgs, "debug", False)
@@ -195,119 +191,20 @@ def clipsToFrameOnTheFly(clips, clipArrs, width, height, precision=3, baseImage=
         for pd in pixelData:
             for i, pixels in pd:
                 clipsPixelData[i] = [pixels]
-        baseImage = clipsToFrameGPU(validClipArrs, width, height, clipsPixelData, precision, baseImage, globalArgs=globalArgs)
+        # pixels are loaded fresh for each frame, so sprites are identified by their source file and time
+        sourceKeys = [(clip["filename"], clip["t"]) for clip in validClips]
+        baseImage = clipsToFrameGPU(validClipArrs, width, height, clipsPixelData, precision, baseImage, globalArgs=globalArgs, sourceKeys=sourceKeys)
 
     return baseImage
 
-def clipsToFrameGPU(clips, width, height, clipsPixelData, precision=3, baseImage=None, gpuProgram=None, globalArgs={}):
-    c = getValue(globalArgs, "colors", 3)
-    offset = 0
-    maxScaleFactor = 2.0
-    precisionMultiplier = int(10 ** precision)
-
-    # filter out clips with no pixels, or zero [width, height, alpha]
-    # keep track of how many pixels we'll need
-    indices = []
-    pixelCount = 0
-    for i in range(len(clips)):
-        clip = clipArrToDict(clips[i], precision)
-        frameCount = len(clipsPixelData[i])
-        # only take clips that are visible
-        if frameCount > 0 and clip["width"] > 0.0 and clip["height"] > 0.0 and clip["alpha"] > 0.0:
-            indices.append(i)
-            tn = clip["tn"]
-            h, w, _ = clipsPixelData[i][roundInt(tn * (frameCount-1))].shape
-            # we want to resample if scaled too much
-            scaleFactor = 1.0 * w / clip["width"]
-            if scaleFactor > maxScaleFactor:
-                w = roundInt(clip["width"])
-                h = roundInt(clip["height"])
-            # we need to resize if blurred or rotated
-            if clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0:
-                _x, _y, newW, newH = bboxRotate(0, 0, roundInt(clip["width"]), roundInt(clip["height"]), angle=45.0)
-                w = roundInt(newW)
-                h = roundInt(newH)
-            pixelCount += int(h*w*c)
-
-    validCount = len(indices)
-    propertyCount = Clip.gpuPropertyCount
-    properties = np.zeros((validCount, propertyCount), dtype=np.int32)
-    pixelData = np.zeros(pixelCount, dtype=np.uint8)
-    for i, clipIndex in enumerate(indices):
-        clipArr = clips[clipIndex]
-        x, y, tw, th, alpha, t, zindex, rotation, blur, brightness = tuple(clipArr)
-        clip = clipArrToDict(clipArr, precision)
-        clipPixelData = clipsPixelData[clipIndex]
-        frameCount = len(clipPixelData)
-        tn = clip["tn"]
-        pixels = clipPixelData[roundInt(tn * (frameCount-1))]
-        h, w, _c = pixels.shape
-        # we want to resample if scaled too much
-        scaleFactor = 1.0 * w / clip["width"]
-        if scaleFactor > maxScaleFactor or clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0:
-            rw = roundInt(clip["width"])
-            rh = roundInt(clip["height"])
-            im = None
-            # assume we are debugging if single pixel
-            if h==1 and w==1:
-                newPixels = np.zeros((rh, rw, _c), dtype=np.uint8)
-                newPixels[:,:] = pixels[0,0]
-                im = Image.fromarray(newPixels, mode="RGB")
-            else:
-                im = Image.fromarray(pixels, mode="RGB")
-
-            # apply effects before resize for better quality
-            if clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0:
-                im, _x, _y = applyEffects(im, 0, 0, clip["rotation"], clip["blur"], colors=c)
-                # retrieve new coordinates based on target/resized size
-                newX, newY, newW, newH = bboxRotate(clip["x"], clip["y"], roundInt(clip["width"]), roundInt(clip["height"]), angle=45.0)
-                rw = roundInt(newW)
-                rh = roundInt(newH)
-                # x, y, tw, th changes if we rotate or blur
-                x = roundInt(newX * precisionMultiplier)
-                y = roundInt(newY * precisionMultiplier)
-                tw = roundInt(newW * precisionMultiplier)
-                th = roundInt(newH * precisionMultiplier)
-
-            # resize image
-            imW, imH = im.size
-            if imW != rw or imH != rh:
-                resampleType = Image.LANCZOS if imW > rw else Image.NEAREST
-                im = im.resize((rw, rh), resample=resampleType)
-
-            # im.save("output/test_pil.png")
-            pixels = np.array(im)
-            h, w, _c = pixels.shape
-        # pixels are size 3, but need size 4
-        if c > _c:
-            fillVals = np.full((h, w, 1), 255, dtype='uint8')
-            pixels = np.concatenate((pixels, fillVals), axis=2)
-        properties[i] = np.array([offset, x, y, w, h, tw, th, alpha, zindex, brightness])
-        px0 = offset
-        px1 = px0 + int(h*w*c)
-        pixelData[px0:px1] = pixels.reshape(-1)
-        offset += int(h*w*c)
-
-    pixels = clipsToImageGPU(width, height, pixelData, properties, c, precision, gpuProgram=gpuProgram, baseImage=baseImage)
-    return Image.fromarray(pixels, mode="RGB")
+def clipsToFrameGPU(clips, width, height, clipsPixelData, precision=3, baseImage=None, gpuProgram=None, globalArgs={}, sourceKeys=None):
+    properties, pixelData = gatherClipPixels(clips, clipsPixelData, precision, gpuProgram=gpuProgram, globalArgs=globalArgs, sourceKeys=sourceKeys)
+    return compositeClipPixels(width, height, properties, pixelData, precision, baseImage=baseImage, gpuProgram=gpuProgram, globalArgs=globalArgs)
 
 def compileFrames(infile, fps, outfile, padZeros, audioFile=None, quality="high"):
     print("Compiling frames...")
     padStr = '%0'+str(padZeros)+'d'
-
-    # https://trac.ffmpeg.org/wiki/Encode/H.264
-    # presets: veryfast, faster, fast, medium, slow, slower, veryslow
-    #   slower = better quality
-    # crf: 0 is lossless, 23 is the default, and 51 is worst possible quality
-    #   17 or 18 to be visually lossless or nearly so
-    preset = "veryslow"
-    crf = "18"
-    if quality=="medium":
-        preset = "medium"
-        crf = "23"
-    elif quality=="low":
-        preset = "medium"
-        crf = "28"
+    preset, crf = getEncodingQuality(quality)
 
     if audioFile:
         command = ['ffmpeg','-y',
@@ -339,6 +236,42 @@ def compileFrames(infile, fps, outfile, padZeros, audioFile=None, quality="high"
     finished = subprocess.check_call(command)
     print("Done.")
 
+def compositeClipPixels(width, height, properties, pixelData, precision=3, baseImage=None, gpuProgram=None, globalArgs={}):
+    c = getValue(globalArgs, "colors", 3)
+    tileSize = getValue(globalArgs, "tileSize", 128)
+    if getValue(globalArgs, "compositor", "gpu") == "cpu" and tileSize > 0:
+        pixels = clipsToImageTilesCPU(width, height, pixelData, properties, c, precision, baseImage=baseImage, tileSize=tileSize, pool=getValue(globalArgs, "tilePool", None))
+    elif getValue(globalArgs, "compositor", "gpu") == "cpu":
+        pixels = clipsToImageCPU(width, height, pixelData, properties, c, precision, baseImage=baseImage)
+    elif isinstance(gpuProgram, GPUCompositor):
+        pixels = gpuProgram.makeImage(properties, pixelData, baseImage=baseImage)
+    else:
+        pixels = clipsToImageGPU(width, height, pixelData, properties, c, precision, gpuProgram=gpuProgram, baseImage=baseImage)
+    return Image.fromarray(pixels, mode="RGB")
+
+# join videos with the same encoding end to end without re-encoding them, optionally adding an audio track
+def concatVideos(filenames, outfile, audioFile=None):
+    print("Joining %s videos..." % len(filenames))
+    listFilename = os.path.splitext(outfile)[0] + ".concat.txt"
+    with open(listFilename, "w", encoding="utf8") as f:
+        for fn in filenames:
+            f.write("file '%s'\n" % os.path.abspath(fn).replace("'", "'\\''"))
+    command = ['ffmpeg','-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', listFilename]
+    if audioFile:
+        command += ['-i', audioFile,
+                    '-map', '0:v',
+                    '-map', '1:a',
+                    '-c:a', 'aac',
+                    '-b:a', '192k']
+    command += ['-c:v', 'copy', outfile]
+    print(" ".join(command))
+    finished = subprocess.check_call(command)
+    os.remove(listFilename)
+    print("Done.")
+
 def containImage(img, w, h, resampleType="default", bgcolor=[0,0,0]):
     resampleType = Image.LANCZOS if resampleType=="default" else resampleType
     vw, vh = img.size
@@ -438,6 +371,111 @@ def frameToMs(frame, fps, roundResult=True):
         result = roundInt(result)
     return result
 
+# the compositor's clip properties and pixel data for a frame's clip array
+def gatherClipPixels(clips, clipsPixelData, precision=3, gpuProgram=None, globalArgs={}, sourceKeys=None):
+    c = getValue(globalArgs, "colors", 3)
+    spriteCache = getValue(globalArgs, "spriteCache", None)
+    offset = 0
+    maxScaleFactor = 2.0
+    precisionMultiplier = int(10 ** precision)
+    # clip frames that are drawn as-is can be read from the compositor's device atlas, so only the rest need to be sent
+    atlasOffsets = gpuProgram.atlasOffsets if isinstance(gpuProgram, GPUCompositor) else None
+
+    # filter out clips with no pixels, or zero [width, height, alpha]
+    # keep track of how many pixels we'll need
+    indices = []
+    pixelCount = 0
+    for i in range(len(clips)):
+        clip = clipArrToDict(clips[i], precision)
+        # rotation and blur are snapped to the cache's steps so cached sprites can be reused
+        if spriteCache is not None:
+            clip["rotation"], clip["blur"] = spriteCache.quantize(clip["rotation"], clip["blur"])
+        frameCount = len(clipsPixelData[i])
+        # only take clips that are visible
+        if frameCount > 0 and clip["width"] > 0.0 and clip["height"] > 0.0 and clip["alpha"] > 0.0:
+            indices.append(i)
+            tn = clip["tn"]
+            # frames with mip levels are drawn from the smallest level that's still at least as wide as the clip
+            _level, pixels = getMipLevel(clipsPixelData[i][roundInt(tn * (frameCount-1))], clip["width"])
+            h, w, _ = pixels.shape
+            # we want to resample if scaled too much
+            scaleFactor = 1.0 * w / clip["width"]
+            if scaleFactor > maxScaleFactor:
+                w = roundInt(clip["width"])
+                h = roundInt(clip["height"])
+            # we need to resize if blurred or rotated
+            if clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0:
+                _x, _y, newW, newH = bboxRotate(0, 0, roundInt(clip["width"]), roundInt(clip["height"]), angle=45.0)
+                w = roundInt(newW)
+                h = roundInt(newH)
+            elif atlasOffsets is not None and scaleFactor <= maxScaleFactor:
+                continue
+            pixelCount += int(h*w*c)
+
+    validCount = len(indices)
+    propertyCount = Clip.gpuPropertyCount
+    properties = np.zeros((validCount, propertyCount), dtype=np.int32)
+    pixelData = np.zeros(pixelCount, dtype=np.uint8)
+    for i, clipIndex in enumerate(indices):
+        clipArr = clips[clipIndex]
+        x, y, tw, th, alpha, t, zindex, rotation, blur, brightness = tuple(clipArr)
+        clip = clipArrToDict(clipArr, precision)
+        if spriteCache is not None:
+            clip["rotation"], clip["blur"] = spriteCache.quantize(clip["rotation"], clip["blur"])
+        clipPixelData = clipsPixelData[clipIndex]
+        frameCount = len(clipPixelData)
+        tn = clip["tn"]
+        frameIndex = roundInt(tn * (frameCount-1))
+        level, pixels = getMipLevel(clipPixelData[frameIndex], clip["width"])
+        h, w, _c = pixels.shape
+        # we want to resample if scaled too much
+        scaleFactor = 1.0 * w / clip["width"]
+        needsResample = scaleFactor > maxScaleFactor or clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0
+        if not needsResample and atlasOffsets is not None:
+            properties[i] = np.array([atlasOffsets[clipIndex][frameIndex][level], x, y, w, h, tw, th, alpha, zindex, brightness])
+            continue
+        if needsResample:
+            rw = roundInt(clip["width"])
+            rh = roundInt(clip["height"])
+            rotation = clip["rotation"]
+            blur = clip["blur"]
+            if clip["blur"] > 0.0 or clip["rotation"] % 360.0 > 0.0:
+                # retrieve new coordinates based on target/resized size
+                newX, newY, newW, newH = bboxRotate(clip["x"], clip["y"], roundInt(clip["width"]), roundInt(clip["height"]), angle=45.0)
+                rw = roundInt(newW)
+                rh = roundInt(newH)
+                # x, y, tw, th changes if we rotate or blur
+                x = roundInt(newX * precisionMultiplier)
+                y = roundInt(newY * precisionMultiplier)
+                tw = roundInt(newW * precisionMultiplier)
+                th = roundInt(newH * precisionMultiplier)
+
+            # the same source frame is often drawn with the same transform over consecutive frames
+            spriteKey = None
+            sprite = None
+            if spriteCache is not None:
+                sourceKey = sourceKeys[clipIndex] if sourceKeys is not None else clipIndex
+                spriteKey = spriteCache.getKey((sourceKey, frameIndex, level), rotation, blur, rw, rh, c)
+                sprite = spriteCache.get(spriteKey)
+            if sprite is None:
+                sprite = transformClipPixels(pixels, rw, rh, rotation, blur, c)
+                if spriteCache is not None:
+                    spriteCache.set(spriteKey, sprite)
+            pixels = sprite
+            h, w, _c = pixels.shape
+        # pixels are size 3, but need size 4
+        if c > _c:
+            fillVals = np.full((h, w, 1), 255, dtype='uint8')
+            pixels = np.concatenate((pixels, fillVals), axis=2)
+        # with an atlas, pixels made for this frame are flagged with a negative offset
+        properties[i] = np.array([offset if atlasOffsets is None else -offset-1, x, y, w, h, tw, th, alpha, zindex, brightness])
+        px0 = offset
+        px1 = px0 + int(h*w*c)
+        pixelData[px0:px1] = pixels.reshape(-1)
+        offset += int(h*w*c)
+
+    return (properties, pixelData)
+
 def getAlpha(clip):
     alpha = clip["alpha"] if "alpha" in clip and clip["alpha"] < 1.0 else 1.0
     return roundInt(alpha*255)
@@ -447,6 +485,21 @@ def getCenter(clip):
     cy = clip["y"] + clip["height"] * 0.5
     return (cx, cy)
 
+# the source frame time for each of a clip's frames; times missing from availableTimes (sorted) use the nearest earlier available frame, or the first one
+def getClipFrameTimes(clip, msStep, availableTimes=None):
+    times = []
+    ms = clip["start"]
+    end = ms + clip["dur"]
+    while ms < end:
+        times.append(roundInt(ms))
+        ms += msStep
+    if availableTimes is not None:
+        if len(availableTimes) <= 0:
+            raise ValueError("No frames could be read for clip %s" % clip["index"])
+        indices = np.searchsorted(availableTimes, times, side="right") - 1
+        times = [availableTimes[max(index, 0)] for index in indices]
+    return times
+
 def getDurationFromFile(filename, accurate=False):
     result = 0
     if os.path.isfile(filename):
@@ -477,6 +530,45 @@ def getEmptyVideoClipImage(clip):
     clipImg = Image.fromarray(videoPixels, mode="RGBA")
     return clipImg
 
+# a render manifest key for each frame (see RenderManifest); clipsPixelData is None if clips are drawn from their source files on the fly
+def getFrameRenderKeys(frames, clips, clipsPixelData, precision=3, customClipToArrFunction=None, globalArgs={}):
+    if len(frames) <= 0:
+        return []
+    width = frames[0]["width"]
+    height = frames[0]["height"]
+    container = getValue(globalArgs, "container", None)
+    msList = [frame["ms"] for frame in frames]
+    if customClipToArrFunction is None:
+        clipArrs = Timeline(clips, width, height, precision).toNpArrs(msList)
+    else:
+        clipArrs = [clipsToNpArr(clips, frame["ms"], width, height, precision, customClipToArrFunction=customClipToArrFunction, globalArgs=dict(globalArgs, frame=getValue(frame, "frame", 1))) for frame in frames]
+    frameCounts = [len(clipsPixelData[i]) for i in range(len(clips))] if clipsPixelData is not None else None
+
+    # where each clip's pixels come from; a source file that was replaced under the same name has a different modification time or size
+    fileKeys = {}
+    for clip in clips:
+        fn = clip.props["filename"]
+        if fn not in fileKeys:
+            fileKeys[fn] = (os.path.getmtime(fn), os.path.getsize(fn)) if os.path.isfile(fn) else None
+    clipIds = np.zeros(len(clips), dtype=np.int64)
+    for clip in clips:
+        p = clip.props
+        source = (p["filename"], fileKeys[p["filename"]], p["start"], p["dur"], getValue(p, "maxWidth", None), getValue(p, "maxHeight", None), getValue(p, "resizeMode", None))
+        clipIds[p["index"]] = int(hashlib.sha1(repr(source).encode("utf-8")).hexdigest()[:15], 16)
+
+    # everything else that changes how frames look
+    baseImage = getValue(globalArgs, "baseImage", None)
+    settingKeys = ["colors", "compositor", "resizeMode", "mipLevels", "frameAlpha", "spriteQuantize"]
+    settings = [(width, height, precision, getValue(frames[0], "debug", False))] + [getValue(globalArgs, key, None) for key in settingKeys]
+    settings.append(hashlib.sha1(np.array(baseImage).tobytes()).hexdigest() if baseImage is not None else None)
+    settings.append(getattr(customClipToArrFunction, "__name__", None))
+
+    keys = []
+    for ms, clipArr in zip(msList, clipArrs):
+        containerBlur = container.vector.getBlur(ms) if container is not None else 0.0
+        keys.append(getFrameStateKey(clipArr, frameCounts, precision, (settings, containerBlur), clipIds))
+    return keys
+
 # e.g. returns ['audio', 'video'] for a/v files
 def getMediaTypes(filename):
     result = []
@@ -516,6 +608,71 @@ def getVideoClipImage(video, videoDur, clip, t=None, resizeMode="fill", resample
     clipImg = resizeImage(clipImg, cw, ch, resizeMode, resampleType)
     return clipImg
 
+# Extract many clip frames from a single file in one forward pass of ffmpeg instead of seeking once per frame
+#   requests is a list of (ms, width, height, resizeMode); returns a list of (height, width, 3) uint8 arrays in the same order,
+#   matching the layout of np.array(getVideoClipImage(...)), with None for frames that could not be read (e.g. past the end of the stream)
+def getVideoClipPixels(filename, requests, maxGapMs=30000, maxOutputs=16):
+    results = [None] * len(requests)
+    if len(requests) <= 0:
+        return results
+    info = ffmpeg_parse_infos(filename)
+    videoFps = info["video_fps"]
+    videoDur = info["duration"]
+
+    # map each request to a source frame index and an output geometry
+    items = []
+    for i, request in enumerate(requests):
+        t, w, h, resizeMode = request
+        videoT = t / 1000.0
+        delta = videoDur - videoT
+        # check if we need to loop video clip
+        if delta < 0:
+            videoT = videoT % videoDur
+        # hack: ffmpeg sometimes has trouble reading the very end of the video; choose 500ms from end
+        elif delta < 0.5:
+            videoT = videoDur - 0.5
+        index = int(videoFps * max(0, videoT) + 0.00001)
+        items.append((index, (roundInt(w), roundInt(h), resizeMode), i))
+    items = sorted(items)
+
+    # split into separate forward passes where there is a large gap between the frames we need
+    maxGapFrames = max(1, roundInt(maxGapMs / 1000.0 * videoFps))
+    passes = [[items[0]]]
+    for item in items[1:]:
+        if item[0] - passes[-1][-1][0] > maxGapFrames:
+            passes.append([])
+        passes[-1].append(item)
+
+    for passItems in passes:
+        startIndex = passItems[0][0]
+        geometries = sorted(list(set([item[1] for item in passItems])))
+        for j in range(0, len(geometries), maxOutputs):
+            outputs = []
+            for geometry in geometries[j:j+maxOutputs]:
+                indices = sorted(list(set([item[0] - startIndex for item in passItems if item[1]==geometry])))
+                outputs.append((geometry, indices))
+            frames = readVideoFrames(filename, videoFps, startIndex, outputs)
+            for index, geometry, i in passItems:
+                if (geometry, index - startIndex) in frames:
+                    results[i] = frames[(geometry, index - startIndex)]
+
+    for index, geometry, i in items:
+        if results[i] is None:
+            print("Could not read pixels for %s at frame %s" % (filename, index))
+
+    return results
+
+# pick the smallest mip level that's at least as wide as the clip will be drawn; frames without mip levels are just arrays
+def getMipLevel(frame, width):
+    if not isinstance(frame, tuple):
+        return (0, frame)
+    level = 0
+    for i, pixels in enumerate(frame):
+        if pixels.shape[1] < width:
+            break
+        level = i
+    return (level, frame[level])
+
 def getRotation(clip):
     rotation = clip["rotation"] if "rotation" in clip else 0.0
     angle = normalizeAngle(rotation)
@@ -524,7 +681,173 @@ def getRotation(clip):
 def hasAudio(filename):
     return ("audio" in getMediaTypes(filename))
 
-def loadVideoPixelData(clips, fps, cacheDir="tmp/", width=None, height=None, verifyData=True, cache=True, resizeMode="fill"):
+def isRenderJobDone(job):
+    return job["fileExists"] or job["dupe"] is not None or getValue(job, "isDupe", False)
+
+def loadGPUCompositor(width, height, colorDimensions, precision, clipsPixelData, globalArgs={}):
+    compositor = GPUCompositor(width, height, Clip.gpuPropertyCount, colorDimensions, precision, cacheDir=getValue(globalArgs, "cacheDir", None))
+    # clip pixel data stays on the device for the whole render when it fits; streamed pixel data is sent with each frame
+    if clipsPixelData is not None and not isinstance(clipsPixelData, PixelProvider):
+        compositor.loadAtlas(clipsPixelData)
+    return compositor
+
+# make sure each mip store has a level for each time, at the size that matches the store's current frame
+def loadMipFrameStores(store, times, mipLevels):
+    mipStores = getMipFrameStores(store, mipLevels)
+    batchSize = 100
+    for i in range(0, len(times), batchSize):
+        levelFrames = [[] for level in range(mipLevels)]
+        for t in times[i:i+batchSize]:
+            h, w, _ = store.getShape(t)
+            sizes = getMipSizes(w, h, mipLevels)
+            isValid = True
+            for level, size in enumerate(sizes):
+                mw, mh = size
+                if not mipStores[level].hasFrame(t) or mipStores[level].getShape(t)[:2] != (mh, mw):
+                    isValid = False
+                    break
+            if isValid:
+                continue
+            levels = makeMipLevels(store.getFrame(t), sizes)
+            for level, pixels in enumerate(levels):
+                levelFrames[level].append((t, pixels))
+        for level, frames in enumerate(levelFrames):
+            mipStores[level].appendFrames(frames)
+    return mipStores
+
+def loadVideoFileFrames(p):
+    fn = p["filename"]
+    vclips = p["clips"]
+    msStep = p["msStep"]
+    cacheDir = p["cacheDir"]
+    resizeMode = p["resizeMode"]
+    verifyData = p["verifyData"]
+    cache = p["cache"]
+    mipLevels = getValue(p, "mipLevels", 0)
+
+    # check for cache for filename; frames are kept in a memory-mapped frame store
+    cacheFn = cacheDir + os.path.basename(fn) + ".p"
+    store = None
+    frames = {}
+    if cache:
+        store = frameStoreFromCacheFile(cacheFn, cacheDir + os.path.basename(fn))
+    loaded = store is not None and len(store.lookup) > 0
+    hasFrame = store.hasFrame if store is not None else (lambda t: t in frames)
+    getShape = store.getShape if store is not None else (lambda t: frames[t].shape)
+
+    # Verify loaded data
+    if loaded and verifyData:
+        print("Verifying cache data for %s..." % store.filename)
+        for clip in vclips:
+            start = clip["start"]
+            end = start + clip["dur"]
+            ms = start
+            while ms < end:
+                t = roundInt(ms)
+                ms += msStep
+                if not hasFrame(t):
+                    print("%s not found in %s. Resetting cache data" % (t, store.filename))
+                    loaded = False
+                    break
+                clipH, clipW, _ = getShape(t)
+                if roundInt(clip["maxWidth"]) > clipW:
+                    print("Clip width is too small (%s > %s) for %s at %s. Resetting cache data" % (clip["maxWidth"], clipW, store.filename, t))
+                    loaded = False
+                    break
+                # TODO: Add check for aspect ratio?
+            if not loaded:
+                break
+        print("Verified cache data for %s" % store.filename)
+
+    if not loaded:
+        print("No cache for %s, rebuilding..." % fn)
+
+        # collect every frame we need from this file; existing frames in the store are kept and only missing or too small frames are extracted
+        requests = {}
+        for clip in vclips:
+            start = clip["start"]
+            end = start + clip["dur"]
+            ms = start
+            clipResizeMode = getValue(clip, "resizeMode", resizeMode)
+            while ms < end:
+                t = roundInt(ms)
+                ms += msStep
+                # already exists, check size
+                if hasFrame(t):
+                    clipH, clipW, _ = getShape(t)
+                    if roundInt(clip["maxWidth"]) <= clipW:
+                        continue
+                # the same time may be used by more than one clip; keep the largest
+                if t not in requests or clip["maxWidth"] > requests[t][1]:
+                    requests[t] = (t, clip["maxWidth"], clip["maxHeight"], clipResizeMode)
+        requests = sorted(requests.values())
+
+        # extract frames from video in a single forward pass
+        # frames that couldn't be read are never persisted, so they're requested again next time; clips fall back to a nearby frame
+        pixels = getVideoClipPixels(fn, requests)
+        fileFrames = [(request[0], pixels[j]) for j, request in enumerate(requests) if pixels[j] is not None]
+        if store is not None:
+            store.appendFrames(fileFrames)
+        else:
+            frames.update(fileFrames)
+
+    # store half-size copies of each frame so clips drawn small can read a smaller level instead of resizing every frame
+    if mipLevels > 0:
+        times = set([])
+        for clip in vclips:
+            ms = clip["start"]
+            while ms < clip["start"] + clip["dur"]:
+                times.add(roundInt(ms))
+                ms += msStep
+        times = sorted([t for t in times if hasFrame(t)])
+        if store is not None:
+            loadMipFrameStores(store, times, mipLevels)
+        else:
+            for t in times:
+                frame = frames[t] if not isinstance(frames[t], tuple) else frames[t][0]
+                h, w, _ = frame.shape
+                levels = makeMipLevels(frame, getMipSizes(w, h, mipLevels))
+                frames[t] = tuple([frame] + levels) if len(levels) > 0 else frame
+
+    return store if store is not None else frames
+
+def loadVideoFileFramesParallel(fileParams, processes, memoryBudget=-1):
+    fileCount = len(fileParams)
+    # estimate how much memory a worker needs to hold a file's extracted frames before writing them
+    estimates = []
+    for p in fileParams:
+        estimate = 0
+        for clip in p["clips"]:
+            frameCount = ceilInt(clip["dur"] / p["msStep"])
+            estimate += frameCount * ceilInt(clip["maxWidth"]) * ceilInt(clip["maxHeight"]) * 3
+        estimates.append(estimate)
+
+    print("Loading pixel data from %s files with %s processes..." % (fileCount, processes))
+    pool = Pool(processes)
+    finished = queue.Queue()
+    inFlight = {}
+    nextIndex = 0
+    completed = 0
+    while completed < fileCount:
+        # schedule as many files as the process count and memory budget allow; always allow at least one
+        while nextIndex < fileCount and len(inFlight) < processes:
+            estimate = estimates[nextIndex]
+            if memoryBudget > 0 and len(inFlight) > 0 and sum(inFlight.values()) + estimate > memoryBudget:
+                break
+            inFlight[nextIndex] = estimate
+            pool.apply_async(loadVideoFileFrames, (fileParams[nextIndex],), callback=(lambda result, i=nextIndex: finished.put((i, None))), error_callback=(lambda err, i=nextIndex: finished.put((i, err))))
+            nextIndex += 1
+        i, err = finished.get()
+        if err is not None:
+            pool.terminate()
+            raise err
+        del inFlight[i]
+        completed += 1
+        printProgress(completed, fileCount)
+    pool.close()
+    pool.join()
+
+def loadVideoPixelData(clips, fps, cacheDir="tmp/", width=None, height=None, verifyData=True, cache=True, resizeMode="fill", processes=1, memoryBudget=-1, mipLevels=0, pixelMemory=-1, pixelWindow=48):
     # load videos
     filenames = list(set([clip.props["filename"] for clip in clips]))
     fileCount = len(filenames)
@@ -541,107 +864,51 @@ def loadVideoPixelData(clips, fps, cacheDir="tmp/", width=None, height=None, ver
         if "maxHeight" not in clip.props:
             clip.setProp("maxHeight", clip.props["height"])
 
-    # only open one video at a time
-    for i, fn in enumerate(filenames):
-        # check for cache fors filename
-        cacheFn = cacheDir + os.path.basename(fn) + ".p"
-        loaded = False
-        fileCacheData = []
-        if cache:
-            loaded, fileCacheData = loadCacheFile(cacheFn)
-        vclips = [c for c in clips if fn==c.props["filename"]]
-        valid = True
-
-        # Verify loaded data
-        if loaded and verifyData:
-            print("Verifying cache data for %s..." % cacheFn)
-            clipTimesSet = set(fileCacheData[0])
-            for clip in vclips:
-                start = clip.props["start"]
-                end = start + clip.props["dur"]
-                ms = start
-                while ms < end:
-                    t = roundInt(ms)
-                    ms += msStep
-                    if t not in clipTimesSet:
-                        print("%s not found in %s. Resetting cache data" % (t, cacheFn))
-                        loaded = False
-                        break
-                    index = fileCacheData[0].index(t)
-                    clipH, clipW, _ = fileCacheData[1][index].shape
-                    if roundInt(clip.props["maxWidth"]) > clipW:
-                        print("Clip width is too small (%s > %s) for %s at %s. Resetting cache data" % (clip.props["maxWidth"], clipW, cacheFn, t))
-                        loaded = False
-                        break
-                    # TODO: Add check for aspect ratio?
-                if not loaded:
-                    break
-            print("Verified cache data for %s" % cacheFn)
-
-        if not loaded:
-            print("No cache for %s, rebuilding..." % fn)
-            video = VideoFileClip(fn, audio=False)
-            videoDur = video.duration
-            clipTimes = []
-            clipPixels = []
-
-            # Already loaded cache data; append to it rather than overwrite it
-            if len(fileCacheData) > 0:
-                clipTimes, clipPixels = fileCacheData
-
-            # extract frames from videos
-            vclipCount = len(vclips)
-            for j, clip in enumerate(vclips):
-                start = clip.props["start"]
-                end = start + clip.props["dur"]
-                ms = start
-                while ms < end:
-                    fclip = clip.props.copy()
-                    fclip["width"] = fclip["maxWidth"]
-                    fclip["height"] = fclip["maxHeight"]
-                    t = roundInt(ms)
-                    ms += msStep
-                    # already exists, check size
-                    existIndex = None
-                    if t in set(clipTimes):
-                        existIndex = clipTimes.index(t)
-                        clipH, clipW, _ = clipPixels[existIndex].shape
-                        if roundInt(fclip["width"]) <= clipW:
-                            continue
-                    clipResizeMode = getValue(clip.props, "resizeMode", resizeMode)
-                    clipImg = getVideoClipImage(video, videoDur, fclip, t, clipResizeMode)
-                    if existIndex is not None:
-                        clipPixels[existIndex] = np.array(clipImg, dtype=np.uint8)
-                    else:
-                        clipTimes.append(t)
-                        clipPixels.append(np.array(clipImg, dtype=np.uint8))
-                printProgress(j+1, vclipCount)
-
-            # save cache data
-            fileCacheData = (clipTimes, clipPixels)
-
-            if cache:
-                saveCacheFile(cacheFn, fileCacheData, overwrite=True)
-
-            # close video to free up memory
-            video.reader.close()
-            del video
+    fileParams = []
+    for fn in filenames:
+        vclips = [c.props for c in clips if fn==c.props["filename"]]
+        vclips = [{"index": c["index"], "start": c["start"], "dur": c["dur"], "maxWidth": c["maxWidth"], "maxHeight": c["maxHeight"], "resizeMode": getValue(c, "resizeMode", resizeMode)} for c in vclips]
+        fileParams.append({"filename": fn, "clips": vclips, "msStep": msStep, "cacheDir": cacheDir, "resizeMode": resizeMode, "verifyData": verifyData, "cache": cache, "mipLevels": mipLevels})
+
+    # build each file's frame store in a process pool, then just open the stores below
+    parallel = (processes > 1 and cache and fileCount > 1)
+    if parallel:
+        loadVideoFileFramesParallel(fileParams, min(processes, fileCount), memoryBudget)
+
+    # with a pixel memory budget, frames are read from the stores as they're needed instead of all being kept in memory
+    streamPixels = (pixelMemory > 0 and cache)
+    stores = []
+    clipSources = [(0, [])] * len(clips)
+
+    # otherwise only open one video at a time
+    for i, p in enumerate(fileParams):
+        fileFrames = FrameStore(cacheDir + os.path.basename(p["filename"])) if parallel else loadVideoFileFrames(p)
+        availableTimes = sorted(fileFrames.getTimes() if isinstance(fileFrames, FrameStore) else fileFrames.keys())
+        if streamPixels:
+            stores.append((fileFrames, getMipFrameStores(fileFrames, mipLevels)))
+            for clip in p["clips"]:
+                clipSources[clip["index"]] = (len(stores)-1, getClipFrameTimes(clip, msStep, availableTimes))
+            if not parallel:
+                printProgress(i+1, fileCount)
+            continue
+        getFrame = (lambda t: fileFrames[t])
+        # frames with mip levels are tuples of pixels, largest first
+        if isinstance(fileFrames, FrameStore):
+            mipStores = getMipFrameStores(fileFrames, mipLevels)
+            getFrame = (lambda t: getMipFrame(fileFrames, mipStores, t))
 
         # assign pixel data to clips
-        for clip in vclips:
-            start = clip.props["start"]
-            end = start + clip.props["dur"]
-            ms = start
-            pixelData = []
-            while ms < end:
-                t = roundInt(ms)
-                ms += msStep
-                index = fileCacheData[0].index(t)
-                pixelData.append(fileCacheData[1][index])
-            clipsPixelData[clip.props["index"]] = pixelData
+        for clip in p["clips"]:
+            pixelData = [getFrame(t) for t in getClipFrameTimes(clip, msStep, availableTimes)]
+            clipsPixelData[clip["index"]] = pixelData
             # clip.setProp("framePixelData", pixelData)
 
-        printProgress(i+1, fileCount)
+        if not parallel:
+            printProgress(i+1, fileCount)
+
+    if streamPixels:
+        print("Streaming pixel data with a %s MB memory budget" % roundInt(pixelMemory/1000000.0))
+        return PixelProvider(stores, clipSources, pixelMemory, pixelWindow)
 
     print("Finished loading pixel data.")
     return clipsPixelData
@@ -659,36 +926,55 @@ def loadVideoPixelDataFromFrames(frames, clips, containerW, containerH, fps, cac
     cacheFile = cacheKey + "_maxes.p"
     resizeMode = getValue(globalArgs, "resizeMode", "fill")
     recalculateClipSizes = getValue(globalArgs, "recalculateClipSizes", False)
+    loadProcesses = getValue(globalArgs, "loadProcesses", 1)
+    loadMemoryBudget = getValue(globalArgs, "loadMemoryBudget", -1)
+    mipLevels = getValue(globalArgs, "mipLevels", 0)
+    pixelMemory = getValue(globalArgs, "pixelMemory", -1)
+    pixelWindow = getValue(globalArgs, "pixelWindow", 48)
 
     if debug:
         clipsPixelData = loadVideoPixelDataDebug(clipCount)
         return clipsPixelData
 
+    ccfunction = customClipToArrFunction
+    # override custom clip arr function for calcuation
+    if customClipToArrCalcFunction is "default":
+        ccfunction = None
+    elif customClipToArrCalcFunction is not None:
+        ccfunction = customClipToArrCalcFunction
+
+    # the cached maxes are only used if they came from the same timeline (and frames, if a custom function has to evaluate every one)
+    timeline = Timeline(clips, containerW, containerH, precision)
+    msList = [frame["ms"] for frame in frames]
+    msRange = [min(msList), max(msList)] if frameCount > 0 else [0, 0]
+    timelineHash = timeline.getHash(msList if ccfunction is not None else msRange)
     loaded = False
+    cached = None
     clipWidthMaxes = None
-    if cache:
-        loaded, clipWidthMaxes = loadCacheFile(cacheDir+cacheFile)
-
-    if not loaded or len(clipWidthMaxes) != clipCount or recalculateClipSizes:
-        print("Calculating clip size/position from frame sequence...")
-        clipWidthMaxes = np.zeros(clipCount, dtype=np.int32)
-        clipCompare = np.zeros((2, clipCount), dtype=np.int32)
-        ccfunction = customClipToArrFunction
-        # override custom clip arr function for calcuation
-        if customClipToArrCalcFunction is "default":
-            ccfunction = None
-        elif customClipToArrCalcFunction is not None:
-            ccfunction = customClipToArrCalcFunction
-        for i, frame in enumerate(frames):
-            ms = frame["ms"]
-            # frameClips = clipsToDictsGPU(clips, ms, container, precision)
-            frameClips = clipsToNpArr(clips, ms, containerW, containerH, precision, customClipToArrFunction=ccfunction, globalArgs=globalArgs)
-            clipCompare[0] = clipWidthMaxes
-            clipCompare[1] = frameClips[:,2] # just take the width (2)
-            clipWidthMaxes = np.amax(clipCompare, axis=0)
-            printProgress(i+1, frameCount)
+    if cache and not recalculateClipSizes:
+        loaded, cached = loadCacheFile(cacheDir+cacheFile)
+        if loaded and isinstance(cached, dict) and cached["hash"] == timelineHash and len(cached["maxes"]) == clipCount:
+            clipWidthMaxes = cached["maxes"]
+
+    if clipWidthMaxes is None:
+        # work out the largest size from the keyframes if we're not using a custom function
+        if ccfunction is None:
+            print("Calculating clip sizes from keyframes...")
+            clipWidthMaxes = timeline.getMaxWidths(msRange[0], msRange[1])
+        else:
+            print("Calculating clip size/position from frame sequence...")
+            clipWidthMaxes = np.zeros(clipCount, dtype=np.int32)
+            clipCompare = np.zeros((2, clipCount), dtype=np.int32)
+            for i, frame in enumerate(frames):
+                ms = frame["ms"]
+                # frameClips = clipsToDictsGPU(clips, ms, container, precision)
+                frameClips = clipsToNpArr(clips, ms, containerW, containerH, precision, customClipToArrFunction=ccfunction, globalArgs=globalArgs)
+                clipCompare[0] = clipWidthMaxes
+                clipCompare[1] = frameClips[:,2] # just take the width (2)
+                clipWidthMaxes = np.amax(clipCompare, axis=0)
+                printProgress(i+1, frameCount)
         if cache:
-            saveCacheFile(cacheDir+cacheFile, clipWidthMaxes, overwrite=True)
+            saveCacheFile(cacheDir+cacheFile, {"hash": timelineHash, "maxes": clipWidthMaxes}, overwrite=True)
 
     # visualize the result
     # from matplotlib import pyplot as plt
@@ -708,10 +994,20 @@ def loadVideoPixelDataFromFrames(frames, clips, containerW, containerH, fps, cac
         clip.setProp("maxHeight", height)
         # print("%s, %s" % (clip.props["width"], clip.props["height"]))
 
-    clipsPixelData = loadVideoPixelData(clips, fps, cacheDir=cacheDir, verifyData=verifyData, cache=cache, resizeMode=resizeMode)
+    memoryBudget = roundInt(loadMemoryBudget * 1000000000) if loadMemoryBudget > 0 else -1
+    pixelMemory = roundInt(pixelMemory * 1000000000) if pixelMemory > 0 else -1
+    clipsPixelData = loadVideoPixelData(clips, fps, cacheDir=cacheDir, verifyData=verifyData, cache=cache, resizeMode=resizeMode, processes=loadProcesses, memoryBudget=memoryBudget, mipLevels=mipLevels, pixelMemory=pixelMemory, pixelWindow=pixelWindow)
 
     return clipsPixelData
 
+# make each mip level from the one above it
+def makeMipLevels(pixels, sizes):
+    levels = []
+    for w, h in sizes:
+        im = Image.fromarray(pixels if len(levels) <= 0 else levels[-1])
+        levels.append(np.array(im.resize((w, h), resample=Image.LANCZOS)))
+    return levels
+
 def msToFrame(ms, fps):
     return roundInt((ms / 1000.0) * fps)
 
@@ -726,8 +1022,12 @@ def parseVideoArgs(args):
     d["BRIGHTNESS_RANGE"] =  tuple([float(v) for v in args.BRIGHTNESS_RANGE.strip().split(",")])
     d["FRAME_RANGE"] =  tuple([int(v) for v in args.FRAME_RANGE.strip().split(",")])
     d["VIDEO_THREADS"] = args.VIDEO_THREADS if "VIDEO_THREADS" in d else 1
+    d["PIPELINE_WORKERS"] = dict([(v.split("=")[0].strip(), int(v.split("=")[1])) for v in args.PIPELINE_WORKERS.strip().split(",") if "=" in v])
+    d["TEE_FRAMES"] = args.TEE_FRAMES.strip() if args.TEE_FRAMES.strip() == "all" else [int(v) for v in args.TEE_FRAMES.strip().split(",") if len(v.strip()) > 0]
     if args.OUTPUT_SINGLE_FRAME > 0:
         d["VIDEO_ONLY"] = True
+        # a single frame is just saved as a PNG
+        d["STREAM_OUTPUT"] = False
 
 def pasteImage(im, clipImg, x, y):
     width, height = im.size
@@ -737,13 +1037,14 @@ def pasteImage(im, clipImg, x, y):
     im = Image.alpha_composite(im, stagingImg)
     return im
 
-def processFrames(params, clips, clipsPixelData, threads=1, precision=3, verbose=True, customClipToArrFunction=None, postProcessingFunction=None, preProcessingFunction=None, globalArgs={}):
+def processFrames(params, clips, clipsPixelData, threads=1, precision=3, verbose=True, customClipToArrFunction=None, postProcessingFunction=None, preProcessingFunction=None, globalArgs={}, processes=1, encoder=None):
     if len(params) < 1:
         return
 
     count = len(params)
     print("Processing %s frames" % count)
     threads = getThreadCount(threads)
+    processes = getThreadCount(processes) if processes != 1 else 1
 
     frameAlpha = getValue(globalArgs, "frameAlpha", 1.0)
     isSequential = getValue(globalArgs, "isSequential", False)
@@ -751,26 +1052,451 @@ def processFrames(params, clips, clipsPixelData, threads=1, precision=3, verbose
     propagateFrames = (0.0 <= frameAlpha < 1.0)
     if propagateFrames:
         isSequential = True
-
-    # load gpu program
+    useProcesses = processes > 1 and count > 1 and not isSequential
+
+    # render state shared by every frame
+    globalArgs = globalArgs.copy()
+
+    # when streaming to an encoder, each frame is tagged with its position in the output so it can be written in order
+    if encoder is not None:
+        params = [dict(p, streamIndex=i) for i, p in enumerate(params)]
+        if not useProcesses:
+            globalArgs["frameSink"] = lambda p, im: encoder.addFrame(p["streamIndex"], im.tobytes())
+
+    # keep clips that were rotated, blurred, or resized for reuse in later frames; each worker process gets its own copy
+    spriteCacheMemory = getValue(globalArgs, "spriteCacheMemory", 0.5)
+    spriteCache = None
+    if spriteCacheMemory > 0:
+        # sprites are keyed on exact rotation and blur unless quantizing them (which slightly changes the output) is turned on
+        spriteQuantize = getValue(globalArgs, "spriteQuantize", False)
+        spriteCache = SpriteCache(roundInt(spriteCacheMemory * 1000000000), 0.1 if spriteQuantize else 0, 0.05 if spriteQuantize else 0)
+        globalArgs["spriteCache"] = spriteCache
+
+    # frames that draw the same thing as a recent frame reuse its output; frames that depend on the previous frame or on custom processing are always rendered
+    frameDeduper = None
+    if getValue(globalArgs, "dedupeFrames", False) and not propagateFrames and preProcessingFunction is None and postProcessingFunction is None:
+        frameDeduper = FrameDeduper()
+        globalArgs["frameDeduper"] = frameDeduper
+
+    # the number of frames each clip has, for working out which source frame a clip draws without touching its pixels
+    if clipsPixelData is not None:
+        globalArgs["clipFrameCounts"] = [len(clipsPixelData[i]) for i in range(len(clips))]
+
+    # compile the clip keyframes and plays once so each frame evaluates all clips at once
     p0 = params[0]
+    if customClipToArrFunction is None and len(clips) > 0:
+        globalArgs["timeline"] = Timeline(clips, p0["width"], p0["height"], precision)
+    # otherwise clips are evaluated one at a time; sequential renders look up each clip's play start for each frame from a schedule
+    elif isSequential:
+        msList = [getValue(p, "ms", 0) for p in params]
+        for clip in clips:
+            if len(clip.plays) > 0:
+                clip.setPlaySchedule(msList)
+
+    # load gpu program; process pool workers load their own
     colorDimensions = getValue(globalArgs, "colors", 3)
     pcount = Clip.gpuPropertyCount
-    gpuProgram = loadMakeImageProgram(p0["width"], p0["height"], pcount, colorDimensions, precision)
-
-    if threads > 1 and not isSequential:
-        pool = ThreadPool(threads)
-        pclipsToFrame = partial(clipsToFrame, clips=clips, pixelData=clipsPixelData, precision=precision, customClipToArrFunction=customClipToArrFunction, baseImage=baseImage, gpuProgram=gpuProgram, postProcessingFunction=postProcessingFunction, preProcessingFunction=preProcessingFunction, globalArgs=globalArgs)
-        pool.map(pclipsToFrame, params)
+    gpuProgram = None
+    if getValue(globalArgs, "compositor", "gpu") != "cpu" and not useProcesses:
+        gpuProgram = loadGPUCompositor(p0["width"], p0["height"], colorDimensions, precision, clipsPixelData, globalArgs)
+
+    # the cpu compositor draws the tiles of each frame in parallel
+    tilePool = None
+    if getValue(globalArgs, "compositor", "gpu") == "cpu" and getValue(globalArgs, "tileSize", 128) > 0 and threads > 1 and not useProcesses:
+        tilePool = ThreadPool(threads)
+        globalArgs["tilePool"] = tilePool
+
+    # a streaming pixel provider prefetches frames for the clips visible in the upcoming frames; each worker process starts its own
+    pixelProvider = clipsPixelData if isinstance(clipsPixelData, PixelProvider) else None
+    if pixelProvider is not None and not useProcesses:
+        startPixelProvider(pixelProvider, params, clips, precision, customClipToArrFunction, globalArgs)
+
+    if useProcesses:
+        # workers get the clips and pixel data once when they start (forked workers inherit them without pickling), then render contiguous chunks of frames
+        workerArgs = {
+            "clips": clips,
+            "pixelData": clipsPixelData,
+            "precision": precision,
+            "customClipToArrFunction": customClipToArrFunction,
+            "baseImage": baseImage,
+            "postProcessingFunction": postProcessingFunction,
+            "preProcessingFunction": preProcessingFunction,
+            "globalArgs": globalArgs,
+            "width": p0["width"],
+            "height": p0["height"],
+            "colors": colorDimensions
+        }
+        chunkSize = max(1, ceilInt(1.0 * count / (processes * 4)))
+        # streamed frames are sent back to this process, so keep chunks small to limit what's held in the reorder buffer
+        if encoder is not None:
+            workerArgs["streamOutput"] = True
+            chunkSize = 1
+        chunks = [params[i:i+chunkSize] for i in range(0, count, chunkSize)]
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else multiprocessing.get_context()
+        pool = context.Pool(processes, initializer=processFramesWorkerInit, initargs=(workerArgs,))
+        completed = 0
+        for frameCount, frames, skipped in pool.imap_unordered(processFramesChunk, chunks):
+            for index, data in frames:
+                encoder.addFrame(index, data)
+            if frameDeduper is not None:
+                frameDeduper.skipped += skipped
+            completed += frameCount
+            if verbose:
+                printProgress(completed, count)
         pool.close()
         pool.join()
     else:
-        prevImage = None
-        for i, p in enumerate(params):
-            baseImage = prevImage if propagateFrames else baseImage
-            prevImage = clipsToFrame(p, clips=clips, pixelData=clipsPixelData, precision=precision, customClipToArrFunction=customClipToArrFunction, baseImage=baseImage, gpuProgram=gpuProgram, postProcessingFunction=postProcessingFunction, preProcessingFunction=preProcessingFunction, globalArgs=globalArgs)
-            if verbose:
-                printProgress(i+1, count)
+        # only compositing depends on the previous frame in sequential renders, so later frames are still evaluated and gathered ahead
+        renderFramesPipeline(params, clips, clipsPixelData, threads, precision, verbose, customClipToArrFunction, baseImage, gpuProgram, postProcessingFunction, preProcessingFunction, globalArgs, isSequential, propagateFrames)
+
+    if frameDeduper is not None:
+        print("Reused the output of an identical earlier frame for %s of %s frames" % (frameDeduper.skipped, count))
+    if spriteCache is not None and spriteCache.hits + spriteCache.misses > 0:
+        print(spriteCache.getStats())
+    if pixelProvider is not None and not useProcesses:
+        pixelProvider.stop()
+        print(pixelProvider.getStats())
+    if tilePool is not None:
+        tilePool.close()
+        tilePool.join()
+
+# the render arguments for this worker process, set once by processFramesWorkerInit
+processFramesWorkerArgs = {}
+
+def processFramesChunk(params):
+    a = processFramesWorkerArgs
+    globalArgs = a["globalArgs"]
+    # streamed frames are returned as raw rgb bytes for the main process to encode
+    frames = []
+    if getValue(a, "streamOutput", False):
+        globalArgs = globalArgs.copy()
+        globalArgs["frameSink"] = lambda p, im: frames.append((p["streamIndex"], im.tobytes()))
+    frameDeduper = getValue(globalArgs, "frameDeduper", None)
+    skipped = frameDeduper.skipped if frameDeduper is not None else 0
+    # the prefetch thread isn't forked with the process, and chunks are handed out in any order, so each worker prefetches just the chunk it's rendering
+    pixelProvider = a["pixelData"] if isinstance(a["pixelData"], PixelProvider) else None
+    if pixelProvider is not None:
+        startPixelProvider(pixelProvider, params, a["clips"], a["precision"], a["customClipToArrFunction"], globalArgs)
+    for p in params:
+        clipsToFrame(p, clips=a["clips"], pixelData=a["pixelData"], precision=a["precision"], customClipToArrFunction=a["customClipToArrFunction"], baseImage=a["baseImage"], gpuProgram=a["gpuProgram"], postProcessingFunction=a["postProcessingFunction"], preProcessingFunction=a["preProcessingFunction"], globalArgs=globalArgs)
+    if pixelProvider is not None:
+        pixelProvider.stop()
+    # each worker has its own copy of the deduper, so report how many frames it skipped for this chunk
+    if frameDeduper is not None:
+        skipped = frameDeduper.skipped - skipped
+    return (len(params), frames, skipped)
+
+def processFramesWorkerInit(workerArgs):
+    global processFramesWorkerArgs
+    processFramesWorkerArgs = workerArgs
+    # OpenCL contexts can't be shared across processes, so each worker builds its own program
+    workerArgs["gpuProgram"] = None
+    if getValue(workerArgs["globalArgs"], "compositor", "gpu") != "cpu":
+        workerArgs["gpuProgram"] = loadGPUCompositor(workerArgs["width"], workerArgs["height"], workerArgs["colors"], workerArgs["precision"], workerArgs["pixelData"], workerArgs["globalArgs"])
+
+# Decode from startIndex forward once and write each requested (geometry, frame indices) to its own rawvideo pipe, scaled by ffmpeg
+def readVideoFrames(filename, fps, startIndex, outputs):
+    outputCount = len(outputs)
+    filters = ["[0:v]fps=%s,split=%s%s" % (fps, outputCount, "".join(["[v%s]" % i for i in range(outputCount)]))]
+    for i, output in enumerate(outputs):
+        geometry, indices = output
+        w, h, resizeMode = geometry
+        # select contiguous runs of frames so only those get scaled and converted
+        runs = []
+        for index in indices:
+            if len(runs) > 0 and index == runs[-1][1] + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        select = "+".join(["between(n,%s,%s)" % tuple(run) for run in runs])
+        if resizeMode=="warp":
+            scale = "scale=%s:%s:flags=lanczos" % (w, h)
+        elif resizeMode=="contain":
+            scale = "scale=%s:%s:force_original_aspect_ratio=decrease:flags=lanczos,pad=%s:%s:(ow-iw)/2:(oh-ih)/2:black" % (w, h, w, h)
+        else:
+            scale = "scale=%s:%s:force_original_aspect_ratio=increase:flags=lanczos,crop=%s:%s" % (w, h, w, h)
+        filters.append("[v%s]select='%s',%s[o%s]" % (i, select, scale, i))
+
+    # the select expressions grow with the number of runs, so pass the graph as a file rather than one (size-limited) argument
+    fd, scriptFilename = tempfile.mkstemp(prefix="filters_", suffix=".txt")
+    with os.fdopen(fd, "w") as f:
+        f.write(";".join(filters))
+
+    pipes = [os.pipe() for i in range(outputCount)]
+    command = ['ffmpeg', '-loglevel', 'error',
+               '-ss', '%.6f' % (1.0 * startIndex / fps),
+               '-i', filename,
+               '-an',
+               '-filter_complex_script', scriptFilename]
+    for i, p in enumerate(pipes):
+        command += ['-map', '[o%s]' % i, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', '0', 'pipe:%s' % p[1]]
+    proc = subprocess.Popen(command, pass_fds=[p[1] for p in pipes])
+    for p in pipes:
+        os.close(p[1])
+
+    frames = {}
+    def readOutput(i):
+        geometry, indices = outputs[i]
+        w, h, resizeMode = geometry
+        frameSize = w * h * 3
+        with os.fdopen(pipes[i][0], "rb") as f:
+            for index in indices:
+                data = f.read(frameSize)
+                if len(data) < frameSize:
+                    break
+                frames[(geometry, index)] = np.frombuffer(data, dtype=np.uint8).reshape(h, w, 3)
+            # drain anything left so ffmpeg can exit
+            while f.read(frameSize):
+                pass
+
+    # each output needs its own reader or ffmpeg will block on a full pipe
+    threads = [threading.Thread(target=readOutput, args=(i,)) for i in range(outputCount)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    returnCode = proc.wait()
+    os.remove(scriptFilename)
+    # frames read before ffmpeg failed can't be trusted either
+    if returnCode != 0:
+        raise subprocess.CalledProcessError(returnCode, command)
+    return frames
+
+# The stages of rendering a frame, each taking and returning a job dict that starts as {"params": frame params}.
+# context has clipsToFrame()'s arguments. A job that reuses another frame's output (or an existing file) skips straight to output.
+
+# evaluate each clip's state for the frame
+def renderFrameEvaluate(job, context):
+    p = job["params"]
+    globalArgs = context["globalArgs"]
+    precision = context["precision"]
+    customClipToArrFunction = context["customClipToArrFunction"]
+    filename = p["filename"]
+    ms = getValue(p, "ms", 0)
+    saveFrame = getValue(p, "saveFrame", filename)
+    isSequential = getValue(globalArgs, "isSequential", False)
+    container = getValue(globalArgs, "container", None)
+    frameDeduper = getValue(globalArgs, "frameDeduper", None)
+
+    globalArgsCopy = globalArgs.copy()
+    globalArgsCopy["frame"] = getValue(p, "frame", 1)
+    globalArgsCopy["debug"] = getValue(p, "debug", False)
+    job["globalArgs"] = globalArgsCopy
+
+    fileExists = saveFrame and filename and os.path.isfile(filename) and not getValue(p, "overwrite", False)
+    job["fileExists"] = fileExists
+    job["clipArr"] = None
+    if not fileExists and saveFrame or not saveFrame or isSequential:
+        timeline = getValue(globalArgs, "timeline", None)
+        if timeline is not None and customClipToArrFunction is None:
+            job["clipArr"] = timeline.toNpArr(ms)
+        else:
+            job["clipArr"] = clipsToNpArr(context["clips"], ms, p["width"], p["height"], precision, customClipToArrFunction=customClipToArrFunction, globalArgs=globalArgsCopy)
+
+    # a key for what the frame draws, so it can reuse the output of a recent frame that draws exactly the same thing
+    job["frameKey"] = None
+    job["dupe"] = None
+    if frameDeduper is not None and job["clipArr"] is not None and not fileExists:
+        containerBlur = container.vector.getBlur(ms) if container is not None else 0.0
+        job["frameKey"] = getFrameStateKey(job["clipArr"], getValue(globalArgs, "clipFrameCounts", None), precision, (containerBlur,))
+    return job
+
+def renderFrameGather(job, context):
+    pixelData = context["pixelData"]
+    if isRenderJobDone(job) or pixelData is None:
+        return job
+    p = job["params"]
+    ms = getValue(p, "ms", 0)
+    # let a streaming pixel provider know which frame is being drawn so it can drop frames that are no longer needed
+    pixelProvider = pixelData if isinstance(pixelData, PixelProvider) else None
+    if pixelProvider is not None:
+        pixelProvider.beginFrame(ms)
+    job["properties"], job["pixels"] = gatherClipPixels(job["clipArr"], pixelData, context["precision"], gpuProgram=context["gpuProgram"], globalArgs=context["globalArgs"])
+    if pixelProvider is not None:
+        pixelProvider.endFrame(ms)
+    return job
+
+def renderFrameComposite(job, context):
+    if isRenderJobDone(job):
+        return job
+    p = job["params"]
+    width = p["width"]
+    height = p["height"]
+    ms = getValue(p, "ms", 0)
+    globalArgs = context["globalArgs"]
+    container = getValue(globalArgs, "container", None)
+    baseImage = job["baseImage"] if "baseImage" in job else context["baseImage"]
+    if context["preProcessingFunction"] is not None:
+        baseImage = context["preProcessingFunction"](baseImage, ms, globalArgs=globalArgs)
+    if context["pixelData"] is None:
+        im = clipsToFrameOnTheFly(context["clips"], job["clipArr"], width, height, context["precision"], baseImage=baseImage, globalArgs=job["globalArgs"])
+    else:
+        im = compositeClipPixels(width, height, job["properties"], job["pixels"], context["precision"], baseImage=baseImage, gpuProgram=context["gpuProgram"], globalArgs=globalArgs)
+        job["properties"] = job["pixels"] = None
+    im = im.convert("RGB")
+    # check to see if we're applying container-level effects
+    if container is not None:
+        # right now we only care about blur
+        blur = container.vector.getBlur(ms)
+        if blur > 0.0:
+            im = blurImage(im, blur)
+    job["image"] = im
+    return job
+
+def renderFramePostProcess(job, context):
+    if isRenderJobDone(job) or context["postProcessingFunction"] is None:
+        return job
+    job["image"] = context["postProcessingFunction"](job["image"], getValue(job["params"], "ms", 0), globalArgs=context["globalArgs"])
+    return job
+
+# save the frame and/or pass it on to the encoder
+def renderFrameOutput(job, context):
+    p = job["params"]
+    globalArgs = context["globalArgs"]
+    filename = p["filename"]
+    saveFrame = getValue(p, "saveFrame", filename)
+    frameAlpha = getValue(globalArgs, "frameAlpha", None)
+    frameSink = getValue(globalArgs, "frameSink", None)
+    frameDeduper = getValue(globalArgs, "frameDeduper", None)
+    renderManifest = getValue(globalArgs, "renderManifest", None)
+    renderKey = getValue(p, "renderKey", None)
+    im = None
+    returnValue = None
+
+    # a pipeline only knows a frame is the same as the one before it; wait for that frame's output
+    if getValue(job, "isDupe", False):
+        job["dupe"] = frameDeduper.wait(job["frameKey"])
+        # the render failed before that frame was output
+        if job["dupe"] is None:
+            job["image"] = None
+            job["returnValue"] = None
+            return job
+
+    if job["dupe"] is not None:
+        dupeFilename, im = job["dupe"]
+        if saveFrame:
+            if dupeFilename and os.path.isfile(dupeFilename):
+                linkFile(dupeFilename, filename)
+            else:
+                im.save(filename)
+            print("Saved frame %s (same as an earlier frame)" % filename)
+            if renderManifest is not None and renderKey is not None:
+                renderManifest.set(filename, renderKey)
+        if frameAlpha is None:
+            returnValue = im
+
+    elif not job["fileExists"]:
+        im = job["image"]
+        # save if necessary
+        if saveFrame:
+            # an existing frame may be a hard link to another frame (see FrameDeduper), so replace it instead of writing into it
+            if os.path.isfile(filename):
+                os.remove(filename)
+            im.save(filename)
+            print("Saved frame %s" % filename)
+            if renderManifest is not None and renderKey is not None:
+                renderManifest.set(filename, renderKey)
+        if frameAlpha is None:
+            returnValue = im
+        if job["frameKey"] is not None:
+            frameDeduper.set(job["frameKey"], filename if saveFrame else None, im)
+
+    # pass the frame on to the encoder when streaming output
+    if frameSink is not None:
+        if im is None:
+            im = Image.open(filename).convert("RGB")
+        frameSink(p, im)
+
+    # frame has alpha, so darken for next frame
+    if frameAlpha is not None and 0.0 <= frameAlpha < 1.0:
+        if im is None:
+            im = Image.open(filename)
+        blackOverlay = Image.new(mode="RGB", size=im.size, color=(0, 0, 0))
+        im = Image.blend(im, blackOverlay, frameAlpha)
+        returnValue = im
+
+    job["image"] = None
+    job["returnValue"] = returnValue
+    return job
+
+# Render frames through a pipeline of stages (see RenderPipeline and renderFrameEvaluate()), each with its own worker threads.
+# Frames are evaluated by the evaluate stage's workers, then checked in order so a frame that's the same as a recent frame can be
+# spotted before it's composited.
+# Sequential frames are composited, post-processed, and output one at a time in order (drawn on top of the previous frame if
+# propagateFrames), while the frames after them are evaluated and gathered ahead of time.
+def renderFramesPipeline(params, clips, clipsPixelData, threads=1, precision=3, verbose=True, customClipToArrFunction=None, baseImage=None, gpuProgram=None, postProcessingFunction=None, preProcessingFunction=None, globalArgs={}, isSequential=False, propagateFrames=False):
+    context = {
+        "clips": clips,
+        "pixelData": clipsPixelData,
+        "precision": precision,
+        "customClipToArrFunction": customClipToArrFunction,
+        "baseImage": baseImage,
+        "gpuProgram": gpuProgram,
+        "postProcessingFunction": postProcessingFunction,
+        "preProcessingFunction": preProcessingFunction,
+        "globalArgs": globalArgs
+    }
+    pipelineWorkers = getValue(globalArgs, "pipelineWorkers", {})
+    stageWorkers = dict([(name, getValue(pipelineWorkers, name, threads)) for name in ["evaluate", "gather", "composite", "post", "output"]])
+    # a custom clip function may keep state from frame to frame like pre and post-processing functions, so it evaluates one frame at a time in order
+    if customClipToArrFunction is not None:
+        stageWorkers["evaluate"] = getValue(pipelineWorkers, "evaluate", 1)
+    # pre and post-processing functions may keep state from frame to frame (e.g. postProcessGL in projects/global_lives/movie.py), so they run one frame at a time in order
+    if preProcessingFunction is not None:
+        stageWorkers["composite"] = getValue(pipelineWorkers, "composite", 1)
+    if postProcessingFunction is not None:
+        stageWorkers["post"] = getValue(pipelineWorkers, "post", 1)
+    if isSequential:
+        stageWorkers["output"] = 1
+    frameDeduper = getValue(globalArgs, "frameDeduper", None)
+    recentCount = frameDeduper.size if frameDeduper is not None else 0
+    # output workers can set frames a little ahead of the frames that reuse earlier ones, so keep a few more than are looked for
+    if frameDeduper is not None:
+        frameDeduper.size = recentCount + stageWorkers["output"]
+
+    pipeline = RenderPipeline(getValue(globalArgs, "pipelineQueueSize", 4))
+    pipeline.addStage("evaluate", lambda job: renderFrameEvaluate(job, context), stageWorkers["evaluate"], ordered=True)
+    # keep track of the keys the deduper will have when each frame reaches output, which needs the frames in order
+    if frameDeduper is not None:
+        recentKeys = OrderedDict()
+        def markDupe(job):
+            key = job["frameKey"]
+            job["isDupe"] = key is not None and key in recentKeys
+            if key is not None:
+                recentKeys[key] = True
+                recentKeys.move_to_end(key)
+                while len(recentKeys) > recentCount:
+                    recentKeys.popitem(last=False)
+            return job
+        pipeline.addStage("dedupe", markDupe, 1, ordered=True)
+    pipeline.addStage("gather", lambda job: renderFrameGather(job, context), stageWorkers["gather"])
+    if isSequential:
+        prevImage = [None]
+        def renderSequentialFrame(job):
+            if propagateFrames:
+                job["baseImage"] = prevImage[0]
+            for stage in [renderFrameComposite, renderFramePostProcess, renderFrameOutput]:
+                job = stage(job, context)
+            prevImage[0] = job["returnValue"]
+            return job
+        pipeline.addStage("composite", renderSequentialFrame, 1, ordered=True)
+    else:
+        pipeline.addStage("composite", lambda job: renderFrameComposite(job, context), stageWorkers["composite"], ordered=(preProcessingFunction is not None))
+        pipeline.addStage("post", lambda job: renderFramePostProcess(job, context), stageWorkers["post"], ordered=True)
+        # frames that are the same as a recent frame wait for its output
+        pipeline.addStage("output", lambda job: renderFrameOutput(job, context), stageWorkers["output"], ordered=True)
+
+    count = len(params)
+    completed = [0]
+    def onDone(job):
+        completed[0] += 1
+        if verbose:
+            printProgress(completed[0], count)
+
+    # don't leave output workers waiting on frames that won't be output
+    onError = (lambda err: frameDeduper.abort()) if frameDeduper is not None else None
+    pipeline.run("frames", [{"params": p} for p in params], onDone=onDone, onError=onError)
+    print(pipeline.getStats())
 
 def resizeImage(im, w, h, mode="fill", resampleType="default"):
     resampleType = Image.LANCZOS if resampleType=="default" else resampleType
@@ -825,6 +1551,44 @@ def saveBlankFrame(fn, width, height, bgColor="#000000", overwrite=False, verbos
     if verbose:
         print("Saved %s" % fn)
 
+# start prefetching clip frames for the output frames in params (in the order they'll be rendered)
+def startPixelProvider(provider, params, clips, precision, customClipToArrFunction=None, globalArgs={}):
+    timeline = getValue(globalArgs, "timeline", None)
+    # clips drawn with a custom function can't be predicted, so their frames are only read when drawn
+    getClipArrs = timeline.toNpArrs if timeline is not None and customClipToArrFunction is None else None
+    provider.start([p["ms"] for p in params], getClipArrs, precision)
+
+# rotate, blur, and/or resize a clip's pixels for drawing; the result has the compositor's color dimensions
+def transformClipPixels(pixels, rw, rh, rotation=0.0, blur=0.0, colors=3):
+    h, w, _c = pixels.shape
+    im = None
+    # assume we are debugging if single pixel
+    if h==1 and w==1:
+        newPixels = np.zeros((rh, rw, _c), dtype=np.uint8)
+        newPixels[:,:] = pixels[0,0]
+        im = Image.fromarray(newPixels, mode="RGB")
+    else:
+        im = Image.fromarray(pixels, mode="RGB")
+
+    # apply effects before resize for better quality
+    if blur > 0.0 or rotation % 360.0 > 0.0:
+        im, _x, _y = applyEffects(im, 0, 0, rotation, blur, colors=colors)
+
+    # resize image
+    imW, imH = im.size
+    if imW != rw or imH != rh:
+        resampleType = Image.LANCZOS if imW > rw else Image.NEAREST
+        im = im.resize((rw, rh), resample=resampleType)
+
+    # im.save("output/test_pil.png")
+    pixels = np.array(im)
+    h, w, _c = pixels.shape
+    # pixels are size 3, but need size 4
+    if colors > _c:
+        fillVals = np.full((h, w, 1), 255, dtype='uint8')
+        pixels = np.concatenate((pixels, fillVals), axis=2)
+    return pixels
+
 def updateAlpha(im, alpha):
     im = im.convert("RGBA")
     im.putalpha(alpha)
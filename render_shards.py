@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# Renders a composition in shards (frame ranges) on a pool of local and/or SSH worker processes, then compiles the output
+# python3 render_shards.py -command "python3 compositions/shuffle.py -in tmp/samples.csv -out output/shuffle.mp4 -outframe tmp/shuffle_frames/frame.%s.png" -workers local:4
+# python3 render_shards.py -command "..." -workers local:2,me@render1:4,me@render2:4 -rdir /mnt/shared/media-tools
+# python3 render_shards.py -command "..." -workers local:4 -resume (after an interrupted render, to skip shards that finished)
+# SSH workers need the repository, the media, and the -queue directory at the same paths on a shared filesystem
+
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+
+from lib.io_utils import *
+from lib.math_utils import *
+from lib.shard_queue import *
+from lib.video_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-command', dest="COMMAND", default="", help="The composition command to render, e.g. python3 compositions/shuffle.py -out output/shuffle.mp4")
+parser.add_argument('-workers', dest="WORKERS", default="local:2", help="Comma-separated list of local or user@host workers, each with an optional :count of worker processes")
+parser.add_argument('-shards', dest="SHARDS", default=-1, type=int, help="Number of shards to split frames into, -1 for four per worker")
+parser.add_argument('-queue', dest="QUEUE_DIR", default="tmp/shards/", help="Directory for the shard queue and logs; must be shared with SSH workers")
+parser.add_argument('-retries', dest="RETRIES", default=2, type=int, help="Number of times to retry a shard that fails")
+parser.add_argument('-rdir', dest="REMOTE_DIR", default="", help="Repository directory on SSH workers; defaults to the current directory")
+parser.add_argument('-python', dest="PYTHON", default="python3", help="Python command on SSH workers")
+parser.add_argument('-resume', dest="RESUME", action="store_true", help="Keep shards that an earlier, interrupted render of the same command already finished? Only use this if the composition and its media haven't changed")
+parser.add_argument('-nowarm', dest="NO_WARM_UP", action="store_true", help="Start every worker at once instead of rendering the first shard on its own to build the pixel data cache for the others")
+parser.add_argument('-probe', dest="PROBE", action="store_true", help="Just print the shards?")
+parser.add_argument('-worker', dest="WORKER", action="store_true", help="Run as a worker that renders shards from the queue until there are none left")
+parser.add_argument('-name', dest="WORKER_NAME", default="local-1", help="Name of this worker")
+a = parser.parse_args()
+
+# returns the number of shards that failed
+def renderShards(queue, workerName, limit=-1):
+    count = 0
+    failed = 0
+    while limit < 0 or count < limit:
+        shard = queue.claim(workerName)
+        if shard is None:
+            break
+        print("[%s] Rendering frames %s to %s..." % (workerName, shard["start"], shard["end"]))
+        # the composition skips encoding if its output exists, so never leave one from an earlier attempt or render
+        if shard["output"] and os.path.isfile(shard["output"]):
+            os.remove(shard["output"])
+        with open(queue.getLogFilename(shard), "a", encoding="utf8") as f:
+            f.write("----- %s, attempt %s -----\n%s\n" % (workerName, shard["attempts"] + 1, shard["command"]))
+            f.flush()
+            returnCode = subprocess.call(shard["command"], shell=True, stdout=f, stderr=subprocess.STDOUT)
+        success = returnCode == 0 and (not shard["output"] or os.path.isfile(shard["output"]))
+        state = queue.finish(shard, success)
+        if success:
+            print("[%s] Rendered frames %s to %s" % (workerName, shard["start"], shard["end"]))
+        else:
+            print("[%s] Frames %s to %s failed (see %s); shard is now %s" % (workerName, shard["start"], shard["end"], queue.getLogFilename(shard), state))
+            failed += 1
+        count += 1
+    return failed
+
+if a.WORKER:
+    failed = renderShards(ShardQueue(a.QUEUE_DIR, a.RETRIES), a.WORKER_NAME)
+    sys.exit(1 if failed > 0 else 0)
+
+# read the composition's own video args for the frame count and output files
+commandArgs = shlex.split(a.COMMAND)
+scriptIndex = [i for i, arg in enumerate(commandArgs) if arg.endswith(".py")]
+if len(scriptIndex) < 1:
+    print("Could not find a composition script in %s" % a.COMMAND)
+    sys.exit(1)
+videoParser = argparse.ArgumentParser()
+addVideoArgs(videoParser)
+ca, _unknown = videoParser.parse_known_args(commandArgs[scriptIndex[0]+1:])
+parseVideoArgs(ca)
+if ca.AUDIO_ONLY:
+    print("Audio-only renders aren't split into shards; run the command on its own instead")
+    sys.exit(1)
+
+print("Probing composition...")
+probe = subprocess.run(a.COMMAND + " -probe", shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+matches = re.findall(r"Total frames: ([0-9]+)", probe.stdout)
+if len(matches) < 1:
+    print(probe.stdout)
+    print("Could not get the number of frames from the composition")
+    sys.exit(1)
+totalFrames = int(matches[-1])
+
+# split frames into contiguous shards
+workers = []
+for entry in a.WORKERS.split(","):
+    host, count = tuple(entry.strip().split(":")) if ":" in entry else (entry.strip(), 1)
+    for i in range(int(count)):
+        workers.append((host, "%s-%s" % (host, i+1)))
+shardCount = a.SHARDS if a.SHARDS > 0 else len(workers) * 4
+shardCount = max(1, min(shardCount, totalFrames))
+makeDirectories([a.QUEUE_DIR + "/", ca.OUTPUT_FILE, ca.OUTPUT_FRAME])
+shards = []
+for i in range(shardCount):
+    start = 1 + i * totalFrames // shardCount
+    end = (i + 1) * totalFrames // shardCount
+    name = "shard_%s" % zeroPad(i+1, shardCount)
+    command = a.COMMAND + " -shard -frange %s,%s" % (start, end)
+    output = False
+    # streamed shards are each encoded to their own file and joined afterwards
+    if ca.STREAM_OUTPUT:
+        output = os.path.join(a.QUEUE_DIR, name + os.path.splitext(ca.OUTPUT_FILE)[1])
+        command += " -out %s" % shlex.quote(output)
+    shards.append({"name": name, "start": start, "end": end, "command": command, "output": output})
+print("%s frames in %s shards on %s workers" % (totalFrames, shardCount, len(workers)))
+
+if a.PROBE:
+    for shard in shards:
+        print(shard["command"])
+    sys.exit()
+
+queue = ShardQueue(a.QUEUE_DIR, a.RETRIES)
+added = queue.setShards(shards, resume=a.RESUME)
+if added < len(shards):
+    print("%s shards were already rendered" % (len(shards) - added))
+
+if not ca.VIDEO_ONLY:
+    print("Mixing audio...")
+    subprocess.check_call(a.COMMAND + " -ao", shell=True)
+
+# the first shard builds the pixel data cache, so the rest can read it instead of all building it at once
+if not a.NO_WARM_UP and shards[0]["name"] in queue.getNames("pending"):
+    renderShards(queue, workers[0][1], limit=1)
+
+# workers that exit leave any shard they were rendering in running/; those shards are retried in another round
+scriptFilename = os.path.abspath(__file__)
+remoteDir = a.REMOTE_DIR if len(a.REMOTE_DIR) > 0 else os.getcwd()
+for attempt in range(a.RETRIES + 1):
+    if len(queue.getNames("pending")) < 1:
+        break
+    procs = []
+    for host, name in workers:
+        workerArgs = ["-worker", "-queue", a.QUEUE_DIR, "-name", name, "-retries", str(a.RETRIES)]
+        if host == "local":
+            procs.append(subprocess.Popen([sys.executable, scriptFilename] + workerArgs))
+        else:
+            remoteCommand = "cd %s && %s render_shards.py %s" % (shlex.quote(remoteDir), a.PYTHON, " ".join([shlex.quote(arg) for arg in workerArgs]))
+            procs.append(subprocess.Popen(["ssh", host, remoteCommand]))
+    for proc in procs:
+        proc.wait()
+    requeued = queue.requeue()
+    if requeued > 0:
+        print("%s shards were left unfinished by workers that exited" % requeued)
+
+counts = queue.getCounts()
+if counts["done"] < len(shards):
+    print("%s of %s shards rendered; %s failed and %s did not finish. See the logs in %s" % (counts["done"], len(shards), counts["failed"], counts["pending"] + counts["running"], os.path.join(a.QUEUE_DIR, "logs")))
+    sys.exit(1)
+
+audioFile = ca.AUDIO_OUTPUT_FILE if not ca.VIDEO_ONLY and os.path.isfile(ca.AUDIO_OUTPUT_FILE) else False
+if ca.STREAM_OUTPUT:
+    concatVideos([shard["output"] for shard in shards], ca.OUTPUT_FILE, audioFile=audioFile)
+else:
+    quality = "medium" if ca.DEBUG else "high"
+    compileFrames(ca.OUTPUT_FRAME, ca.FPS, ca.OUTPUT_FILE, getZeroPadding(totalFrames), audioFile=audioFile, quality=quality)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks the NumPy mixer against the pydub mixer on a random sequence of clips and compares their output
+# python3 tests/audioMixer.py -count 10000 -dur 60
+# python3 tests/audioMixer.py -count 2000 -dur 60 -reverb 4 -mixers numpy -fxcache
+# python3 tests/audioMixer.py -count 2000 -dur 60 -reverb 4 -mixers numpy -fxbackend scipy
+# python3 tests/audioMixer.py -in "media/sample/a.mp3,media/sample/b.mp3" -count 2000 -dur 300 -mixers numpy -store tmp/cache/audio/
+
+import argparse
+import inspect
+import numpy as np
+import os
+from pprint import pprint
+from pydub import AudioSegment
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.audio_mixer import *
+from lib.audio_utils import *
+from lib.io_utils import *
+from lib.math_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILES", default="", help="Comma-separated list of audio files; leave blank to generate tones")
+parser.add_argument('-files', dest="FILES", default=4, type=int, help="Number of tone files to generate if no input files")
+parser.add_argument('-count', dest="COUNT", default=10000, type=int, help="Number of instructions")
+parser.add_argument('-clips', dest="CLIPS", default=100, type=int, help="Number of unique clips per file")
+parser.add_argument('-dur', dest="DURATION", default=60, type=float, help="Duration of the mix in seconds")
+parser.add_argument('-mixers', dest="MIXERS", default="pydub,numpy", help="Mixers to compare")
+parser.add_argument('-procs', dest="PROCESSES", default=1, type=int, help="Processes for mixing tracks in parallel (NumPy mixer only)")
+parser.add_argument('-tracks', dest="OUTPUT_TRACKS", action="store_true", help="Also write each track on its own?")
+parser.add_argument('-reverb', dest="REVERB_EVERY", default=0, type=int, help="Add reverb to every nth instruction, 0 for none")
+parser.add_argument('-fxbackend', dest="FX_BACKEND", default="sox", help="Sound fx backend: sox or scipy")
+parser.add_argument('-fxcache', dest="FX_CACHE", action="store_true", help="Cache clips processed with sound fx?")
+parser.add_argument('-store', dest="STORE_DIR", default="", help="Read decoded audio from an audio store in this directory, e.g. tmp/cache/audio/")
+parser.add_argument('-out', dest="OUTPUT_DIR", default="output/audio_mixer_test/", help="Output directory")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+makeDirectories([a.OUTPUT_DIR])
+rng = np.random.RandomState(a.SEED)
+sampleRate = 48000
+duration = roundInt(a.DURATION * 1000)
+
+filenames = [fn.strip() for fn in a.INPUT_FILES.split(",") if len(fn.strip()) > 0]
+if len(filenames) < 1:
+    for i in range(a.FILES):
+        filename = os.path.join(a.OUTPUT_DIR, "tone_%s.wav" % (i+1))
+        t = np.arange(sampleRate * 10) / sampleRate
+        left = np.sin(2.0 * np.pi * 110.0 * (i+1) * t) * 0.25 + rng.uniform(-0.05, 0.05, len(t))
+        right = np.sin(2.0 * np.pi * 165.0 * (i+1) * t) * 0.25 + rng.uniform(-0.05, 0.05, len(t))
+        data = np.round(np.stack([left, right], axis=1) * 32767).astype(np.int16)
+        AudioSegment(data=data.tobytes(), sample_width=2, frame_rate=sampleRate, channels=2).export(filename, format="wav")
+        filenames.append(filename)
+
+# a random sequence that plays a limited number of clips from each file many times, quiet enough that pydub does not
+# clip partway through the mix (it saturates each overlay, the NumPy mixer only saturates the final mix)
+clips = []
+for filename in filenames:
+    fileDuration = len(getAudio(filename, verbose=False))
+    for i in range(a.CLIPS):
+        dur = rng.randint(50, 2000)
+        clips.append((filename, rng.randint(0, max(1, fileDuration - dur)), dur))
+instructions = []
+for i in range(a.COUNT):
+    filename, start, dur = clips[rng.randint(0, len(clips))]
+    instruction = {
+        "ms": rng.randint(0, duration),
+        "filename": filename,
+        "start": start,
+        "dur": dur,
+        "volume": rng.uniform(0.02, 0.2),
+        "pan": rng.uniform(-1.0, 1.0) if i % 2 > 0 else 0.0,
+        "fadeIn": rng.randint(0, dur // 2),
+        "fadeOut": rng.randint(0, dur // 2),
+        "reverse": (i % 7 == 0)
+    }
+    if i % 5 == 0:
+        instruction["matchDb"] = -24
+    if a.REVERB_EVERY > 0 and i % a.REVERB_EVERY == 0:
+        instruction["reverb"] = 80
+    instructions.append(instruction)
+
+audioStore = AudioStore(a.STORE_DIR) if len(a.STORE_DIR) > 0 else None
+results = {}
+for mixer in a.MIXERS.split(","):
+    outfilename = os.path.join(a.OUTPUT_DIR, "mix_%s.wav" % mixer)
+    start = time.time()
+    fxCache = FxCache() if a.FX_CACHE else None
+    mixAudio([dict(i) for i in instructions], duration, outfilename, sfx=(a.REVERB_EVERY > 0), mixer=mixer, audioStore=audioStore, fxCache=fxCache, fxBackend=a.FX_BACKEND, processes=a.PROCESSES, outputTracks=a.OUTPUT_TRACKS, tracksDir=os.path.join(a.OUTPUT_DIR, "track_%s_" % mixer + "%s.wav"))
+    elapsed = time.time() - start
+    print("%s: %.2fs" % (mixer, elapsed))
+    results[mixer] = (elapsed, audioSegmentToSamples(AudioSegment.from_file(outfilename)))
+
+if "pydub" in results and "numpy" in results:
+    pydubTime, pydubSamples = results["pydub"]
+    numpyTime, numpySamples = results["numpy"]
+    diff = (pydubSamples.astype(np.float64) - numpySamples.astype(np.float64)) * 32768
+    print("NumPy is %.2fx the speed of pydub" % (pydubTime / numpyTime))
+    # pydub rounds down after every gain it applies, so dense mixes drift below the NumPy mix by a constant offset
+    print("Difference in 16-bit steps: %.2f offset, %.2f deviation, %.2f max" % (diff.mean(), diff.std(), np.abs(diff).max()))
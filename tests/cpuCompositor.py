@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks the NumPy compositor against the OpenCL compositor (e.g. the pocl CPU runtime on machines without a GPU)
+# python3 tests/cpuCompositor.py -clips 256 -frames 10
+# python3 tests/cpuCompositor.py -clips 10000 -frames 3 -threads 4
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.cpu_utils import *
+from lib.gpu_utils import *
+from lib.math_utils import *
+from multiprocessing.dummy import Pool as ThreadPool
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-width', dest="WIDTH", default=1920, type=int, help="Output width")
+parser.add_argument('-height', dest="HEIGHT", default=1080, type=int, help="Output height")
+parser.add_argument('-clips', dest="CLIPS", default=256, type=int, help="Number of clips per frame")
+parser.add_argument('-frames', dest="FRAMES", default=10, type=int, help="Number of frames to render with each compositor")
+parser.add_argument('-colors', dest="COLORS", default=3, type=int, help="Color dimensions: 3 or 4")
+parser.add_argument('-precision', dest="PRECISION", default=3, type=int, help="Precision of clip properties")
+parser.add_argument('-tile', dest="TILE_SIZE", default=128, type=int, help="Tile size for the tiled NumPy compositor")
+parser.add_argument('-threads', dest="THREADS", default=1, type=int, help="Threads for drawing tiles")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+precisionMultiplier = int(10 ** a.PRECISION)
+rng = np.random.RandomState(a.SEED)
+cols = int(math.sqrt(a.CLIPS))
+rows = ceilInt(1.0 * a.CLIPS / cols)
+cellW = 1.0 * a.WIDTH / cols
+cellH = 1.0 * a.HEIGHT / rows
+
+# a grid of clips that drift, scale, and overlap a little from frame to frame
+def getFrameData(frame):
+    properties = np.zeros((a.CLIPS, 10), dtype=np.int32)
+    pixels = []
+    offset = 0
+    for i in range(a.CLIPS):
+        col = i % cols
+        row = int(i / cols)
+        w = rng.randint(32, 160)
+        h = rng.randint(18, 90)
+        pixels.append(rng.randint(0, 256, size=w*h*a.COLORS).astype(np.uint8))
+        tw = cellW * (1.0 + 0.2 * math.sin(frame * 0.1 + i))
+        th = cellH * (1.0 + 0.2 * math.sin(frame * 0.1 + i))
+        x = col * cellW - (tw - cellW) * 0.5 + frame * 0.37
+        y = row * cellH - (th - cellH) * 0.5 + frame * 0.21
+        alpha = 1.0 if i % 5 > 0 else 0.6
+        brightness = 1.0 if i % 3 > 0 else 0.8
+        properties[i] = np.array([offset, roundInt(x*precisionMultiplier), roundInt(y*precisionMultiplier), w, h, roundInt(tw*precisionMultiplier), roundInt(th*precisionMultiplier), roundInt(alpha*precisionMultiplier), i+1, roundInt(brightness*precisionMultiplier)])
+        offset += w*h*a.COLORS
+    return (np.concatenate(pixels), properties)
+
+frames = [getFrameData(frame) for frame in range(a.FRAMES)]
+
+start = time.time()
+gpuProgram = loadMakeImageProgram(a.WIDTH, a.HEIGHT, 10, a.COLORS, a.PRECISION)
+print("Compiled OpenCL program in %.3fs" % (time.time() - start))
+
+results = []
+start = time.time()
+for pixelData, properties in frames:
+    results.append(clipsToImageGPU(a.WIDTH, a.HEIGHT, pixelData, properties, a.COLORS, a.PRECISION, gpuProgram=gpuProgram))
+gpuTime = time.time() - start
+print("OpenCL: %.3fs per frame" % (gpuTime / a.FRAMES))
+
+maxDiff = 0
+diffPixels = 0
+cpuResults = []
+start = time.time()
+for i, frame in enumerate(frames):
+    pixelData, properties = frame
+    pixels = clipsToImageCPU(a.WIDTH, a.HEIGHT, pixelData, properties, a.COLORS, a.PRECISION)
+    cpuResults.append(pixels)
+    diff = np.abs(pixels.astype(np.int32) - results[i].astype(np.int32))
+    maxDiff = max(maxDiff, diff.max())
+    diffPixels += np.count_nonzero(diff.max(axis=2))
+cpuTime = time.time() - start
+print("NumPy: %.3fs per frame" % (cpuTime / a.FRAMES))
+print("NumPy is %.2fx the speed of OpenCL" % (gpuTime / cpuTime))
+print("Max channel difference: %s (%s pixels differ)" % (maxDiff, diffPixels))
+
+# the tiled compositor should match the NumPy compositor exactly
+pool = ThreadPool(a.THREADS) if a.THREADS > 1 else None
+diffPixels = 0
+start = time.time()
+for i, frame in enumerate(frames):
+    pixelData, properties = frame
+    pixels = clipsToImageTilesCPU(a.WIDTH, a.HEIGHT, pixelData, properties, a.COLORS, a.PRECISION, tileSize=a.TILE_SIZE, pool=pool)
+    diffPixels += np.count_nonzero(np.any(pixels != cpuResults[i], axis=2))
+tileTime = time.time() - start
+if pool is not None:
+    pool.close()
+print("NumPy tiles: %.3fs per frame (%.2fx the speed of drawing one clip at a time)" % (tileTime / a.FRAMES, cpuTime / tileTime))
+print("%s pixels differ from drawing one clip at a time" % diffPixels)
@@ -6,6 +6,7 @@
 # python3 tests/fx.py -effect bass -amounts " -20,-10,-5,5,10,20" -out output/bass_test.mp3
 # python3 tests/fx.py -effect echo -amounts "10,50,100,500,1000" -out output/echo_test.mp3
 # python3 tests/fx.py -effect bass -amounts " -20,-10,-5,5,10,20,-20:50,-10:50,-5:50,5:50,10:50,20:50" -out output/lowpass_test.mp3
+# python3 tests/fx.py -effect reverb -backend scipy -out output/reverb_scipy_test.mp3
 
 import argparse
 import inspect
@@ -28,6 +29,7 @@ parser.add_argument('-dur', dest="CLIP_DUR", default=450, type=int, help="Clip d
 parser.add_argument('-effect', dest="EFFECT", default="reverb", help="Effect name")
 parser.add_argument('-amounts', dest="AMOUNTS", default="20,40,60,80,100", help="Effect amounts")
 parser.add_argument('-pad', dest="PAD", default=3000, type=int, help="Amount to pad in ms")
+parser.add_argument('-backend', dest="BACKEND", default="sox", help="Sound fx backend: sox or scipy")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="output/reverb_test.mp3", help="Output media file")
 args = parser.parse_args()
 
@@ -65,9 +67,9 @@ audio += clip + AudioSegment.silent(duration=pad)
 
 for amount in amounts:
     if effect=="echo":
-        audio += addFx(clip, [(effect, (amount, 3))], pad=pad)
+        audio += addFx(clip, [(effect, (amount, 3))], pad=pad, backend=args.BACKEND)
     else:
-        audio += addFx(clip, [(effect, amount)], pad=pad)
+        audio += addFx(clip, [(effect, amount)], pad=pad, backend=args.BACKEND)
     print("Processed %s %s" % (effect, amount))
 
 fformat = outputFile.split(".")[-1]
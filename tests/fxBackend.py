@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks the sox and scipy sound fx backends on random clips and compares their output per effect
+# python3 tests/fxBackend.py -count 100
+# python3 tests/fxBackend.py -in "media/sample/chromatic_scale_piano_c4-b4.wav" -effects "reverb:80,lowpass:400,echo:100" -count 50
+# python3 tests/fxBackend.py -backends scipy -count 500
+
+import argparse
+import inspect
+import numpy as np
+import os
+from pprint import pprint
+from pydub import AudioSegment
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.audio_utils import *
+from lib.io_utils import *
+from lib.math_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILE", default="", help="Audio file to take clips from; leave blank to generate a tone")
+parser.add_argument('-effects', dest="EFFECTS", default="reverb:50,reverb:90,distortion:20,highpass:500,lowpass:400,bass:-20,echo:100,tempo:1.5", help="Comma-separated list of effect:amount")
+parser.add_argument('-count', dest="COUNT", default=100, type=int, help="Number of clips per effect")
+parser.add_argument('-dur', dest="CLIP_DUR", default=500, type=int, help="Max clip duration in ms")
+parser.add_argument('-pad', dest="PAD", default=3000, type=int, help="Amount to pad in ms")
+parser.add_argument('-backends', dest="BACKENDS", default="sox,scipy", help="Backends to compare")
+parser.add_argument('-out', dest="OUTPUT_DIR", default="output/fx_backend_test/", help="Output directory")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+makeDirectories([a.OUTPUT_DIR])
+rng = np.random.RandomState(a.SEED)
+sampleRate = 48000
+
+filename = a.INPUT_FILE
+if len(filename) < 1:
+    filename = os.path.join(a.OUTPUT_DIR, "tone.wav")
+    t = np.arange(sampleRate * 10) / sampleRate
+    left = np.sin(2.0 * np.pi * 220.0 * t) * 0.25 + rng.uniform(-0.05, 0.05, len(t))
+    right = np.sin(2.0 * np.pi * 330.0 * t) * 0.25 + rng.uniform(-0.05, 0.05, len(t))
+    data = np.round(np.stack([left, right], axis=1) * 32767).astype(np.int16)
+    AudioSegment(data=data.tobytes(), sample_width=2, frame_rate=sampleRate, channels=2).export(filename, format="wav")
+audio = getAudio(filename, verbose=False)
+
+clips = []
+for i in range(a.COUNT):
+    dur = rng.randint(50, a.CLIP_DUR)
+    start = rng.randint(0, max(1, len(audio) - dur))
+    clips.append(getAudioClip(audio, start, dur))
+
+backends = a.BACKENDS.split(",")
+for effectStr in a.EFFECTS.split(","):
+    effect, amount = tuple(effectStr.split(":"))
+    amount = parseNumber(amount)
+    outputs = {}
+    for backend in backends:
+        start = time.time()
+        outputs[backend] = [addFx(clip, [(effect, amount)], pad=a.PAD, backend=backend) for clip in clips]
+        elapsed = time.time() - start
+        print("%s %s: %.2fs (%.1f clips/s)" % (effectStr, backend, elapsed, len(clips) / elapsed))
+        outputs[backend][0].export(os.path.join(a.OUTPUT_DIR, "%s_%s_%s.wav" % (effect, amount, backend)), format="wav")
+    if "sox" in outputs and "scipy" in outputs:
+        diffs = []
+        for soxAudio, scipyAudio in zip(outputs["sox"], outputs["scipy"]):
+            soxSamples = audioSegmentToSamples(soxAudio, sampleRate, 2)
+            scipySamples = audioSegmentToSamples(scipyAudio, sampleRate, 2)
+            frameCount = min(len(soxSamples), len(scipySamples))
+            diff = soxSamples[:frameCount] - scipySamples[:frameCount]
+            diffs.append(getSampleLevels(diff)[0] / max(getSampleLevels(soxSamples[:frameCount])[0], 1e-9))
+        # the rms of the difference relative to the rms of the sox output
+        print("%s difference: %.1f%% mean, %.1f%% max" % (effectStr, np.mean(diffs) * 100.0, np.max(diffs) * 100.0))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Benchmarks the persistent GPU compositor (device frame atlas + cached program binaries) against uploading all pixel data every frame
+# python3 tests/gpuCompositor.py -clips 256 -frames 20
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.gpu_compositor import *
+from lib.gpu_utils import *
+from lib.io_utils import *
+from lib.math_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-width', dest="WIDTH", default=1920, type=int, help="Output width")
+parser.add_argument('-height', dest="HEIGHT", default=1080, type=int, help="Output height")
+parser.add_argument('-clips', dest="CLIPS", default=256, type=int, help="Number of clips per frame")
+parser.add_argument('-cframes', dest="CLIP_FRAMES", default=24, type=int, help="Number of frames of pixel data per clip")
+parser.add_argument('-frames', dest="FRAMES", default=20, type=int, help="Number of frames to render")
+parser.add_argument('-colors', dest="COLORS", default=3, type=int, help="Color dimensions: 3 or 4")
+parser.add_argument('-precision', dest="PRECISION", default=3, type=int, help="Precision of clip properties")
+parser.add_argument('-cd', dest="CACHE_DIR", default="tmp/cache/", help="Dir for caching compiled programs")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+makeDirectories([a.CACHE_DIR])
+precisionMultiplier = int(10 ** a.PRECISION)
+rng = np.random.RandomState(a.SEED)
+cols = int(math.sqrt(a.CLIPS))
+rows = ceilInt(1.0 * a.CLIPS / cols)
+cellW = 1.0 * a.WIDTH / cols
+cellH = 1.0 * a.HEIGHT / rows
+
+# every clip has a few frames of pixel data, like clipsPixelData
+clipsPixelData = []
+for i in range(a.CLIPS):
+    w = rng.randint(32, 160)
+    h = rng.randint(18, 90)
+    clipsPixelData.append([rng.randint(0, 256, size=(h, w, a.COLORS)).astype(np.uint8) for j in range(a.CLIP_FRAMES)])
+
+# a grid of clips that drift, scale, and cycle through their frames; every seventh clip uses pixels made just for that frame
+def getFrameData(frame, atlasOffsets=None):
+    properties = np.zeros((a.CLIPS, 10), dtype=np.int32)
+    pixels = []
+    offset = 0
+    for i in range(a.CLIPS):
+        col = i % cols
+        row = int(i / cols)
+        clipPixels = clipsPixelData[i][(frame + i) % a.CLIP_FRAMES]
+        h, w, _ = clipPixels.shape
+        tw = cellW * (1.0 + 0.2 * math.sin(frame * 0.1 + i))
+        th = cellH * (1.0 + 0.2 * math.sin(frame * 0.1 + i))
+        x = col * cellW - (tw - cellW) * 0.5 + frame * 0.37
+        y = row * cellH - (th - cellH) * 0.5 + frame * 0.21
+        alpha = 1.0 if i % 5 > 0 else 0.6
+        brightness = 1.0 if i % 3 > 0 else 0.8
+        pixelOffset = offset
+        if atlasOffsets is not None and i % 7 > 0:
+            pixelOffset = atlasOffsets[i][(frame + i) % a.CLIP_FRAMES][0]
+        else:
+            pixels.append(clipPixels.reshape(-1))
+            offset += w*h*a.COLORS
+            if atlasOffsets is not None:
+                pixelOffset = -pixelOffset-1
+        properties[i] = np.array([pixelOffset, roundInt(x*precisionMultiplier), roundInt(y*precisionMultiplier), w, h, roundInt(tw*precisionMultiplier), roundInt(th*precisionMultiplier), roundInt(alpha*precisionMultiplier), i+1, roundInt(brightness*precisionMultiplier)])
+    pixels = np.concatenate(pixels) if len(pixels) > 0 else np.zeros(0, dtype=np.uint8)
+    return (pixels, properties)
+
+start = time.time()
+gpuProgram = loadMakeImageProgram(a.WIDTH, a.HEIGHT, 10, a.COLORS, a.PRECISION)
+print("Built OpenCL program from source in %.3fs" % (time.time() - start))
+
+results = []
+start = time.time()
+for frame in range(a.FRAMES):
+    pixelData, properties = getFrameData(frame)
+    results.append(clipsToImageGPU(a.WIDTH, a.HEIGHT, pixelData, properties, a.COLORS, a.PRECISION, gpuProgram=gpuProgram))
+uploadTime = time.time() - start
+print("Uploading pixel data every frame: %.3fs per frame" % (uploadTime / a.FRAMES))
+
+start = time.time()
+compositor = GPUCompositor(a.WIDTH, a.HEIGHT, 10, a.COLORS, a.PRECISION, cacheDir=a.CACHE_DIR)
+print("Loaded compositor (cached program binaries if they exist) in %.3fs" % (time.time() - start))
+start = time.time()
+compositor.loadAtlas(clipsPixelData)
+print("Uploaded atlas in %.3fs" % (time.time() - start))
+
+diffPixels = 0
+start = time.time()
+for frame in range(a.FRAMES):
+    pixelData, properties = getFrameData(frame, compositor.atlasOffsets)
+    pixels = compositor.makeImage(properties, pixelData)
+    diffPixels += np.count_nonzero(np.any(pixels != results[frame], axis=2))
+atlasTime = time.time() - start
+print("Device atlas: %.3fs per frame" % (atlasTime / a.FRAMES))
+print("Device atlas is %.2fx the speed of uploading every frame" % (uploadTime / atlasTime))
+print("%s pixels differ" % diffPixels)
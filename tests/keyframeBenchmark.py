@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Compares Vector.getPropValue() with the previous linear keyframe scan for clips with many keyframes
+# python3 tests/keyframeBenchmark.py -keyframes 2000 -frames 2400
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.clip import *
+from lib.math_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-clips', dest="CLIPS", default=10, type=int, help="Number of clips")
+parser.add_argument('-keyframes', dest="KEYFRAMES", default=2000, type=int, help="Number of tweens per clip (each adds two keyframes per property)")
+parser.add_argument('-frames', dest="FRAMES", default=2400, type=int, help="Number of frames to evaluate")
+parser.add_argument('-fps', dest="FPS", default=24, type=int, help="Frames per second")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+rng = np.random.RandomState(a.SEED)
+durationMs = roundInt(1000.0 * a.FRAMES / a.FPS)
+tweenDur = max(1, roundInt(1.0 * durationMs / a.KEYFRAMES))
+properties = [("pos", 0), ("pos", 1), ("scale", 0), ("scale", 1), ("translate", 0), ("translate", 1), ("alpha", None), ("rotation", None), ("blur", None), ("brightness", None)]
+
+# the lookup before keyframes were split into tracks
+def getPropValueLinear(vector, name, dimension, ms):
+    value = getattr(vector, name)
+    if dimension is not None:
+        value = value[dimension]
+    keyframes = [k for k in vector.keyframes if k["name"]==name and (k["dimension"]==dimension or k["dimension"] is None or dimension is None)]
+    kcount = len(keyframes)
+    for i, kf in enumerate(keyframes):
+        if i >= kcount-1 and ms >= kf["ms"]:
+            value = kf["value"]
+            break
+        elif kf["ms"] > ms:
+            if i <= 0:
+                value = kf["value"]
+                break
+            kf0 = keyframes[i-1]
+            value = lerpEase((kf0["value"], kf["value"]), norm(ms, (kf0["ms"], kf["ms"])), kf["easing"])
+            break
+    return value
+
+clips = []
+for i in range(a.CLIPS):
+    clip = Clip({"index": i, "dur": 1000, "width": 100, "height": 100})
+    for j in range(a.KEYFRAMES):
+        # tweens overlap a little so keyframes aren't strictly sorted
+        ms = j * tweenDur + rng.randint(-tweenDur, tweenDur)
+        clip.queueTween(ms, tweenDur, [("translateX", rng.uniform(-50, 50), rng.uniform(-50, 50), "sin"), ("alpha", rng.uniform(0, 1), rng.uniform(0, 1))])
+    clips.append(clip)
+print("%s clips with %s keyframes each" % (a.CLIPS, len(clips[0].vector.keyframes)))
+
+sequentialMs = [roundInt(1000.0 * f / a.FPS) for f in range(a.FRAMES)]
+randomMs = [roundInt(ms) for ms in rng.uniform(-1000, durationMs+1000, a.FRAMES)]
+
+for label, msList in [("Sequential", sequentialMs), ("Random", randomMs)]:
+    start = time.time()
+    expected = [[getPropValueLinear(clip.vector, name, dimension, ms) for name, dimension in properties for clip in clips] for ms in msList]
+    linearTime = time.time() - start
+
+    start = time.time()
+    values = [[clip.vector.getPropValue(name, dimension, ms) for name, dimension in properties for clip in clips] for ms in msList]
+    trackTime = time.time() - start
+
+    mismatches = sum([1 for i, frameValues in enumerate(values) for j, value in enumerate(frameValues) if value != expected[i][j]])
+    print("%s: linear scan %.3fs, tracks %.3fs (%.1fx faster), %s mismatched values" % (label, linearTime, trackTime, linearTime / trackTime, mismatches))
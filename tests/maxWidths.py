@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Checks Timeline.getMaxWidths() against the largest width from evaluating every frame and compares how long each takes
+# python3 tests/maxWidths.py -clips 1000 -frames 2400
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.clip import *
+from lib.math_utils import *
+from lib.timeline import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-clips', dest="CLIPS", default=1000, type=int, help="Number of clips")
+parser.add_argument('-frames', dest="FRAMES", default=2400, type=int, help="Number of frames to evaluate")
+parser.add_argument('-width', dest="WIDTH", default=1920, type=int, help="Container width")
+parser.add_argument('-height', dest="HEIGHT", default=1080, type=int, help="Container height")
+parser.add_argument('-fps', dest="FPS", default=24, type=int, help="Frames per second")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+rng = np.random.RandomState(a.SEED)
+easings = ["linear", "sin", "quadInOut", "cubicIn", "expOut^3", "sinInvert"]
+durationMs = roundInt(1000.0 * a.FRAMES / a.FPS)
+
+container = Clip({"width": a.WIDTH, "height": a.HEIGHT, "cache": True})
+container.queueTween(0, durationMs/2, ("scale", 1.0, 2.0, "sin"))
+container.queueTween(durationMs/2, durationMs/2, ("scale", 2.0, 1.0, "sin"))
+
+clips = []
+for i in range(a.CLIPS):
+    clip = Clip({
+        "start": rng.randint(0, 60000),
+        "dur": rng.randint(200, 3000),
+        "index": i,
+        "width": rng.uniform(10, 200),
+        "height": rng.uniform(10, 200),
+        "x": rng.uniform(-500, 2000),
+        "y": rng.uniform(-500, 1200),
+        "plays": []
+    })
+    clip.vector.setParent(container.vector)
+    ms = 0
+    for j in range(rng.randint(0, 8)):
+        ms += rng.randint(0, roundInt(durationMs/4))
+        dur = rng.randint(0, roundInt(durationMs/4))
+        easing = easings[rng.randint(len(easings))]
+        r = rng.rand()
+        if r < 0.5:
+            clip.queueTween(ms, dur, ("scale", rng.uniform(0, 1), rng.uniform(0, 1.5), easing))
+        elif r < 0.8:
+            clip.queueTween(ms, dur, ("translateX", rng.uniform(-1000, 1000), rng.uniform(-1000, 1000), easing))
+        else:
+            clip.queueTween(ms, dur, ("alpha", rng.uniform(0, 1), rng.uniform(0, 1), easing))
+        # tweens one after another, since the visibility of clips with keyframes out of order can't be bounded
+        ms += dur
+    clips.append(clip)
+
+msList = [roundInt(1000.0 * f / a.FPS) for f in range(a.FRAMES)]
+
+# the same container as processComposition(), so clips outside it don't count
+start = time.time()
+timeline = Timeline(clips, a.WIDTH, a.HEIGHT)
+sampled = np.amax(timeline.toNpArrs(msList)[:,:,2], axis=0)
+sampledTime = time.time() - start
+print("Every frame: %.3fs" % sampledTime)
+
+start = time.time()
+timeline = Timeline(clips, a.WIDTH, a.HEIGHT)
+analytic = timeline.getMaxWidths(msList[0], msList[-1])
+analyticTime = time.time() - start
+print("Analytic: %.3fs" % analyticTime)
+print("Analytic is %.1fx faster" % (sampledTime / analyticTime))
+
+smaller = np.argwhere(analytic < sampled).reshape(-1)
+print("%s clips smaller than the sampled max" % len(smaller))
+for i in smaller[:10]:
+    print("clip %s: %s < %s" % (i, analytic[i], sampled[i]))
+# clips that are never visible in a frame have no sampled width to compare to
+hidden = sampled <= 0
+print("%s clips not visible in any frame, %s of them with an analytic width (up to %s)" % (np.count_nonzero(hidden), np.count_nonzero(analytic[hidden] > 0), np.amax(analytic[hidden]) if np.any(hidden) else 0))
+differences = 1.0 * (analytic - sampled)[~hidden] / sampled[~hidden]
+print("Analytic is up to %.3f%% larger (%.3f%% on average)" % (np.amax(differences) * 100.0, np.mean(differences) * 100.0))
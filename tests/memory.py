@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+# Fills memory with pixel data until it runs out, or with -pixelmem, checks that a pixel provider streaming a grid of clips
+# keeps no more than that much pixel data in memory
+# python3 tests/memory.py -mat 1000
+# python3 tests/memory.py -pixelmem 0.05 -clips 64 -frames 240
+# python3 tests/memory.py -pixelmem 0.05 -clips 64 -frames 240 -chunk 20
+
 import argparse
 import inspect
 import math
@@ -13,14 +19,88 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
+from lib.clip import *
+from lib.frame_store import *
 from lib.io_utils import *
 from lib.math_utils import *
+from lib.pixel_provider import *
+from lib.timeline import *
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-max', dest="MAX_ITERATIONS", default=1000, type=int, help="Maximum times to iterate (otherwise will crash at some point)")
 parser.add_argument('-mat', dest="MATRIX_D", default=1000, type=int, help="Dimension of the matrix to be squared")
+parser.add_argument('-pixelmem', dest="PIXEL_MEMORY", default=-1, type=float, help="If set, check a pixel provider against this memory budget in GB instead")
+parser.add_argument('-pixelwin', dest="PIXEL_WINDOW", default=48, type=int, help="Number of upcoming frames to prefetch")
+parser.add_argument('-clips', dest="CLIPS", default=64, type=int, help="Number of clips in the grid")
+parser.add_argument('-frames', dest="FRAMES", default=240, type=int, help="Number of output frames")
+parser.add_argument('-size', dest="CLIP_SIZE", default=160, type=int, help="Width and height of each clip's frames")
+parser.add_argument('-fps', dest="FPS", default=24, type=int, help="Frames per second")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=0, type=int, help="Prefetch chunks of this many frames in a random order, like render worker processes; 0 for all frames in order")
+parser.add_argument('-out', dest="OUTPUT_DIR", default="tmp/memory_test/", help="Directory for the test frame stores")
 a = parser.parse_args()
 
+if a.PIXEL_MEMORY > 0:
+    makeDirectories([a.OUTPUT_DIR])
+    budget = roundInt(a.PIXEL_MEMORY * 1000000000)
+    durationMs = roundInt(1000.0 * a.FRAMES / a.FPS)
+    msStep = 1000.0 / a.FPS
+    cols = ceilInt(math.sqrt(a.CLIPS))
+    width = height = cols * a.CLIP_SIZE
+
+    # each clip plays its own source for a random stretch of the composition, one frame of pixels per output frame
+    rng = np.random.RandomState(3)
+    clips = []
+    stores = []
+    clipSources = []
+    for i in range(a.CLIPS):
+        start = rng.randint(0, roundInt(durationMs * 0.75))
+        dur = rng.randint(roundInt(durationMs * 0.1), durationMs - start + 1)
+        clips.append(Clip({"start": start, "dur": dur, "index": i, "width": a.CLIP_SIZE, "height": a.CLIP_SIZE, "x": (i % cols) * a.CLIP_SIZE, "y": int(i / cols) * a.CLIP_SIZE, "plays": []}))
+        store = FrameStore(a.OUTPUT_DIR + "clip%s" % i)
+        store.remove()
+        times = [roundInt(ms) for ms in np.arange(start, start + dur, msStep)]
+        store.appendFrames([(t, np.full((a.CLIP_SIZE, a.CLIP_SIZE, 3), i % 256, dtype=np.uint8)) for t in times])
+        stores.append((store, []))
+        clipSources.append((i, times))
+    totalBytes = sum([len(times) for i, times in clipSources]) * a.CLIP_SIZE * a.CLIP_SIZE * 3
+
+    timeline = Timeline(clips, width, height)
+    msList = [roundInt(f * msStep) for f in range(a.FRAMES)]
+    provider = PixelProvider(stores, clipSources, budget, a.PIXEL_WINDOW)
+    # like a render worker process, prefetch each chunk of frames as it's rendered, in any order
+    chunkSize = a.CHUNK_SIZE if a.CHUNK_SIZE > 0 else len(msList)
+    chunks = [msList[i:i+chunkSize] for i in range(0, len(msList), chunkSize)]
+    if len(chunks) > 1:
+        rng.shuffle(chunks)
+    properties = [p[0] for p in Clip.npProperties]
+    precisionMultiplier = 1000.0
+    peakBytes = 0
+    f = 0
+    for chunk in chunks:
+        provider.start(chunk, timeline.toNpArrs)
+        for ms in chunk:
+            provider.beginFrame(ms)
+            arr = timeline.toNpArrs([ms])[0]
+            # draw every visible clip like clipsToFrameGPU() does
+            for clipIndex in np.nonzero((arr[:, properties.index("width")] > 0) & (arr[:, properties.index("alpha")] > 0))[0]:
+                frames = provider[clipIndex]
+                frames[roundInt(arr[clipIndex, properties.index("tn")] / precisionMultiplier * (len(frames)-1))]
+            peakBytes = max(peakBytes, provider.bytes)
+            provider.endFrame(ms)
+            f += 1
+            sys.stdout.write('\r')
+            sys.stdout.write("%s: %s MB" % (f, round(provider.bytes / 1000000.0, 1)))
+            sys.stdout.flush()
+    provider.stop()
+    print("")
+    print(provider.getStats())
+    print("Peak pixel data: %s MB of a %s MB budget (%s MB if every frame was kept in memory)" % (round(max(peakBytes, provider.maxBytes) / 1000000.0, 1), round(budget / 1000000.0, 1), round(totalBytes / 1000000.0, 1)))
+    if provider.maxBytes > budget:
+        print("Failed: pixel data went over budget")
+        sys.exit(1)
+    print("Done.")
+    sys.exit()
+
 MATRIX_W = a.MATRIX_D
 MATRIX_H = a.MATRIX_D
 FILL_COLOR = (255,0,0)
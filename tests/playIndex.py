@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Checks that getClipTime gives the same times with the play index as a linear scan of plays and compares how long each takes
+# python3 tests/playIndex.py -clips 200 -plays 500 -frames 240
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.clip import *
+from lib.math_utils import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-clips', dest="CLIPS", default=200, type=int, help="Number of clips")
+parser.add_argument('-plays', dest="PLAYS", default=500, type=int, help="Max number of plays per clip")
+parser.add_argument('-frames', dest="FRAMES", default=240, type=int, help="Number of frames to evaluate")
+parser.add_argument('-fps', dest="FPS", default=24, type=int, help="Frames per second")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+rng = np.random.RandomState(a.SEED)
+durationMs = roundInt(1000.0 * a.FRAMES / a.FPS)
+
+# the way getClipTime used to find the active or closest play
+def getClipTimeLinear(clip, ms):
+    plays = [t for t in clip.plays if t[0] <= ms <= t[1]]
+    start = clip.initialOffset
+    if len(plays) > 0:
+        start, end, params = plays[0]
+    elif len(clip.plays) > 0:
+        plays = sorted(clip.plays, key=lambda p: abs(ms - lerp((p[0], p[1]), 0.5)))
+        start, end, params = plays[0]
+        if ms < clip.plays[0][0] or ms > clip.plays[-1][1]:
+            start = clip.initialOffset
+    remainder = (ms - start) % int(clip.dur*2)
+    if remainder > clip.dur:
+        remainder -= clip.dur
+        remainder = clip.dur - remainder - 1
+    remainder = lim(remainder, (0, clip.dur-1))
+    return roundInt(clip.start + remainder)
+
+clips = []
+for i in range(a.CLIPS):
+    clip = Clip({
+        "start": rng.randint(0, 60000),
+        "dur": rng.randint(200, 3000),
+        "initialOffset": rng.randint(0, 1000),
+        "plays": []
+    })
+    ms = 0
+    for j in range(rng.randint(0, a.PLAYS)):
+        ms += rng.randint(0, roundInt(2.0 * durationMs / a.PLAYS))
+        clip.queuePlay(ms, {"dur": rng.randint(20, 1200)})
+    clips.append(clip)
+
+msList = [roundInt(1000.0 * f / a.FPS) for f in range(a.FRAMES)]
+
+start = time.time()
+expected = [[getClipTimeLinear(clip, ms) for clip in clips] for ms in msList]
+linearTime = time.time() - start
+print("Linear scan: %.3fs" % linearTime)
+
+start = time.time()
+times = [[clip.getClipTime(ms) for clip in clips] for ms in msList]
+indexTime = time.time() - start
+print("Play index: %.3fs (%.1fx faster)" % (indexTime, linearTime / indexTime))
+
+start = time.time()
+for clip in clips:
+    clip.setPlaySchedule(msList)
+scheduleTimes = [[clip.getClipTime(ms) for clip in clips] for ms in msList]
+scheduleTime = time.time() - start
+print("Play schedule: %.3fs (%.1fx faster)" % (scheduleTime, linearTime / scheduleTime))
+
+# changing a clip's offset or plays after scheduling it should drop the schedule
+for clip in clips:
+    clip.setInitialOffset(clip.initialOffset + rng.randint(1, 1000))
+    if len(clip.plays) > 0 and rng.random_sample() < 0.5:
+        clip.setPlays([(p[0] + 100, p[1] + 100, p[2]) for p in clip.plays])
+changedExpected = [[getClipTimeLinear(clip, ms) for clip in clips] for ms in msList]
+changedTimes = [[clip.getClipTime(ms) for clip in clips] for ms in msList]
+
+mismatches = [(ms, j) for i, ms in enumerate(msList) for j in range(len(clips)) if times[i][j] != expected[i][j] or scheduleTimes[i][j] != expected[i][j] or changedTimes[i][j] != changedExpected[i][j]]
+print("%s mismatched times" % len(mismatches))
+for ms, j in mismatches[:10]:
+    print("ms %s, clip %s: %s != %s" % (ms, j, clips[j].getClipTime(ms), getClipTimeLinear(clips[j], ms)))
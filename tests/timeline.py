@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Checks that Timeline gives the same clip arrays as clipsToNpArr and compares how long each takes
+# python3 tests/timeline.py -clips 1000 -frames 240
+
+import argparse
+import inspect
+import math
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+
+# add parent directory to sys path to import relative modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from lib.clip import *
+from lib.math_utils import *
+from lib.timeline import *
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-width', dest="WIDTH", default=1920, type=int, help="Container width")
+parser.add_argument('-height', dest="HEIGHT", default=1080, type=int, help="Container height")
+parser.add_argument('-clips', dest="CLIPS", default=1000, type=int, help="Number of clips")
+parser.add_argument('-frames', dest="FRAMES", default=240, type=int, help="Number of frames to evaluate")
+parser.add_argument('-fps', dest="FPS", default=24, type=int, help="Frames per second")
+parser.add_argument('-seed', dest="SEED", default=3, type=int, help="Random seed")
+a = parser.parse_args()
+
+rng = np.random.RandomState(a.SEED)
+easings = ["linear", "sin", "quadInOut", "cubicIn", "expOut^3", "sinInvert"]
+durationMs = roundInt(1000.0 * a.FRAMES / a.FPS)
+
+container = Clip({"width": a.WIDTH, "height": a.HEIGHT, "cache": True})
+container.queueTween(0, durationMs/2, ("scale", 1.0, 2.0, "sin"))
+container.queueTween(durationMs/2, durationMs/2, [("translateX", 0, -a.WIDTH*0.25), ("scale", 2.0, 1.0, "sin")])
+
+clips = []
+for i in range(a.CLIPS):
+    clip = Clip({
+        "start": rng.randint(0, 60000),
+        "dur": rng.randint(200, 3000),
+        "index": i,
+        "width": rng.uniform(10, 200),
+        "height": rng.uniform(10, 200),
+        "x": rng.uniform(-100, a.WIDTH),
+        "y": rng.uniform(-100, a.HEIGHT),
+        "plays": []
+    })
+    clip.vector.setParent(container.vector)
+    ms = 0
+    for j in range(rng.randint(0, 8)):
+        ms += rng.randint(0, roundInt(durationMs/4))
+        dur = rng.randint(0, roundInt(durationMs/4))
+        tweens = [(name, rng.uniform(-50, 50), rng.uniform(-50, 50), easings[rng.randint(len(easings))]) for name in ["translateX", "translateY"]]
+        tweens += [(name, rng.uniform(0, 1), rng.uniform(0, 1.5), easings[rng.randint(len(easings))]) for name in ["alpha", "scale", "brightness", "rotation"] if rng.rand() < 0.3]
+        clip.queueTween(ms, dur, tweens)
+    ms = 0
+    for j in range(rng.randint(0, 20)):
+        ms += rng.randint(0, roundInt(durationMs/10))
+        clip.queuePlay(ms, {"dur": rng.randint(50, 1200)})
+    clips.append(clip)
+
+msList = [roundInt(1000.0 * f / a.FPS) for f in range(a.FRAMES)]
+
+start = time.time()
+expected = np.array([clipsToNpArr(clips, ms, a.WIDTH, a.HEIGHT) for ms in msList])
+clipsTime = time.time() - start
+print("clipsToNpArr: %.3fs" % clipsTime)
+
+start = time.time()
+timeline = Timeline(clips, a.WIDTH, a.HEIGHT)
+compileTime = time.time() - start
+arrs = timeline.toNpArrs(msList)
+timelineTime = time.time() - start
+print("Timeline: %.3fs (%.3fs to compile)" % (timelineTime, compileTime))
+print("Timeline is %.1fx faster" % (clipsTime / timelineTime))
+
+mismatches = np.argwhere(arrs != expected)
+print("%s mismatched values" % len(mismatches))
+for frame, clip, prop in mismatches[:10]:
+    print("ms %s, clip %s, %s: %s != %s" % (msList[frame], clip, Clip.npProperties[prop][0], arrs[frame, clip, prop], expected[frame, clip, prop]))